@@ -1,17 +1,36 @@
+import asyncio
+from contextlib import aclosing
 import logging
-import requests
-from bs4 import BeautifulSoup
-from transformers import pipeline
-
-# Configure logging
-logging.basicConfig(filename='error_log.txt', level=logging.ERROR, 
+import instrumentation
+from chunking import TokenChunker
+from dedup import get_fingerprint_index
+from extraction import extract_text, iter_paragraphs
+from fetching import Fetcher
+from http_cache import get_http_cache
+from link_rules import find_article_links
+from models import SUMMARIZATION_MODEL
+from pipeline import Pipeline, iterate_sync
+from scheduling import get_scheduler
+from summarization import DEFAULT_BATCH_SIZE, DEFAULT_TARGET_WORDS
+from summary_cache import get_summary_cache
+from worker_pool import get_shared_summarizer
+from writers import write_resources
+
+# Configure logging; progress messages and per-query timings are kept while instrumenting
+logging.basicConfig(filename='error_log.txt', level=logging.INFO if instrumentation.enabled else logging.ERROR, 
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
 # Lists of sites based on scraping method
 direct_access_sites = {
     "Wikipedia": {
         "url": "https://en.wikipedia.org/w/index.php?search=",
-        "query_format": lambda query: query.replace(" ", "+")
+        "query_format": lambda query: query.replace(" ", "+"),
+        "links": {
+            "base": "https://en.wikipedia.org",
+            "prefixes": ["/wiki/"],
+            # Namespaced pages (Special:, Help:, Category:, ...) are not articles
+            "exclude": [r":"],
+        },
     },
     
 }
@@ -20,23 +39,48 @@ direct_access_sites = {
 traversal_sites = {
     "Medium": {
         "url": "https://medium.com/search?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://medium.com",
+            "prefixes": ["https://medium.com/"],
+            "exclude": [r"^/$", r"^/(tag|tags|topic|search|m|membership|plans)(/|$)"],
+        },
     },
     "Dev.to": {
         "url": "https://dev.to/search?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://dev.to",
+            # Articles live at /<author>/<slug>
+            "patterns": [r"https://dev\.to/[^/?#]+/[^/?#]+"],
+            "exclude": [r"^/(t|search|enter|settings|tags|about)(/|$)"],
+        },
     },
     "GeeksforGeeks": {
         "url": "https://www.geeksforgeeks.org/search/?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://www.geeksforgeeks.org",
+            "prefixes": ["/articles/", "/geeks/"],
+        },
     },
     "Tutorialspoint": {
         "url": "https://www.tutorialspoint.com/search/index.htm?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://www.tutorialspoint.com",
+            "prefixes": ["/tutorials/", "https://www.tutorialspoint.com/"],
+            "exclude": [r"^/$", r"^/index\.htm$", r"^/(about|search)(/|$)"],
+        },
     },
     "Stack Overflow": {
         "url": "https://stackoverflow.com/search?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://stackoverflow.com",
+            # Only numbered questions; /questions/tagged/... and /questions/ask are listings and forms
+            "patterns": [r"(https://stackoverflow\.com)?/questions/\d+"],
+        },
     },
     "W3Schools": {
         "url": "https://www.w3schools.com/#gsc.tab=0&gsc.q=",
@@ -44,154 +88,109 @@ traversal_sites = {
     },
 }
 
-def split_text(text, chunk_size):
-    """Splits the text into chunks of specified size."""
-    words = text.split()
-    for i in range(0, len(words), chunk_size):
-        yield ' '.join(words[i:i + chunk_size])
-
-def scrape_resources(query, n=5):  # Add n parameter for number of articles
-    model_name = "facebook/bart-large-cnn"
-    summarizer = pipeline("summarization", model=model_name)
-    output = []
-
-    # Process Wikipedia separately
-    if "Wikipedia" in direct_access_sites:
-        wiki_info = direct_access_sites["Wikipedia"]
-        search_url = f"{wiki_info['url']}{wiki_info['query_format'](query)}"
-        logging.info(f"Searching Wikipedia URL: {search_url}")
-
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
-        }
-        try:
-            response = requests.get(search_url, headers=headers)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request failed: {e}")
-            return output
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Extract article links from Wikipedia search results
-        article_links = []
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            if href.startswith('/wiki/') and ':' not in href:
-                article_links.append(f"https://en.wikipedia.org{href}")
-
-        # Limit to the first n article links
-        article_links = article_links[:n]
-
-        # Scrape each Wikipedia article
-        for article_url in article_links:
-            try:
-                article_response = requests.get(article_url, headers=headers)
-                article_response.raise_for_status()
-                article_soup = BeautifulSoup(article_response.text, 'html.parser')
-
-                # Extract relevant content from the article
-                paragraphs = article_soup.find_all('p')
-                full_text = " ".join([para.get_text(strip=True) for para in paragraphs])
-
-                # Summarization logic here...
-                if full_text:
-                    chunk_size = 300
-                    summaries = []
-                    for chunk in split_text(full_text, chunk_size):
-                        if len(chunk.split()) < 30:
-                            continue
-                        max_length = min(130, len(chunk) // 2) if len(chunk) > 30 else 30
-                        # Adjusting max_length and min_length
-                        chunk_summary = summarizer(chunk, max_length=max_length, min_length=10, do_sample=False)
-                        summaries.append(chunk_summary[0]['summary_text'])
-                    final_summary = " ".join(summaries)
-
-                    # Compile final output
-                    output.append({'site': "Wikipedia", 'url': article_url, 'summary': final_summary})
-
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Failed to retrieve article: {e}")
-
-    # Process other direct access sites
-    for site, info in traversal_sites.items():  # Change to traversal_sites
-        search_url = f"{info['url']}{info['query_format'](query)}"
-        logging.info(f"Searching URL: {search_url}")
-
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
-        }
-        try:
-            response = requests.get(search_url, headers=headers)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request failed: {e}")
-            continue
+headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+}
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Step 2: Extract article links based on site structure
-        article_links = []
-
-        # Generic extraction logic for traversal sites
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            # Ensure that the correct links are being captured for each site
-            if site == "Medium" and href.startswith('https://medium.com/'):
-                article_links.append(href)
-            elif site == "Dev.to" and href.startswith('https://dev.to/'):
-                article_links.append(href)
-            elif site == "GeeksforGeeks" and (href.startswith('/articles/') or href.startswith('/geeks/')):
-                article_links.append(f"https://www.geeksforgeeks.org{href}")
-            elif site == "Tutorialspoint" and (href.startswith('/tutorials/') or href.startswith('https://www.tutorialspoint.com/')):
-                article_links.append(f"https://www.tutorialspoint.com{href}")
-            elif site == "Stack Overflow" and (href.startswith('/questions/') or href.startswith('https://stackoverflow.com/questions/')):
-                article_links.append(f"https://stackoverflow.com{href}")
-
-        # Limit to the first n article links
-        article_links = article_links[:n]
-
-        # Step 3: Scrape each article
+def extract_wikipedia_links(page_content, n=5):
+    """Returns the first n article links on a Wikipedia search page."""
+    return find_article_links(page_content, direct_access_sites["Wikipedia"]["links"], n)
+
+def extract_article_links(site, page_content, n=5):
+    """Returns the first n article links on a traversal site's search page."""
+    return find_article_links(page_content, traversal_sites[site].get("links"), n)
+
+def extract_article_text(page_content):
+    """Joins the text of every paragraph on an article page."""
+    # Extract relevant content from the article; only the <p> elements are parsed
+    return extract_text(page_content, strip=True)
+
+def iter_article_paragraphs(page_content):
+    """Yields the text of every paragraph on an article page as soon as it is parsed."""
+    return iter_paragraphs(page_content, strip=True)
+
+async def discover_articles(fetcher, query, n=5, failed_sites=None):
+    """Fetches every search page at once and yields a job for each of the top n links per site.
+
+    The sites whose search page could not be fetched are appended to
+    failed_sites, if given; Wikipedia among them means the query was abandoned.
+    """
+    wiki_info = direct_access_sites["Wikipedia"]
+    search_urls = [("Wikipedia", f"{wiki_info['url']}{wiki_info['query_format'](query)}")]
+    search_urls += [(site, f"{info['url']}{info['query_format'](query)}") for site, info in traversal_sites.items()]
+    for site, search_url in search_urls:
+        logging.info(f"Searching {site} URL: {search_url}")
+
+    # Step 1: Fetch all search pages at once over pooled connections
+    search_pages = await fetcher.fetch_all([url for _, url in search_urls])
+    if failed_sites is not None:
+        failed_sites.extend(site for (site, _), page in zip(search_urls, search_pages) if page is None)
+    if search_pages[0] is None:
+        # Without Wikipedia results the query is abandoned, as before
+        return
+
+    for (site, _), page_content in zip(search_urls, search_pages):
+        if page_content is None:
+            continue
+        if site == "Wikipedia":
+            article_links = extract_wikipedia_links(page_content, n)
+        else:
+            article_links = extract_article_links(site, page_content, n)
         for article_url in article_links:
-            try:
-                article_response = requests.get(article_url, headers=headers)
-                article_response.raise_for_status()
-                article_soup = BeautifulSoup(article_response.text, 'html.parser')
-
-                # Extract relevant content from the article
-                paragraphs = article_soup.find_all('p')
-                full_text = " ".join([para.get_text(strip=True) for para in paragraphs])
-
-                # Summarization logic here...
-                if full_text:
-                    chunk_size = 300
-                    summaries = []
-                    for chunk in split_text(full_text, chunk_size):
-                        if len(chunk.split()) < 30:
-                            continue
-                        max_length = min(130, len(chunk) // 2) if len(chunk) > 30 else 30
-                        # Adjusting max_length and min_length
-                        chunk_summary = summarizer(chunk, max_length=max_length, min_length=10, do_sample=False)
-                        summaries.append(chunk_summary[0]['summary_text'])
-                    final_summary = " ".join(summaries)
-
-                    # Compile final output
-                    output.append({'site': site, 'url': article_url, 'summary': final_summary})
-
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Failed to retrieve article: {e}")
-
-    return output
+            yield {'site': site, 'url': article_url}
+
+def build_fetcher(use_cache=True, fetcher_class=Fetcher, user_agents=None):
+    # Unchanged pages are served from, or revalidated against, the on-disk HTTP cache;
+    # requests share the process-wide per-host rate limits
+    http_cache = get_http_cache() if use_cache else None
+    return fetcher_class(user_agents=user_agents or [headers["User-Agent"]], http_cache=http_cache,
+                         scheduler=get_scheduler())
+
+def build_pipeline(fetcher, summarizer, batch_size=DEFAULT_BATCH_SIZE, use_cache=True,
+                   extract_paragraphs=iter_article_paragraphs, min_length=10):
+    # Step 3: Articles are fetched, parsed and summarized in overlapping stages;
+    # chunks already summarized by an earlier query are served from the summary cache
+    cache = get_summary_cache() if use_cache else None
+    # Articles are tokenized once and packed into sentence-aligned chunks near BART's input limit;
+    # a summarizer without a tokenizer gets word-count chunks
+    chunker = TokenChunker(summarizer.tokenizer) if summarizer.tokenizer is not None else None
+    # Mirrored and syndicated copies of an article reuse the summary of the first one seen
+    dedup = get_fingerprint_index() if use_cache else None
+    # Long articles get their chunk summaries summarized again instead of concatenated;
+    # each page's paragraphs are chunked and fingerprinted as the parser yields them
+    return Pipeline(fetcher, None, summarizer, batch_size=batch_size, min_length=min_length,
+                    cache=cache, chunker=chunker, target_words=DEFAULT_TARGET_WORDS, dedup=dedup,
+                    extract_paragraphs=extract_paragraphs)
+
+async def scrape_resources_async(query, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=True):
+    # The summarizer is loaded once per process and reused across queries; with
+    # SUMMARIZER_WORKERS > 1 it is a pool of worker processes sharing its weights
+    summarizer = get_shared_summarizer(SUMMARIZATION_MODEL)
+    with instrumentation.query_timing(query):
+        async with build_fetcher(use_cache) as fetcher:
+            pipeline = build_pipeline(fetcher, summarizer, batch_size, use_cache)
+            return await pipeline.run(discover_articles(fetcher, query, n))
+
+async def iter_resources_async(query, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=True):
+    """Yields each {'site', 'url', 'summary'} record as soon as it is ready."""
+    summarizer = get_shared_summarizer(SUMMARIZATION_MODEL)
+    with instrumentation.query_timing(query):
+        async with build_fetcher(use_cache) as fetcher:
+            pipeline = build_pipeline(fetcher, summarizer, batch_size, use_cache)
+            async with aclosing(pipeline.stream(discover_articles(fetcher, query, n))) as resources:
+                async for resource in resources:
+                    yield resource
+
+def scrape_resources(query, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=True):  # Add n parameter for number of articles
+    return asyncio.run(scrape_resources_async(query, n, batch_size, use_cache))
+
+def iter_resources(query, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=True):
+    """Synchronous generator over the records of a query, in completion order."""
+    return iterate_sync(iter_resources_async(query, n, batch_size, use_cache))
 
 # Example usage
 if __name__ == "__main__":
     query = "Dynamic programming"
-    resources = scrape_resources(query)
-    
-    # Write the summarized data and links to a text file with utf-8 encoding
-    with open('summarized_resources.txt', 'w', encoding='utf-8') as f:
-        for resource in resources:
-            f.write(f"Site: {resource['site']}\n")
-            f.write(f"URL: {resource['url']}\n")
-            f.write(f"Summary: {resource['summary']}\n")
-            f.write("\n")  # Add a newline for better readability
\ No newline at end of file
+
+    # Write the summarized data and links to a text file with utf-8 encoding as each one is ready
+    write_resources(iter_resources(query), 'summarized_resources.txt')
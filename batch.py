@@ -0,0 +1,270 @@
+"""Batch mode: refresh the summaries of many queries in one run.
+
+Every query of the batch goes through a single ``Pipeline``, so they share one
+summarizer, one HTTP connection pool and host scheduler, and the summary, HTTP
+and fingerprint caches. An article URL returned by several queries is fetched
+and summarized once; the other queries get a copy of its record.
+
+Results are written as sharded JSONL: one line per finished query,
+``{"query": ..., "resources": [...]}``, at most ``shard_size`` lines per
+``results-NNNNN.jsonl`` file. The shards double as the checkpoint. A rerun
+with the same output directory skips the queries already written and appends
+new shards, so an interrupted batch resumes where it stopped and loses at
+most the queries that were in flight. A query whose search failed (Wikipedia
+unreachable) or whose articles all failed is not written, so
+the next run retries it.
+
+    python batch.py queries.txt --output-dir results/ [-n 5] [--concurrency 4]
+
+The queries file holds one query per line; blank lines and lines starting
+with ``#`` are ignored.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import aclosing
+
+import instrumentation
+from app import build_fetcher, build_pipeline, discover_articles
+from dedup import FingerprintIndex, canonical_url
+from models import SUMMARIZATION_MODEL
+from summarization import DEFAULT_BATCH_SIZE
+from worker_pool import get_shared_summarizer
+
+DEFAULT_SHARD_SIZE = 1000
+# Queries whose search pages are fetched and parsed at the same time
+DEFAULT_CONCURRENCY = 4
+SHARD_NAME = re.compile(r"^results-(\d{5})\.jsonl$")
+
+
+def read_queries(path):
+    """Returns the distinct queries in a file, one per line, in file order."""
+    with open(path, encoding='utf-8') as f:
+        lines = (line.strip() for line in f)
+        return list(dict.fromkeys(line for line in lines if line and not line.startswith("#")))
+
+
+def completed_queries(output_dir):
+    """Returns the queries already written to the shards in output_dir, and the next shard number."""
+    done = set()
+    next_shard = 0
+    if not os.path.isdir(output_dir):
+        return done, next_shard
+    for name in sorted(os.listdir(output_dir)):
+        match = SHARD_NAME.match(name)
+        if not match:
+            continue
+        next_shard = max(next_shard, int(match.group(1)) + 1)
+        with open(os.path.join(output_dir, name), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)['query'])
+                except (json.JSONDecodeError, KeyError):
+                    # The run stopped while writing this line; the query is redone
+                    continue
+    return done, next_shard
+
+
+class ShardWriter:
+    """Appends one JSON line per finished query, starting a new shard every shard_size lines."""
+
+    def __init__(self, output_dir, first_shard=0, shard_size=DEFAULT_SHARD_SIZE):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.shard = first_shard
+        self.shard_size = shard_size
+        self.lines = 0
+        self.file = None
+
+    def write(self, query, resources):
+        if self.file is None or self.lines >= self.shard_size:
+            self.close()
+            # Existing shards are never appended to, so a torn last line stays the last line
+            path = os.path.join(self.output_dir, f"results-{self.shard:05d}.jsonl")
+            self.file = open(path, 'x', encoding='utf-8')
+            self.shard += 1
+            self.lines = 0
+        self.file.write(json.dumps({'query': query, 'resources': resources}, ensure_ascii=False) + "\n")
+        # Flushed per query: the shards are the checkpoint
+        self.file.flush()
+        self.lines += 1
+
+    def close(self):
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+
+class _Progress:
+    """Tracks which queries have every one of their articles accounted for."""
+
+    def __init__(self):
+        self.expected = {}
+        self.records = {}
+        self.search_failed = set()
+
+    def started(self, query):
+        self.records[query] = []
+
+    def discovered(self, query, jobs):
+        self.expected[query] = jobs
+
+    def add(self, record):
+        self.records[record['query']].append(record)
+
+    def finished(self, query):
+        return query in self.expected and len(self.records[query]) >= self.expected[query]
+
+    def pop(self, query):
+        """Returns the records of a finished query and whether it succeeded enough to be checkpointed."""
+        del self.expected[query]
+        records = self.records.pop(query)
+        failed = query in self.search_failed or (records and all('error' in record for record in records))
+        self.search_failed.discard(query)
+        return records, not failed
+
+
+async def _discover_all(fetcher, queries, n, concurrency, progress, finished):
+    """Yields the article jobs of every query, running discovery for several queries at a time."""
+    jobs = asyncio.Queue(concurrency * 8)
+    remaining = iter(queries)
+
+    async def discover(query):
+        found = 0
+        failed_sites = []
+        async with aclosing(discover_articles(fetcher, query, n, failed_sites)) as articles:
+            async for job in articles:
+                job['query'] = query
+                found += 1
+                await jobs.put(job)
+        # discover_articles abandons a query without Wikipedia results
+        if "Wikipedia" in failed_sites:
+            logging.error(f"Search failed for query {query!r} on: {', '.join(failed_sites)}")
+            progress.search_failed.add(query)
+        progress.discovered(query, found)
+        if progress.finished(query):
+            # Queries without results are complete as soon as their search is
+            await finished.put(query)
+
+    async def worker():
+        for query in remaining:
+            progress.started(query)
+            await discover(query)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    waiter = asyncio.ensure_future(asyncio.gather(*workers))
+    try:
+        while True:
+            getter = asyncio.ensure_future(jobs.get())
+            await asyncio.wait({getter, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+                continue
+            getter.cancel()
+            while not jobs.empty():
+                yield jobs.get_nowait()
+            # Surfaces a failure in any discovery worker
+            waiter.result()
+            return
+    finally:
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+
+async def run_batch_async(queries, output_dir, n=5, batch_size=DEFAULT_BATCH_SIZE, shard_size=DEFAULT_SHARD_SIZE,
+                          concurrency=DEFAULT_CONCURRENCY, use_cache=True):
+    """Runs every query not yet in output_dir's shards and writes its records there.
+
+    Returns throughput statistics for the run, including queries per hour.
+    """
+    done, next_shard = completed_queries(output_dir)
+    pending = [query for query in queries if query not in done]
+    # 'failed' counts queries left out of the shards for the next run to retry
+    stats = {'queries': 0, 'skipped': len(queries) - len(pending), 'articles': 0, 'shared': 0, 'duplicates': 0,
+             'failed_articles': 0, 'failed': 0}
+    start = time.perf_counter()
+    if pending:
+        # The model is loaded once for the whole batch, in SUMMARIZER_WORKERS processes if set
+        summarizer = get_shared_summarizer(SUMMARIZATION_MODEL)
+        writer = ShardWriter(output_dir, next_shard, shard_size)
+        progress = _Progress()
+        seen = set()
+        finished = asyncio.Queue()
+
+        def write_finished():
+            while not finished.empty():
+                query = finished.get_nowait()
+                records, succeeded = progress.pop(query)
+                if not succeeded:
+                    stats['failed'] += 1
+                    instrumentation.count('batch_failed_queries')
+                    continue
+                writer.write(query, records)
+                stats['queries'] += 1
+                instrumentation.count('batch_queries')
+
+        try:
+            async with build_fetcher(use_cache) as fetcher:
+                pipeline = build_pipeline(fetcher, summarizer, batch_size, use_cache)
+                # Articles shared between queries are only fetched and summarized once per batch
+                pipeline.dedup = pipeline.dedup or FingerprintIndex(":memory:")
+                pipeline.report_failures = True
+                jobs = _discover_all(fetcher, pending, n, concurrency, progress, finished)
+                async with aclosing(pipeline.stream(jobs)) as records:
+                    async for record in records:
+                        progress.add(record)
+                        stats['failed_articles'] += 'error' in record
+                        stats['duplicates'] += 'duplicate_of' in record
+                        stats['articles'] += 'error' not in record
+                        url = canonical_url(record['url'])
+                        stats['shared'] += url in seen
+                        seen.add(url)
+                        if progress.finished(record['query']):
+                            await finished.put(record['query'])
+                        write_finished()
+                write_finished()
+        finally:
+            writer.close()
+    elapsed = time.perf_counter() - start
+    stats['elapsed_seconds'] = elapsed
+    stats['queries_per_hour'] = stats['queries'] / elapsed * 3600 if elapsed and stats['queries'] else 0.0
+    logging.info(f"Batch finished: {stats}")
+    return stats
+
+
+def run_batch(queries, output_dir, n=5, batch_size=DEFAULT_BATCH_SIZE, shard_size=DEFAULT_SHARD_SIZE,
+              concurrency=DEFAULT_CONCURRENCY, use_cache=True):
+    """Synchronous wrapper around run_batch_async."""
+    return asyncio.run(run_batch_async(queries, output_dir, n, batch_size, shard_size, concurrency, use_cache))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("queries", help="file with one query per line")
+    parser.add_argument("--output-dir", "-o", required=True, help="directory of results-NNNNN.jsonl shards")
+    parser.add_argument("-n", type=int, default=5, help="articles followed per site")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE, help="queries per shard")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="queries whose search pages are processed at once")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the HTTP, summary and fingerprint caches")
+    args = parser.parse_args(argv)
+
+    queries = read_queries(args.queries)
+    stats = run_batch(queries, args.output_dir, args.n, args.batch_size, args.shard_size, args.concurrency,
+                      not args.no_cache)
+    print(f"{stats['queries']} queries ({stats['skipped']} already done, {stats['failed']} failed and left for "
+          f"the next run), {stats['articles']} articles ({stats['shared']} shared between queries, "
+          f"{stats['duplicates']} duplicates, {stats['failed_articles']} failed) "
+          f"in {stats['elapsed_seconds']:.1f}s: {stats['queries_per_hour']:.0f} queries/hour")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""Compare the summarization inference backends for speed, memory and summary quality.
+
+Every backend in ``models.BACKENDS`` summarizes the same chunks of the fixture
+articles, each in a fresh subprocess so that its resident memory is its own.
+The report gives the latency per chunk, the peak RSS, and the ROUGE-1/2/L F1
+of each backend's summaries against the fp32 ``torch`` summaries. The run fails
+when a backend's ROUGE-L falls below ``--min-rouge``.
+
+    python -m benchmarks.bench_backends [--model NAME] [--backends torch,int8,onnx] [--threads N]
+
+ROUGE is computed here on lower-cased word tokens, so no scoring package is needed.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from benchmarks import fixtures
+from extraction import extract_text
+from models import BACKENDS, SUMMARIZATION_MODEL
+from summarization import DEFAULT_CHUNK_SIZE, eligible_chunks
+
+REFERENCE = 'torch'
+
+
+def _tokens(text):
+    return [word.strip(".,;:!?\"'()[]").lower() for word in text.split() if word.strip(".,;:!?\"'()[]")]
+
+
+def _f1(overlap, candidate_total, reference_total):
+    if not overlap:
+        return 0.0
+    precision = overlap / candidate_total
+    recall = overlap / reference_total
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_n(candidate, reference, n):
+    """Returns the ROUGE-N F1 score of candidate against reference."""
+    grams = [Counter(zip(*(tokens[i:] for i in range(n)))) for tokens in (_tokens(candidate), _tokens(reference))]
+    overlap = sum((grams[0] & grams[1]).values())
+    return _f1(overlap, sum(grams[0].values()), sum(grams[1].values()))
+
+
+def rouge_l(candidate, reference):
+    """Returns the ROUGE-L F1 score (longest common subsequence) of candidate against reference."""
+    candidate, reference = _tokens(candidate), _tokens(reference)
+    previous = [0] * (len(reference) + 1)
+    for word in candidate:
+        current = [0]
+        for index, other in enumerate(reference):
+            current.append(previous[index] + 1 if word == other else max(previous[index + 1], current[index]))
+        previous = current
+    return _f1(previous[-1], len(candidate), len(reference))
+
+
+def rouge(candidates, references):
+    """Returns the mean ROUGE-1, ROUGE-2 and ROUGE-L F1 over pairs of summaries."""
+    pairs = list(zip(candidates, references))
+    return {
+        'rouge1': sum(rouge_n(c, r, 1) for c, r in pairs) / len(pairs),
+        'rouge2': sum(rouge_n(c, r, 2) for c, r in pairs) / len(pairs),
+        'rougeL': sum(rouge_l(c, r) for c, r in pairs) / len(pairs),
+    }
+
+
+def benchmark_chunks(articles, chunks_per_article):
+    _, article_pages = fixtures.load(articles=articles)
+    chunks = []
+    for page in article_pages.values():
+        chunks += list(eligible_chunks(extract_text(page), DEFAULT_CHUNK_SIZE))[:chunks_per_article]
+    return chunks
+
+
+def _peak_rss_mib():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_backend(backend, model_name, threads, articles, chunks_per_article):
+    import models
+    chunks = benchmark_chunks(articles, chunks_per_article)
+    start = time.perf_counter()
+    summarizer = models.get_summarizer(model_name, backend=backend, num_threads=threads)
+    load_seconds = time.perf_counter() - start
+    # The first call pays for lazy initialization, which is not what is being compared
+    summarizer(chunks[:1], max_length=60, min_length=10, do_sample=False)
+    summaries = []
+    latencies = []
+    for chunk in chunks:
+        start = time.perf_counter()
+        summaries.append(summarizer([chunk], max_length=130, min_length=30, do_sample=False)[0]['summary_text'])
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(json.dumps({
+        'load_s': load_seconds,
+        'chunk_p50_s': latencies[len(latencies) // 2],
+        'chunk_mean_s': sum(latencies) / len(latencies),
+        'peak_rss_mib': _peak_rss_mib(),
+        'summaries': summaries,
+    }))
+
+
+def run_backend(backend, args):
+    command = [sys.executable, "-m", "benchmarks.bench_backends", "--run-backend", backend,
+               "--model", args.model, "--articles", str(args.articles), "--chunks", str(args.chunks)]
+    if args.threads:
+        command += ["--threads", str(args.threads)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=SUMMARIZATION_MODEL)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--threads", type=int, help="inference threads for every backend")
+    parser.add_argument("--articles", type=int, default=4, help="fixture articles to summarize")
+    parser.add_argument("--chunks", type=int, default=3, help="chunks summarized per article")
+    parser.add_argument("--min-rouge", type=float, default=0.6, help="lowest ROUGE-L F1 accepted against fp32")
+    parser.add_argument("--run-backend", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_backend:
+        _run_backend(args.run_backend, args.model, args.threads, args.articles, args.chunks)
+        return 0
+
+    backends = args.backends.split(",")
+    if REFERENCE not in backends:
+        backends.insert(0, REFERENCE)
+    results = {backend: run_backend(backend, args) for backend in backends}
+    reference = results[REFERENCE]
+
+    header = (f"{'backend':<8} {'chunk p50 s':>12} {'speedup':>8} {'peak RSS MiB':>13} "
+              f"{'ROUGE-1':>8} {'ROUGE-2':>8} {'ROUGE-L':>8}")
+    print(header)
+    print("-" * len(header))
+    failed = False
+    for backend, result in results.items():
+        scores = rouge(result['summaries'], reference['summaries'])
+        failed = failed or scores['rougeL'] < args.min_rouge
+        print(f"{backend:<8} {result['chunk_p50_s']:>12.3f} {reference['chunk_p50_s'] / result['chunk_p50_s']:>7.2f}x "
+              f"{result['peak_rss_mib']:>13.0f} {scores['rouge1']:>8.3f} {scores['rouge2']:>8.3f} "
+              f"{scores['rougeL']:>8.3f}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
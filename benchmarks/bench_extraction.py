@@ -0,0 +1,145 @@
+"""Benchmark the HTML extraction backends against the original BeautifulSoup path.
+
+For every backend this reports search and article pages parsed per second and
+the peak extra resident memory while parsing a page, and checks that the links
+and paragraph text it extracts are identical to the ``bs4`` reference. The
+fixtures include malformed pages, on which parsers disagree; the run fails when
+the default backend (``extraction.DEFAULT_BACKEND``) differs from ``bs4`` on any
+page, and reports how many pages every other backend gets wrong.
+
+    python -m benchmarks.bench_extraction [--fixtures DIR] [--repeat N] [--backends lxml,strainer]
+
+Memory is measured in a fresh subprocess per backend as the growth of the
+resident set while a single page is parsed, so allocations made inside C
+parsers are counted. On Linux the RSS high-water mark is reset before every
+page; elsewhere only Python allocations (tracemalloc) can be measured per page.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks import fixtures
+from extraction import DEFAULT_BACKEND, backends, extract_links, extract_paragraphs
+
+REFERENCE = 'bs4'
+
+
+def _proc_status_kib(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise OSError(f"{field} missing from /proc/self/status")
+
+
+def _reset_rss_peak():
+    """Resets the RSS high-water mark, returning False where the OS does not allow it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _page_peak_kib(function, page):
+    """Returns how far memory rose above its starting point while function(page) ran."""
+    if _reset_rss_peak():
+        before = _proc_status_kib("VmRSS")
+        function(page)
+        return max(0, _proc_status_kib("VmHWM") - before)
+    tracemalloc.start()
+    try:
+        function(page)
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def _extract_all(backend, search_pages, article_pages):
+    links = [extract_links(page, backend) for page in search_pages]
+    stripped = [extract_paragraphs(page, True, backend) for page in article_pages]
+    raw = [extract_paragraphs(page, False, backend) for page in article_pages]
+    return links, stripped, raw
+
+
+def _differing_pages(backend, reference, search_pages, article_pages):
+    """Returns how many pages backend extracts differently from the reference extraction."""
+    extracted = _extract_all(backend, search_pages, article_pages)
+    links, stripped, raw = (
+        [page != reference_page for page, reference_page in zip(pages, reference_pages)]
+        for pages, reference_pages in zip(extracted, reference))
+    return sum(links) + sum(a or b for a, b in zip(stripped, raw))
+
+
+def pages_per_second(function, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            function(page)
+    return repeat * len(pages) / (time.perf_counter() - start)
+
+
+def peak_memory(backend, fixture_dir):
+    """Returns the largest per-page memory peak in KiB for backend's search and article pages."""
+    command = [sys.executable, "-m", "benchmarks.bench_extraction", "--measure-memory", backend]
+    if fixture_dir:
+        command += ["--fixtures", fixture_dir]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def _measure_memory(backend, fixture_dir):
+    search_pages, article_pages = fixtures.load(fixture_dir)
+    # Warm up imports and parser state before taking the baseline
+    _extract_all(backend, list(search_pages.values())[:1], list(article_pages.values())[:1])
+    result = {}
+    for kind, pages, function in (
+        ('search', search_pages.values(), lambda page: extract_links(page, backend)),
+        ('article', article_pages.values(), lambda page: extract_paragraphs(page, True, backend)),
+    ):
+        result[kind] = max(_page_peak_kib(function, page) for page in pages)
+    print(json.dumps(result))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", help="directory of saved search_*.html/article_*.html pages")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--backends", default=",".join(backends))
+    parser.add_argument("--measure-memory", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure_memory:
+        _measure_memory(args.measure_memory, args.fixtures)
+        return 0
+
+    search_pages, article_pages = fixtures.load(args.fixtures)
+    search_pages, article_pages = list(search_pages.values()), list(article_pages.values())
+    article_bytes = sum(len(page.encode('utf-8')) for page in article_pages)
+    print(f"{len(search_pages)} search pages, {len(article_pages)} article pages "
+          f"({article_bytes / len(article_pages) / 1024:.0f} KiB average)")
+
+    reference = _extract_all(REFERENCE, search_pages, article_pages)
+    header = f"{'backend':<10} {'search/s':>10} {'article/s':>10} {'search KiB':>11} {'article KiB':>12}  output"
+    print(header)
+    print("-" * len(header))
+    failed = False
+    for backend in args.backends.split(","):
+        search_rate = pages_per_second(lambda page: extract_links(page, backend), search_pages, args.repeat)
+        article_rate = pages_per_second(lambda page: extract_paragraphs(page, True, backend),
+                                        article_pages, args.repeat)
+        memory = peak_memory(backend, args.fixtures)
+        differing = _differing_pages(backend, reference, search_pages, article_pages)
+        failed = failed or (differing and backend == DEFAULT_BACKEND)
+        print(f"{backend:<10} {search_rate:>10.1f} {article_rate:>10.1f} {memory['search']:>11} "
+              f"{memory['article']:>12}  {f'DIFFERS on {differing} pages' if differing else 'identical'}"
+              f"{' (default)' if backend == DEFAULT_BACKEND else ''}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
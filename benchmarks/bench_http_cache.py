@@ -0,0 +1,102 @@
+"""Check that unchanged pages are revalidated with a 304 and not parsed again.
+
+One query's search and article pages are replayed from the fixture server,
+which sends ``ETag``/``Last-Modified`` validators and answers ``304 Not
+Modified`` while they still match. The query is scraped twice through
+``app.build_pipeline`` with a fresh ``HttpCache`` whose entries go stale at
+once, so the second pass sends a conditional GET for every page. The run fails
+unless every page of the second pass is counted as ``revalidated`` in
+``HttpCache.stats()`` and no article page is parsed again: its text must come
+from the cache's stored paragraphs.
+
+    python -m benchmarks.bench_http_cache [--query Q] [-n N]
+"""
+import argparse
+import asyncio
+import functools
+import os
+import sys
+import tempfile
+import time
+
+import app
+from benchmarks import fixtures
+from benchmarks.fixture_server import FixtureServer
+from benchmarks.run import ReplayFetcher, Timings, article_links, search_urls
+from benchmarks.stubs import StubSummarizer
+from http_cache import HttpCache
+from scheduling import HostScheduler
+
+COUNTERS = ('misses', 'revalidated', 'hits')
+
+
+def _totals(cache):
+    stats = cache.stats().values()
+    return {counter: sum(host_stats[counter] for host_stats in stats) for counter in COUNTERS}
+
+
+async def _scrape(server, cache, query, n, extract_paragraphs):
+    async with ReplayFetcher(server, Timings(), user_agents=[app.headers["User-Agent"]],
+                             http_cache=cache, scheduler=HostScheduler()) as fetcher:
+        scrape = app.build_pipeline(fetcher, StubSummarizer(), use_cache=False)
+        scrape.extract_paragraphs = extract_paragraphs
+        return len(await scrape.run(app.discover_articles(fetcher, query, n)))
+
+
+def run_passes(query, n, passes=2):
+    """Scrapes query passes times through one HttpCache and returns the counts of each pass."""
+    pages = fixtures.site_recordings(search_urls(query), article_links(n))
+    parsed = []
+
+    # Wrapped so the cache files its extractions under the same name as the real extractor
+    @functools.wraps(app.iter_article_paragraphs)
+    def extract_paragraphs(page):
+        parsed.append(len(page))
+        return app.iter_article_paragraphs(page)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory, FixtureServer(pages) as server:
+        cache = HttpCache(os.path.join(directory, "http_cache.sqlite3"))
+        try:
+            for _ in range(passes):
+                before = _totals(cache)
+                parsed.clear()
+                start = time.perf_counter()
+                records = asyncio.run(_scrape(server, cache, query, n, extract_paragraphs))
+                after = _totals(cache)
+                result = {counter: after[counter] - before[counter] for counter in COUNTERS}
+                result.update(records=records, parsed=len(parsed), seconds=time.perf_counter() - start)
+                results.append(result)
+        finally:
+            cache.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--query", default="dynamic programming")
+    parser.add_argument("-n", type=int, default=5, help="articles followed per site")
+    args = parser.parse_args(argv)
+
+    first, second = run_passes(args.query, args.n)
+    header = f"{'pass':<6} {'records':>8} {'misses':>7} {'revalidated':>12} {'hits':>5} {'parsed':>7} {'seconds':>8}"
+    print(header)
+    print("-" * len(header))
+    for index, result in enumerate((first, second), 1):
+        print(f"{index:<6} {result['records']:>8} {result['misses']:>7} {result['revalidated']:>12} "
+              f"{result['hits']:>5} {result['parsed']:>7} {result['seconds']:>8.2f}")
+
+    failures = []
+    if second['revalidated'] != first['misses'] or second['misses'] or second['hits']:
+        failures.append(f"expected all {first['misses']} pages to be revalidated on the second pass")
+    if second['parsed']:
+        failures.append(f"{second['parsed']} unchanged article pages were parsed again")
+    if second['records'] != first['records']:
+        failures.append(f"the second pass produced {second['records']} records, not {first['records']}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
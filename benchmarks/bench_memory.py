@@ -0,0 +1,133 @@
+"""Check that extraction, chunking and transcript wrapping run in bounded memory.
+
+A fixture article page and a fixture transcript are generated piece by piece
+at growing sizes, and each case runs in a fresh subprocess that reports how
+far its resident memory rose above its starting point:
+
+* ``stream`` - the page's blocks go through ``extraction.iter_paragraphs`` and
+  ``summarization.iter_paragraph_chunks``, so neither the page, its tree nor
+  its full text is ever held whole;
+* ``dom`` - the page is joined into one string, parsed into a tree by the
+  ``lxml`` backend, joined into ``full_text`` and chunked, for comparison;
+* ``stream-tokens`` and ``dom-tokens`` - the same with a ``TokenChunker``
+  over ``stubs.stub_tokenizer``, which tokenizes the streamed paragraphs a
+  block of ``chunking.TOKENIZE_CHARS`` at a time;
+* ``transcript-stream`` - transcript segments are wrapped straight into a
+  file by ``transcription.write_transcript``;
+* ``transcript-join`` - the segments are joined into one text and wrapped by
+  ``format_transcript``, for comparison.
+
+The run fails when a streaming case rises more than ``--limit-mib`` at any
+size: their peak must not depend on the size of the input.
+
+    python -m benchmarks.bench_memory [--sizes 2,8,32] [--limit-mib 32]
+
+Sizes are in MiB of HTML; the transcript has as many bytes of words. As in
+``bench_extraction``, the RSS high-water mark is reset before a measurement on
+Linux; elsewhere only Python allocations (tracemalloc) are counted.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import fixtures
+from benchmarks.bench_extraction import _proc_status_kib, _reset_rss_peak
+from benchmarks.stubs import stub_tokenizer
+from chunking import TokenChunker
+from extraction import extract_text, iter_paragraphs
+from summarization import chunk_text, iter_paragraph_chunks
+from transcription import format_transcript, write_transcript
+
+STREAMING_CASES = ('stream', 'stream-tokens', 'transcript-stream')
+CASES = ('stream', 'dom', 'stream-tokens', 'dom-tokens', 'transcript-stream', 'transcript-join')
+# Average bytes per word of the fixture transcript, spaces included
+BYTES_PER_WORD = 8
+
+
+_chunker = None
+
+
+def _token_chunker():
+    # Trained once per process, during the warm-up run
+    global _chunker
+    if _chunker is None:
+        _chunker = TokenChunker(stub_tokenizer())
+    return _chunker
+
+
+def _run_case(case, size):
+    chunker = _token_chunker() if case.endswith('-tokens') else None
+    if case.startswith('stream'):
+        paragraphs = iter_paragraphs(fixtures.huge_article_blocks(size))
+        return sum(1 for _ in iter_paragraph_chunks(paragraphs, chunker=chunker))
+    if case.startswith('dom'):
+        text = extract_text("".join(fixtures.huge_article_blocks(size)), backend='lxml')
+        return len(chunk_text(text, chunker=chunker))
+    words = size // BYTES_PER_WORD
+    with tempfile.TemporaryDirectory() as directory:
+        if case == 'transcript-stream':
+            path = os.path.join(directory, "transcript.txt")
+            write_transcript(fixtures.transcript_pieces(words), path)
+            return os.path.getsize(path)
+        return len(format_transcript(" ".join(fixtures.transcript_pieces(words))))
+
+
+def _measure(case, size):
+    # Warm up imports and parser state before taking the baseline
+    _run_case(case, 64 * 1024)
+    start = time.perf_counter()
+    if _reset_rss_peak():
+        before = _proc_status_kib("VmRSS")
+        items = _run_case(case, size)
+        peak = max(0, _proc_status_kib("VmHWM") - before)
+    else:
+        tracemalloc.start()
+        items = _run_case(case, size)
+        peak = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    print(json.dumps({'peak_kib': peak, 'seconds': time.perf_counter() - start, 'items': items}))
+
+
+def measure(case, size_mib):
+    command = [sys.executable, "-m", "benchmarks.bench_memory", "--measure", case, "--size", str(size_mib)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="2,8,32", help="input sizes in MiB")
+    parser.add_argument("--cases", default=",".join(CASES))
+    parser.add_argument("--limit-mib", type=float, default=32.0,
+                        help="largest memory rise accepted for a streaming case")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        _measure(args.measure, int(args.size * 1024 * 1024))
+        return 0
+
+    sizes = [float(size) for size in args.sizes.split(",")]
+    header = f"{'case':<18} {'MiB in':>7} {'peak MiB':>9} {'seconds':>8}"
+    print(header)
+    print("-" * len(header))
+    failed = False
+    for case in args.cases.split(","):
+        for size in sizes:
+            result = measure(case, size)
+            peak = result['peak_kib'] / 1024
+            over = case in STREAMING_CASES and peak > args.limit_mib
+            failed = failed or over
+            print(f"{case:<18} {size:>7.0f} {peak:>9.1f} {result['seconds']:>8.2f}"
+                  f"{'  over limit' if over else ''}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Local HTTP servers that replay recorded pages in place of the real sites.
+
+Every original host gets its own server on a loopback port, so the fetcher's
+per-host connection pools, rate limits and fair queueing see the same set of
+hosts as they would against the live sites. ``local_url`` maps a real URL to
+the server standing in for its host; unknown hosts and paths answer 404.
+
+Pages are served with an ``ETag`` (a digest of the body) and a
+``Last-Modified`` date (when the server was created), and a conditional GET
+whose ``If-None-Match`` or ``If-Modified-Since`` still matches is answered
+``304 Not Modified``, as the live sites do for pages that have not changed.
+"""
+import email.utils
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, unquote_plus, urlsplit
+
+
+def _target(parts):
+    return (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+
+def _key(target):
+    # Clients encode what the site configs leave raw (a space in a query may arrive as + or %20)
+    path, _, query = target.partition("?")
+    return unquote(path) + (f"?{unquote_plus(query)}" if query else "")
+
+
+def _etag(body):
+    return f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+
+
+def _not_modified(request_headers, etag, last_modified):
+    """Tells whether a conditional GET's validators still match the page."""
+    if_none_match = request_headers.get("If-None-Match")
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+    if_modified_since = request_headers.get("If-Modified-Since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return since >= email.utils.parsedate_to_datetime(last_modified)
+
+
+def _handler(pages, latency, last_modified):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            page = pages.get(_key(self.path))
+            if page is None:
+                self._respond(404, b"")
+                return
+            body = page.encode('utf-8')
+            etag = _etag(body)
+            if _not_modified(self.headers, etag, last_modified):
+                self._respond(304, b"", etag)
+            else:
+                self._respond(200, body, etag)
+
+        def _respond(self, status, body, etag=None):
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            if etag is not None:
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+            if status != 304:
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class FixtureServer:
+    def __init__(self, pages, latency=0.0):
+        # Seconds every response is held back, standing in for network round trips
+        self.latency = latency
+        self.last_modified = email.utils.formatdate(time.time(), usegmt=True)
+        self.pages = {}
+        for url, page in pages.items():
+            parts = urlsplit(url)
+            self.pages.setdefault(parts.netloc, {})[_key(_target(parts))] = page
+        self._servers = {}
+
+    def __enter__(self):
+        # The extra server under the None key answers 404 for hosts that were never recorded
+        for host in list(self.pages) + [None]:
+            handler = _handler(self.pages.get(host, {}), self.latency, self.last_modified)
+            server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self._servers[host] = server
+        return self
+
+    def __exit__(self, *exc_info):
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+        self._servers = {}
+
+    def local_url(self, url):
+        """Returns the URL on the local server standing in for url's host."""
+        parts = urlsplit(url)
+        server = self._servers.get(parts.netloc) or self._servers[None]
+        return f"http://127.0.0.1:{server.server_port}{_target(parts)}"
@@ -0,0 +1,289 @@
+"""Deterministic HTML fixtures modelled on the pages the scrapers visit.
+
+Search pages carry the mix of links the real sites return - article links in
+each site's own format alongside navigation, tag and account links - and
+article pages have the usual head scripts, navigation, inline markup,
+citations, comments and footers around their paragraphs. A few more article
+pages use the malformed markup real pages carry (unclosed and misnested
+paragraphs, stray end tags), on which parsers disagree. The same seed always
+produces the same pages, so benchmark runs are comparable across machines.
+
+Recorded pages can be used instead: save them as ``search_<site>.html`` and
+``article_<name>.html`` in a directory and point the benchmarks at it.
+
+``site_recordings`` builds a whole query's worth of pages keyed by URL - every
+search page plus every article it links to - for the fixture server to replay,
+and ``write_speech_wav`` writes a speech-like audio fixture (voiced bursts
+separated by pauses) for the transcription benchmark. ``huge_article_blocks``
+and ``transcript_pieces`` produce an arbitrarily large article page and
+transcript piece by piece, for the memory benchmark.
+
+    python -m benchmarks.fixtures OUTPUT_DIR [--seed N] [--articles N]
+"""
+import argparse
+import os
+import random
+import wave
+
+WORDS = (
+    "algorithm array binary bottom cache call complexity compute dynamic edge element "
+    "fibonacci function graph greedy index input knapsack length linear list loop matrix "
+    "memoization memory method minimum node number optimal overlapping path problem "
+    "programming recursion recursive result sequence solution solve space stack state "
+    "string structure subproblem subsequence sum table time top tree value vertex weight"
+).split()
+
+SEARCH_SITES = ["Wikipedia", "Medium", "Dev.to", "GeeksforGeeks", "Tutorialspoint", "Stack Overflow", "W3Schools"]
+
+
+def site_slug(site):
+    return site.lower().replace(" ", "_").replace(".", "")
+
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def _sentence(rng):
+    return _words(rng, rng.randint(8, 24)).capitalize() + rng.choice([".", ".", ".", "!", "?"])
+
+
+def _paragraph(rng):
+    parts = []
+    for _ in range(rng.randint(2, 8)):
+        sentence = _sentence(rng)
+        roll = rng.random()
+        if roll < 0.2:
+            word = rng.choice(WORDS)
+            sentence = sentence.replace(word, f'<a href="/wiki/{word.capitalize()}" title="{word}">{word}</a>', 1)
+        elif roll < 0.3:
+            word = rng.choice(WORDS)
+            sentence = sentence.replace(word, f"<b>{word}</b>", 1)
+        elif roll < 0.35:
+            sentence += f'<sup class="reference"><a href="#cite_note-{rng.randint(1, 99)}">[{rng.randint(1, 99)}]</a></sup>'
+        elif roll < 0.37:
+            sentence += "<!-- editor note -->"
+        parts.append(sentence)
+    return " ".join(parts)
+
+
+def _nav(rng):
+    return "".join(f'<li><a href="/wiki/{rng.choice(WORDS).capitalize()}">{rng.choice(WORDS)}</a></li>'
+                   for _ in range(rng.randint(30, 80)))
+
+
+def _article_html(title, nav, body):
+    return (
+        "<!DOCTYPE html><html lang=\"en\"><head><meta charset=\"utf-8\">"
+        f"<title>{title}</title>"
+        "<script>window.__config = {\"theme\": \"light\", \"ads\": true};</script>"
+        "<style>p { margin: 0 0 1em; } .nav li { display: inline; }</style>"
+        "</head><body>"
+        f"<div class=\"nav\"><ul>{nav}</ul></div>"
+        f"<main><h1>{title}</h1><div class=\"content\">{''.join(body)}</div></main>"
+        "<footer><p>Content is available under a licence.</p>"
+        "<a href=\"/wiki/About\">About</a> <a href=\"/wiki/Privacy\">Privacy</a></footer>"
+        "<script>track('pageview');</script>"
+        "</body></html>"
+    )
+
+
+def article_page(rng, title, paragraphs=40):
+    """Returns an article page with title and roughly the given number of paragraphs."""
+    nav = _nav(rng)
+    body = []
+    for index in range(paragraphs):
+        if index % 7 == 3:
+            body.append(f"<h2>{_words(rng, 3).title()}</h2>")
+        if index % 11 == 5:
+            body.append(f"<pre><code>def {rng.choice(WORDS)}(n):\n    return n</code></pre>")
+        body.append(f"<p>{_paragraph(rng)}</p>")
+        if index % 13 == 7:
+            body.append("<p></p>")
+    return _article_html(title, nav, body)
+
+
+# Markup that real pages get wrong and that parsers repair in different ways
+MALFORMED_MARKUP = (
+    "<p>{0}<div>{1}</div>{2}</p>",  # block element inside a paragraph
+    "<ul><li><p>{0}</li><li>{1}</li></ul>{2}",  # paragraph closed by the end of its list item
+    "<blockquote><p>{0}</blockquote>{1}<p>{2}",  # paragraph closed by an enclosing end tag
+    "<p>{0}<p>{1}</p>{2}</p>",  # paragraph opened inside an unclosed one
+    "<p>{0}<table><tr><td>{1}</td></tr></table>{2}</p>",
+    "<p>{0} <b>{1} <i>{2}</b> tail</i></p>",  # misnested inline elements
+    "<p>{0}</span>{1}</br>{2}</p></p>",  # stray end tags
+    "<p>{0} &amp {1} &copy &#150; &nbsp;{2}</p>",  # entities missing their semicolon
+    "<p>  <b>{0}</b>\n  <i>{1}</i>  </p>{2}",  # whitespace-only text between inline elements
+    "<pre><p>{0}\n  </p></pre><P CLASS=x>{1}<br/>{2}</P>",
+    "<p>{0}<script>document.write('<p>x</p>')</script><![CDATA[{1}]]><!-- {2} -->",  # never closed
+)
+
+
+def malformed_article_page(rng, title, paragraphs=40):
+    """Returns an article page whose paragraphs use the malformed markup of MALFORMED_MARKUP."""
+    nav = _nav(rng)
+    body = [rng.choice(MALFORMED_MARKUP).format(_sentence(rng), _sentence(rng), _sentence(rng))
+            for _ in range(paragraphs)]
+    return _article_html(title, nav, body)
+
+
+def _result_href(site, rng, index):
+    slug = "-".join(rng.choice(WORDS) for _ in range(3))
+    return {
+        "Wikipedia": f"/wiki/{slug.replace('-', '_').capitalize()}",
+        "Medium": f"https://medium.com/@{rng.choice(WORDS)}/{slug}-{index:x}",
+        "Dev.to": f"https://dev.to/{rng.choice(WORDS)}/{slug}",
+        "GeeksforGeeks": f"/{rng.choice(['articles', 'geeks'])}/{slug}/",
+        "Tutorialspoint": f"/tutorials/{slug}.htm",
+        "Stack Overflow": f"/questions/{10000 + index}/{slug}",
+        "W3Schools": f"/{rng.choice(WORDS)}/{slug}.asp",
+    }.get(site, f"/articles/{slug}")
+
+
+def _noise_href(site, rng):
+    word = rng.choice(WORDS)
+    return rng.choice({
+        "Wikipedia": [f"/wiki/Special:Search?search={word}", f"/wiki/Help:{word}", "/w/index.php?title=Main",
+                      f"/wiki/Category:{word}", "#top"],
+        "Medium": [f"https://medium.com/tag/{word}", "https://medium.com/", "/m/signin", "https://help.medium.com/"],
+        "Dev.to": [f"https://dev.to/t/{word}", "https://dev.to/", "/enter", "https://forem.com"],
+        "GeeksforGeeks": [f"/tag/{word}/", "https://www.geeksforgeeks.org/", "/courses/", "#main"],
+        "Tutorialspoint": [f"https://www.tutorialspoint.com/{word}/index.htm", "/index.htm", "/about/"],
+        "Stack Overflow": [f"/questions/tagged/{word}", "/users/login", "https://stackoverflow.co/", "/questions/ask"],
+        "W3Schools": ["/", "/html/default.asp", "https://profile.w3schools.com/"],
+    }.get(site, ["/", "#top"]))
+
+
+def search_page(site, rng, results=20):
+    """Returns a search results page for site with the given number of results."""
+    links = []
+    for index in range(results):
+        for _ in range(rng.randint(1, 4)):
+            links.append(f'<a href="{_noise_href(site, rng)}">{rng.choice(WORDS)}</a>')
+        href = _result_href(site, rng, index)
+        links.append(f'<div class="result"><a href="{href}"><h3>{_words(rng, 5)}</h3></a>'
+                     f"<p>{_sentence(rng)}</p></div>")
+        # Result lists commonly link the same article twice (title and thumbnail)
+        if rng.random() < 0.3:
+            links.append(f'<a href="{href}"><img alt=""></a>')
+    return (
+        f"<!DOCTYPE html><html><head><title>{site} search</title>"
+        "<script>var q = location.search;</script></head><body>"
+        f"<header><a href=\"/\">{site}</a></header><main>{''.join(links)}</main>"
+        "<a>no href</a></body></html>"
+    )
+
+
+def generate(seed=0, articles=20, paragraphs=40, malformed=5):
+    """Returns a {file name: html} dict of one search page per site, the article pages and malformed ones."""
+    rng = random.Random(seed)
+    pages = {}
+    for site in SEARCH_SITES:
+        pages[f"search_{site_slug(site)}.html"] = search_page(site, rng)
+    for index in range(articles):
+        title = _words(rng, 3).title()
+        pages[f"article_{index:03d}.html"] = article_page(rng, title, rng.randint(paragraphs // 2, paragraphs * 2))
+    for index in range(malformed):
+        title = _words(rng, 3).title()
+        pages[f"article_malformed_{index:03d}.html"] = malformed_article_page(rng, title, paragraphs)
+    return pages
+
+
+def site_recordings(search_urls, article_links, seed=0, paragraphs=40):
+    """Returns {url: html} for every search page and every article linked from it.
+
+    search_urls is a list of (site, url) pairs and article_links(site, page)
+    returns the article URLs a scraper would follow from a search page.
+    """
+    rng = random.Random(f"{seed}:{search_urls}")
+    pages = {}
+    for site, url in search_urls:
+        page = search_page(site, rng)
+        pages[url] = page
+        for article_url in article_links(site, page):
+            if article_url not in pages:
+                title = _words(rng, 3).title()
+                pages[article_url] = article_page(rng, title, rng.randint(paragraphs // 2, paragraphs * 2))
+    return pages
+
+
+def huge_article_blocks(size, seed=0):
+    """Yields one article page of about size bytes as str blocks, without ever building it whole.
+
+    The content of a regular article page is repeated between its head and
+    its footer until the page reaches the requested size.
+    """
+    page = article_page(random.Random(seed), "Huge Article", paragraphs=40)
+    content_start = page.index('<div class="content">') + len('<div class="content">')
+    content_end = page.index("</div></main>")
+    head, content, tail = page[:content_start], page[content_start:content_end], page[content_end:]
+    yield head
+    for _ in range(max(1, (size - len(head) - len(tail)) // len(content))):
+        yield content
+    yield tail
+
+
+def transcript_pieces(words, seed=0, words_per_piece=20):
+    """Yields transcript segment texts adding up to the given number of words."""
+    rng = random.Random(seed)
+    for start in range(0, words, words_per_piece):
+        yield _words(rng, min(words_per_piece, words - start))
+
+
+def write_speech_wav(path, seconds=30.0, rate=44100, channels=2, seed=0):
+    """Writes a 16-bit WAV of voiced bursts (harmonics with a moving pitch) separated by quiet pauses."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    total = int(seconds * rate)
+    signal = rng.normal(0, 0.003, total)  # room noise
+    position = 0
+    while position < total:
+        position += int(rng.uniform(0.3, 1.2) * rate)  # pause
+        length = min(int(rng.uniform(1.0, 4.0) * rate), total - position)
+        if length <= 0:
+            break
+        t = np.arange(length) / rate
+        pitch = rng.uniform(100, 220) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(2, 5) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / rate
+        voiced = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 6))
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * np.arange(length) / length))
+        signal[position:position + length] += 0.25 * voiced * envelope
+        position += length
+    samples = (np.clip(signal, -1, 1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.repeat(samples[:, None], channels, axis=1).tobytes())
+
+
+def load(directory=None, seed=0, articles=20):
+    """Returns (search pages, article pages) from a fixture directory, or generated ones."""
+    if directory is None:
+        pages = generate(seed, articles)
+    else:
+        pages = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".html"):
+                with open(os.path.join(directory, name), encoding='utf-8') as f:
+                    pages[name] = f.read()
+    search_pages = {name: html for name, html in pages.items() if name.startswith("search_")}
+    article_pages = {name: html for name, html in pages.items() if name.startswith("article_")}
+    return search_pages, article_pages
+
+
+def write(directory, seed=0, articles=20):
+    os.makedirs(directory, exist_ok=True)
+    for name, html in generate(seed, articles).items():
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the generated HTML fixtures to a directory.")
+    parser.add_argument("directory")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--articles", type=int, default=20)
+    args = parser.parse_args()
+    write(args.directory, args.seed, args.articles)
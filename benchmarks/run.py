@@ -0,0 +1,406 @@
+"""Offline end-to-end benchmark of the scraper and the transcriber, with a regression gate.
+
+Scrape: every site in ``app.direct_access_sites``/``app.traversal_sites`` is
+replayed from a local fixture server, and each query goes through the
+pipeline ``app.build_pipeline`` builds for ``app.scrape_resources`` (discover
+-> fetch -> parse -> dedup -> chunk -> summarize), with the caches left out
+and near-duplicates looked up in an in-memory fingerprint index. The deterministic stub summarizer is used unless
+``--model`` names a (small, locally available) summarization model.
+``--summarizer-workers N`` runs the summarizer in a ``worker_pool`` of N
+processes.
+
+Transcribe: a generated speech-like recording goes through the stages of
+``transcription.generate_transcript``: by default the in-memory path
+(load_audio -> transcribe -> format), or with ``--audio-path files`` the
+file-based one (extract_audio -> convert_audio -> transcribe -> format).
+``--segment-workers N`` transcribes the in-memory audio span by span with
+``transcription.transcribe_segments`` across N processes. Streaming
+(``transcription.stream_transcript``) is timed to its first segment and to
+the end. A
+stage whose dependency is missing (moviepy for extract_audio, pydub/ffmpeg for
+convert_audio) is reported as skipped. The stub transcriber is used unless
+``--whisper`` names a model.
+
+The run reports throughput, p50/p95 latency per query and per stage, and peak
+RSS. The run fails when any metric is worse than the baseline (written by
+``--save-baseline`` on the machine that runs the gate) by more than
+``--tolerance``. A missing baseline fails the run as well, unless
+``--allow-missing-baseline`` is given, so the gate never passes unchecked.
+
+    python -m benchmarks.run [--queries N] [--model NAME] [--whisper NAME] [--save-baseline]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import app
+import models
+import pipeline
+import transcription
+import worker_pool
+from benchmarks import fixtures
+from benchmarks.fixture_server import FixtureServer
+from benchmarks.stubs import StubSummarizer, StubWhisper
+from dedup import FingerprintIndex
+from fetching import Fetcher
+from scheduling import HostScheduler
+from summarization import DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, eligible_chunks, iter_paragraph_chunks
+
+QUERIES = ["dynamic programming", "binary search tree", "graph traversal", "hash table", "sorting algorithms"]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Metrics where a larger value is better; all others are times or sizes
+HIGHER_IS_BETTER = ("_per_s", "realtime_factor")
+# Time differences below this many seconds are noise, whatever the relative change
+MIN_TIME_DELTA = 0.002
+# Rates computed from a single timing; a drop only counts if that timing also grew noticeably
+DERIVED_FROM = {'transcribe.realtime_factor': 'transcribe.total_p50_s'}
+
+
+def percentile(samples, fraction):
+    """Returns the nearest-rank percentile of samples, or 0.0 if there are none."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def peak_rss_mib():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class Timings:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[stage].append(time.perf_counter() - start)
+
+    def wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            with self.measure(stage):
+                return function(*args, **kwargs)
+        return timed
+
+    def metrics(self, prefix):
+        result = {}
+        for stage, samples in self.samples.items():
+            result[f"{prefix}.{stage}_p50_s"] = percentile(samples, 0.5)
+            result[f"{prefix}.{stage}_p95_s"] = percentile(samples, 0.95)
+        return result
+
+
+class ReplayFetcher(Fetcher):
+    """A Fetcher whose requests go to the fixture server standing in for each host."""
+
+    def __init__(self, server, timings, **options):
+        super().__init__(**options)
+        self.server = server
+        self.timings = timings
+
+    async def fetch(self, url):
+        with self.timings.measure('fetch'):
+            return await super().fetch(self.server.local_url(url))
+
+
+class TimedChunker:
+    """Times each article's chunking by chunker, or by word count when the pipeline has no chunker."""
+
+    def __init__(self, chunker, timings):
+        chunk = (chunker.chunk if chunker is not None
+                 else lambda text: list(eligible_chunks(text, DEFAULT_CHUNK_SIZE)))
+        iter_chunks = (chunker.iter_chunks if chunker is not None
+                       else lambda texts: iter_paragraph_chunks(texts, DEFAULT_CHUNK_SIZE))
+        self.chunk = timings.wrap('chunk', chunk)
+        # Materialized so the time is spent inside the measurement
+        self.iter_chunks = timings.wrap('chunk', lambda texts: list(iter_chunks(texts)))
+
+
+def timed_paragraphs(timings, extract_paragraphs):
+    """Times each page's parse on its own by collecting its paragraphs before they are chunked."""
+    def parse(page):
+        return list(extract_paragraphs(page))
+    return timings.wrap('parse', parse)
+
+
+@contextlib.contextmanager
+def timed_summarize(timings):
+    # The pipeline looks summarize_chunks up at call time, so each model batch can be timed here
+    original = pipeline.summarize_chunks
+    pipeline.summarize_chunks = timings.wrap('summarize', original)
+    try:
+        yield
+    finally:
+        pipeline.summarize_chunks = original
+
+
+def search_urls(query):
+    sites = {**app.direct_access_sites, **app.traversal_sites}
+    return [(site, f"{info['url']}{info['query_format'](query)}") for site, info in sites.items()]
+
+
+def article_links(n):
+    def links(site, page):
+        if site == "Wikipedia":
+            return app.extract_wikipedia_links(page, n)
+        return app.extract_article_links(site, page, n)
+    return links
+
+
+async def _scrape(queries, server, summarizer, timings, n, batch_size):
+    records = 0
+    latencies = []
+    # One scheduler and fingerprint index for the whole run, as app.py shares them across queries
+    scheduler = HostScheduler()
+    dedup = FingerprintIndex(":memory:")
+    for query in queries:
+        start = time.perf_counter()
+        async with ReplayFetcher(server, timings, user_agents=[app.headers["User-Agent"]],
+                                 scheduler=scheduler) as fetcher:
+            scrape = app.build_pipeline(fetcher, summarizer, batch_size, use_cache=False)
+            scrape.extract_paragraphs = timed_paragraphs(timings, scrape.extract_paragraphs)
+            scrape.chunker = TimedChunker(scrape.chunker, timings)
+            scrape.dedup = dedup
+            records += len(await scrape.run(app.discover_articles(fetcher, query, n)))
+        latencies.append(time.perf_counter() - start)
+    dedup.close()
+    return records, latencies
+
+
+def bench_scrape(args):
+    queries = (QUERIES * (args.queries // len(QUERIES) + 1))[:args.queries]
+    pages = {}
+    for query in queries:
+        pages.update(fixtures.site_recordings(search_urls(query), article_links(args.n)))
+
+    if args.model == "stub":
+        summarizer = StubSummarizer()
+    else:
+        summarizer = models.get_summarizer(args.model, backend=args.backend, num_threads=args.threads)
+    if args.summarizer_workers > 1:
+        summarizer = worker_pool.SummarizerPool(summarizer, args.summarizer_workers, args.threads,
+                                                model_name=args.model)
+    timings = Timings()
+
+    with FixtureServer(pages, args.latency) as server, timed_summarize(timings):
+        start = time.perf_counter()
+        records, latencies = asyncio.run(_scrape(queries, server, summarizer, timings, args.n, args.batch_size))
+        elapsed = time.perf_counter() - start
+    if args.summarizer_workers > 1:
+        summarizer.close()
+
+    metrics = {
+        'scrape.queries_per_s': len(queries) / elapsed,
+        'scrape.articles_per_s': records / elapsed,
+        'scrape.query_p50_s': percentile(latencies, 0.5),
+        'scrape.query_p95_s': percentile(latencies, 0.95),
+    }
+    metrics.update(timings.metrics('scrape'))
+    return metrics, {'queries': len(queries), 'articles': records, 'pages': len(pages)}
+
+
+def _make_video(audio_file, video_file):
+    from moviepy.editor import AudioFileClip, ColorClip
+
+    audio = AudioFileClip(audio_file)
+    clip = ColorClip(size=(64, 64), color=(0, 0, 0), duration=audio.duration).set_audio(audio)
+    clip.write_videofile(video_file, fps=1, codec="libx264", audio_codec="aac", logger=None)
+
+
+def _available(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def bench_transcription(args):
+    if args.whisper == "stub":
+        models.register("whisper", "stub", StubWhisper())
+    timings = Timings()
+    skipped = {}
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "speech.wav")
+        fixtures.write_speech_wav(source, args.audio_seconds)
+        # Stands in for convert_audio's output when pydub is not installed
+        converted = os.path.join(directory, "speech_16k.wav")
+        fixtures.write_speech_wav(converted, args.audio_seconds, rate=16000, channels=1)
+
+        video = None
+        if _available("moviepy.editor"):
+            video = os.path.join(directory, "speech.mp4")
+            _make_video(source, video)
+        elif args.audio_path == "files":
+            skipped['extract_audio'] = "moviepy is not installed"
+        if args.audio_path == "files" and not _available("pydub"):
+            skipped['convert_audio'] = "pydub is not installed"
+        if args.audio_path == "memory" and transcription._ffmpeg_executable() is None:
+            skipped['ffmpeg'] = "not installed; load_audio reads the WAV in-process"
+
+        totals = []
+        # The transcription steps print their progress; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            for run in range(args.transcribe_runs):
+                start = time.perf_counter()
+                if args.audio_path == "memory":
+                    with timings.measure('load_audio'):
+                        samples = transcription.load_audio(video or source)
+                    with timings.measure('transcribe'):
+                        if args.segment_workers:
+                            transcript = transcription.segments_text(transcription.transcribe_segments(
+                                samples, args.whisper, args.segment_workers))
+                        else:
+                            transcript = transcription.transcribe_audio_whisper(samples, args.whisper)
+                    with timings.measure('format'):
+                        transcription.format_transcript(transcript)
+                    totals.append(time.perf_counter() - start)
+                    continue
+                audio = source
+                if video is not None:
+                    audio = os.path.join(directory, f"extracted_{run}.mp3")
+                    with timings.measure('extract_audio'):
+                        transcription.extract_audio(video, audio)
+                if 'convert_audio' not in skipped:
+                    output = os.path.join(directory, f"converted_{run}.wav")
+                    with timings.measure('convert_audio'):
+                        transcription.convert_audio(audio, output)
+                else:
+                    output = converted
+                with timings.measure('transcribe'):
+                    transcript = transcription.transcribe_audio_whisper(output, args.whisper)
+                with timings.measure('format'):
+                    transcription.format_transcript(transcript)
+                totals.append(time.perf_counter() - start)
+
+            # Streaming: how soon the first text appears, and the cost of the overlapping windows
+            first_segments = []
+            stream_totals = []
+            for run in range(args.transcribe_runs):
+                start = time.perf_counter()
+                for index, _ in enumerate(transcription.stream_transcript(video or source, args.whisper)):
+                    if not index:
+                        first_segments.append(time.perf_counter() - start)
+                stream_totals.append(time.perf_counter() - start)
+
+    metrics = {
+        'transcribe.realtime_factor': args.audio_seconds / percentile(totals, 0.5),
+        'transcribe.total_p50_s': percentile(totals, 0.5),
+        'transcribe.total_p95_s': percentile(totals, 0.95),
+        'transcribe.stream_first_segment_p50_s': percentile(first_segments, 0.5),
+        'transcribe.stream_total_p50_s': percentile(stream_totals, 0.5),
+    }
+    metrics.update(timings.metrics('transcribe'))
+    return metrics, skipped
+
+
+def compare(metrics, baseline, tolerance):
+    """Returns (metric, baseline value, current value) for every metric worse than the baseline allows."""
+    regressions = []
+    for name, expected in baseline.items():
+        if name not in metrics:
+            continue
+        current = metrics[name]
+        if any(marker in name for marker in HIGHER_IS_BETTER):
+            worse = current < expected * (1 - tolerance)
+            timing = DERIVED_FROM.get(name)
+            if timing in metrics and timing in baseline:
+                worse = worse and metrics[timing] - baseline[timing] > MIN_TIME_DELTA
+        else:
+            worse = current > expected * (1 + tolerance)
+            if name.endswith("_s"):
+                worse = worse and current - expected > MIN_TIME_DELTA
+        if worse:
+            regressions.append((name, expected, current))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=len(QUERIES), help="number of queries to scrape")
+    parser.add_argument("-n", type=int, default=5, help="articles followed per site")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--model", default="stub", help="summarization model, or 'stub'")
+    parser.add_argument("--backend", default="torch", choices=models.BACKENDS,
+                        help="inference backend of the summarization model")
+    parser.add_argument("--threads", type=int, help="inference threads for the summarization model")
+    parser.add_argument("--summarizer-workers", type=int, default=1,
+                        help="summarizer processes sharing the model weights (threads is then per process)")
+    parser.add_argument("--whisper", default="stub", help="Whisper model, or 'stub'")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the fixture server delays each response")
+    parser.add_argument("--audio-seconds", type=float, default=60.0)
+    parser.add_argument("--transcribe-runs", type=int, default=3)
+    parser.add_argument("--segment-workers", type=int,
+                        help="transcribe speech segments across this many processes")
+    parser.add_argument("--audio-path", default="memory", choices=["memory", "files"],
+                        help="decode audio in memory, or through the intermediate files")
+    parser.add_argument("--skip", action="append", default=[], choices=["scrape", "transcribe"])
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--allow-missing-baseline", action="store_true",
+                        help="report the results and succeed when there is no baseline to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    config = {'queries': args.queries, 'n': args.n, 'batch_size': args.batch_size, 'model': args.model,
+              'backend': args.backend, 'threads': args.threads, 'summarizer_workers': args.summarizer_workers,
+              'skip': sorted(set(args.skip)),
+              'whisper': args.whisper, 'latency': args.latency, 'audio_seconds': args.audio_seconds,
+              'audio_path': args.audio_path, 'segment_workers': args.segment_workers}
+    metrics = {}
+    details = {}
+    if "scrape" not in args.skip:
+        scrape_metrics, details['scrape'] = bench_scrape(args)
+        metrics.update(scrape_metrics)
+    if "transcribe" not in args.skip:
+        transcribe_metrics, details['transcribe_skipped'] = bench_transcription(args)
+        metrics.update(transcribe_metrics)
+    metrics['peak_rss_mib'] = peak_rss_mib()
+
+    for name, value in details.items():
+        print(f"{name}: {value}")
+    for name in sorted(metrics):
+        print(f"{name:<36} {metrics[name]:>12.4f}")
+    results = {'config': config, 'metrics': metrics, 'details': details}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0 if args.allow_missing_baseline else 2
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['config'] != config:
+        print(f"Baseline was recorded with {baseline['config']}, not {config}; not comparing.")
+        return 2
+    regressions = compare(metrics, baseline['metrics'], args.tolerance)
+    for name, expected, current in regressions:
+        print(f"REGRESSION {name}: {current:.4f} vs baseline {expected:.4f}")
+    if not regressions:
+        print(f"No regressions beyond {args.tolerance:.0%} of the baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
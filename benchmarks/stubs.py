@@ -0,0 +1,64 @@
+"""Deterministic stand-ins for the models, so benchmarks run without weights or a GPU.
+
+They do no real work, which leaves the measured time to everything around the
+model: fetching, parsing, chunking, batching and bookkeeping. Pass a real model
+name to the benchmarks to include inference.
+
+``stub_tokenizer`` is the exception: a real byte-level BPE tokenizer, built
+the way BART's is but trained on the fixtures' vocabulary, so token chunking
+can be exercised without downloading a model.
+"""
+import wave
+
+# Sample rate of the arrays whisper accepts in place of a file
+SAMPLE_RATE = 16000
+# Words per second of audio the stub transcriber "hears"
+SPEECH_RATE = 2.5
+
+
+class StubSummarizer:
+    """Mimics the transformers summarization pipeline by returning the leading words of each chunk."""
+
+    tokenizer = None
+    model = None
+
+    def __call__(self, texts, max_length=130, min_length=30, do_sample=False, batch_size=None):
+        return [{'summary_text': " ".join(text.split()[:max(min_length, max_length // 2)])} for text in texts]
+
+
+class StubWhisper:
+    """Mimics whisper's transcribe by emitting a fixed word stream sized to the audio's duration."""
+
+    words = "so the idea behind dynamic programming is to store the answers to overlapping subproblems".split()
+
+    def transcribe(self, audio, **options):
+        if isinstance(audio, str):
+            with wave.open(audio, 'rb') as f:
+                duration = f.getnframes() / f.getframerate()
+        else:
+            duration = len(audio) / SAMPLE_RATE
+        count = int(duration * SPEECH_RATE)
+        text = " ".join(self.words[i % len(self.words)] for i in range(count))
+        return {'text': " " + text, 'segments': [], 'language': 'en'}
+
+
+def stub_tokenizer(vocab_size=1000):
+    """Returns a fast byte-level BPE tokenizer (BART's scheme) trained on the fixture vocabulary."""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, processors, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    from benchmarks.fixtures import WORDS
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    special_tokens = ["<s>", "<pad>", "</s>", "<unk>"]
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=special_tokens,
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    sentences = [" ".join(WORDS[i:] + WORDS[:i]).capitalize() + "." for i in range(len(WORDS))]
+    tokenizer.train_from_iterator(sentences, trainer)
+    tokenizer.post_processor = processors.RobertaProcessing(("</s>", tokenizer.token_to_id("</s>")),
+                                                            ("<s>", tokenizer.token_to_id("<s>")),
+                                                            trim_offsets=True)
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, model_max_length=1024, bos_token="<s>",
+                                   eos_token="</s>", pad_token="<pad>", unk_token="<unk>")
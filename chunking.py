@@ -0,0 +1,213 @@
+"""Token-aware, sentence-aligned chunking for the summarizer.
+
+``split_text`` cuts articles every 300 words, which says nothing about how many
+tokens BART actually sees and forces every chunk to be tokenized again inside
+the pipeline. ``TokenChunker`` tokenizes an article once, splits the token
+stream at sentence boundaries and packs whole sentences into chunks as close to
+``token_budget`` as possible. The chunks are returned as token ID lists that go
+straight to ``model.generate``, and the too-short filter and generation lengths
+are computed from their token counts.
+
+``content_defined_chunks`` and ``content_defined_groups`` serve the
+hierarchical summarizer instead: they cut where the content says rather than
+every N words, so an edit to a long transcript moves only the chunk
+boundaries next to it and every other chunk stays byte-for-byte the same.
+"""
+import re
+import zlib
+
+DEFAULT_TOKEN_BUDGET = 1000
+MIN_CHUNK_TOKENS = 40
+
+# A sentence ends at ., ! or ? (optionally followed by closing quotes/brackets) and whitespace
+SENTENCE_END = re.compile(r'[.!?]["\')\]]*\s+')
+# The same ending, up to the whitespace, for text that stops right before it
+SENTENCE_CLOSE = re.compile(r'[.!?]["\')\]]*$')
+_WHITESPACE = re.compile(r'\s+')
+# Once a group holds half its target words, it ends after a unit whose checksum is divisible by this
+BOUNDARY_DIVISOR = 4
+# Characters of a long text split into words at a time by word_blocks
+WORD_BLOCK_CHARS = 64 * 1024
+# Characters of text TokenChunker tokenizes at a time
+TOKENIZE_CHARS = 16 * 1024
+
+
+class TokenChunker:
+    def __init__(self, tokenizer, token_budget=DEFAULT_TOKEN_BUDGET, min_chunk_tokens=MIN_CHUNK_TOKENS):
+        self.tokenizer = tokenizer
+        # Leave room for the special tokens the model adds around every input
+        limit = tokenizer.model_max_length - tokenizer.num_special_tokens_to_add()
+        self.token_budget = min(token_budget, limit)
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def _sentence_token_spans(self, text):
+        """Tokenizes text once and returns the token IDs of each sentence."""
+        if getattr(self.tokenizer, 'is_fast', False):
+            encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                                      verbose=False)
+            ids = encoding['input_ids']
+            # Whitespace ending the text stays with its last sentence, however its token's offsets are trimmed
+            sentence_starts = [match.end() for match in SENTENCE_END.finditer(text) if match.end() < len(text)]
+            sentences = []
+            current = []
+            next_start = 0
+            for token_id, (start, _) in zip(ids, encoding['offset_mapping']):
+                crossed = False
+                while next_start < len(sentence_starts) and sentence_starts[next_start] <= start:
+                    next_start += 1
+                    crossed = True
+                if crossed and current:
+                    sentences.append(current)
+                    current = []
+                current.append(token_id)
+            if current:
+                sentences.append(current)
+            return sentences
+
+        # Slow tokenizers have no offsets, so tokenize the sentences (with their punctuation) in one batched call
+        sentences = split_sentences(text)
+        if not sentences:
+            return []
+        return self.tokenizer(sentences, add_special_tokens=False, verbose=False)['input_ids']
+
+    def chunk(self, text):
+        """Returns the token ID lists of the chunks of text worth summarizing."""
+        return list(self.iter_chunks([text]))
+
+    def iter_chunks(self, texts):
+        """Yields the chunks worth summarizing of a text given in pieces, e.g. paragraphs.
+
+        The chunks are those chunk would return for the pieces joined with
+        spaces, but the text is tokenized about TOKENIZE_CHARS at a time, so
+        only that much of it and the chunk being packed are held at once.
+        """
+        return (chunk for chunk in self._pack(texts) if len(chunk) >= self.min_chunk_tokens)
+
+    def _sentences(self, texts):
+        """Yields the token IDs of each sentence of the texts joined with spaces."""
+        buffer = None
+        unfinished = []  # tokens of a sentence the previous block ended in the middle of
+        for text in texts:
+            buffer = text if buffer is None else f"{buffer} {text}"
+            while len(buffer) >= TOKENIZE_CHARS:
+                cut, ends_sentence = _block_end(buffer, TOKENIZE_CHARS) or _block_end(buffer, len(buffer))
+                if not cut:
+                    break
+                sentences = self._sentence_token_spans(buffer[:cut])
+                buffer = buffer[cut:]
+                if unfinished:
+                    sentences[:1] = [unfinished + (sentences[0] if sentences else [])]
+                unfinished = [] if ends_sentence or not sentences else sentences.pop()
+                yield from sentences
+        sentences = self._sentence_token_spans(buffer) if buffer is not None else []
+        if unfinished:
+            sentences[:1] = [unfinished + (sentences[0] if sentences else [])]
+        yield from sentences
+
+    def _pack(self, texts):
+        current = []
+        for sentence in self._sentences(texts):
+            if current and len(current) + len(sentence) > self.token_budget:
+                yield current
+                current = []
+            # A single sentence longer than the budget is cut into budget-sized pieces
+            while len(sentence) > self.token_budget:
+                yield sentence[:self.token_budget]
+                sentence = sentence[self.token_budget:]
+            current.extend(sentence)
+        if current:
+            yield current
+
+
+def _block_end(text, limit):
+    """Returns (position, ends a sentence) of the best place to cut text for tokenizing, or (0, False).
+
+    Text is only cut before the last space of a whitespace run followed by
+    more text: a byte-level BPE tokenizer (BART's) splits such a run into the
+    rest of the run and a space that belongs to the next word, so the two
+    pieces tokenize exactly like the whole. The last such run that ends a
+    sentence before limit is preferred, then the last run of any kind.
+    """
+    best = (0, False)
+    for match in _WHITESPACE.finditer(text, 0, limit):
+        end = match.end()
+        while end < len(text) and text[end].isspace():
+            end += 1
+        if end == len(text) or text[end - 1] != ' ' or end - 1 == 0:
+            continue
+        start = match.start()
+        ends_sentence = start > 0 and text[start - 1] in '.!?"\')]' and bool(
+            SENTENCE_CLOSE.search(text, max(0, start - 256), start))
+        if ends_sentence or not best[1]:
+            best = (end - 1, ends_sentence)
+    return best
+
+
+def word_blocks(text, block_chars=WORD_BLOCK_CHARS):
+    """Yields the words of text as lists covering about block_chars characters each.
+
+    Same words as text.split(), but a long text never has all of its words
+    in one list. Blocks are cut at whitespace, so no word is split.
+    """
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + block_chars)
+        while end < len(text) and not text[end].isspace():
+            end += 1
+        yield text[start:end].split()
+        start = end
+
+
+def split_sentences(text):
+    """Returns the sentences of text, each stripped of surrounding whitespace."""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        sentences.append(text[start:match.end()].strip())
+        start = match.end()
+    sentences.append(text[start:].strip())
+    return [sentence for sentence in sentences if sentence]
+
+
+def content_defined_groups(units, target_words):
+    """Groups consecutive text units into runs of about target_words words, at content-chosen boundaries.
+
+    A run may end once it holds half of target_words, after a unit whose
+    checksum hits one in BOUNDARY_DIVISOR, and is always ended before it grows
+    past one and a half times target_words. The boundaries depend on the units
+    themselves rather than on their positions, so inserting or removing text
+    only changes the runs around the edit.
+    """
+    groups = []
+    current = []
+    words = 0
+    for unit in units:
+        size = len(unit.split())
+        if current and words + size > target_words * 3 // 2:
+            groups.append(current)
+            current, words = [], 0
+        current.append(unit)
+        words += size
+        if words >= target_words // 2 and zlib.crc32(unit.encode('utf-8')) % BOUNDARY_DIVISOR == 0:
+            groups.append(current)
+            current, words = [], 0
+    if current:
+        # A short tail is folded into the run before it rather than summarized on its own
+        if groups and words < target_words // 2:
+            groups[-1].extend(current)
+        else:
+            groups.append(current)
+    return groups
+
+
+def content_defined_chunks(text, target_words):
+    """Splits text into chunks of whole sentences of about target_words words, at content-chosen boundaries."""
+    units = []
+    for sentence in split_sentences(text):
+        words = sentence.split()
+        # Unpunctuated text (e.g. a raw transcript) has no sentences to cut at
+        if len(words) > target_words:
+            units.extend(" ".join(words[i:i + target_words]) for i in range(0, len(words), target_words))
+        else:
+            units.append(sentence)
+    return [" ".join(group) for group in content_defined_groups(units, target_words)]
@@ -0,0 +1,250 @@
+"""Near-duplicate article detection with URL canonicalization and MinHash.
+
+Search results often point at the same content more than once: a Wikipedia
+redirect and its target, a mobile and a desktop URL, a tracking query, or a
+tutorial syndicated to several sites. Before an article is summarized, the
+pipeline asks the ``FingerprintIndex`` whether its text is a near-duplicate of
+one seen before:
+
+* URLs are canonicalized first (``canonical_url``), so the same page reached
+  through different links is one entry;
+* the extracted text is fingerprinted with a MinHash signature of its word
+  5-shingles, and locality-sensitive hashing (the signature cut into bands)
+  finds candidate matches without comparing against every stored article;
+* a candidate whose estimated Jaccard similarity reaches ``threshold`` makes
+  the new article its duplicate, and the summary recorded for the original is
+  reused instead of running the model again.
+
+The index is a SQLite file, so fingerprints and summaries persist across
+queries and processes. It is bounded to ``max_entries`` articles; the least
+recently seen are evicted first.
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+DEFAULT_INDEX_PATH = "fingerprints.sqlite3"
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_THRESHOLD = 0.8
+SHINGLE_WORDS = 5
+NUM_PERMUTATIONS = 64
+# 16 bands of 4 rows: pairs above ~0.5 similarity almost always share a band
+BANDS = 16
+# Query parameters that only track where a click came from
+TRACKING_PARAMETERS = re.compile(r"^(utm_\w+|ref|ref_src|source|fbclid|gclid|mc_cid|mc_eid|trk|sk)$")
+
+_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(1)
+# Both below 2**31 so that a * hash + b stays within 64 bits for 32-bit shingle hashes
+_A = _rng.integers(1, 1 << 31, NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, NUM_PERMUTATIONS, dtype=np.uint64)
+_WORD = re.compile(r"\w+")
+
+
+def canonical_url(url):
+    """Returns url in a canonical form: same page, same string.
+
+    The scheme and host are lower-cased, mobile Wikipedia hosts mapped to the
+    desktop ones, the fragment and tracking parameters dropped, the remaining
+    parameters sorted, and a trailing slash removed. Wikipedia titles are
+    unquoted with spaces written as underscores and the first letter
+    capitalized, as MediaWiki itself does.
+    """
+    scheme, netloc, path, query, _ = urlsplit(url)
+    netloc = netloc.lower()
+    if netloc.endswith(".m.wikipedia.org"):
+        netloc = netloc[:-len(".m.wikipedia.org")] + ".wikipedia.org"
+    if netloc.endswith("wikipedia.org") and path.startswith("/wiki/"):
+        title = unquote(path[len("/wiki/"):]).replace(" ", "_")
+        path = "/wiki/" + title[:1].upper() + title[1:]
+    parameters = sorted((name, value) for name, value in parse_qsl(query, keep_blank_values=True)
+                        if not TRACKING_PARAMETERS.match(name.lower()))
+    return urlunsplit((scheme.lower(), netloc, path.rstrip("/") or "/", urlencode(parameters), ""))
+
+
+class MinHasher:
+    """Builds the MinHash signature of a text given in pieces, e.g. paragraphs, split between words."""
+
+    def __init__(self):
+        self.word_count = 0
+        # The last words seen, which start shingles that end in the next piece
+        self._tail = []
+        self._signature = np.full(NUM_PERMUTATIONS, np.iinfo(np.uint64).max, dtype=np.uint64)
+
+    def update(self, text):
+        words = self._tail + _WORD.findall(text.lower())
+        self.word_count += len(words) - len(self._tail)
+        if len(words) >= SHINGLE_WORDS:
+            hashes = np.fromiter(
+                {zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode('utf-8'))
+                 for i in range(len(words) - SHINGLE_WORDS + 1)},
+                dtype=np.uint64)
+            # Blocks keep the permutation matrix small for book-length texts
+            for start in range(0, len(hashes), 4096):
+                block = hashes[start:start + 4096]
+                permuted = (_A[:, None] * block[None, :] + _B[:, None]) % _PRIME
+                self._signature = np.minimum(self._signature, permuted.min(axis=1))
+        self._tail = words[-(SHINGLE_WORDS - 1):]
+
+    def signature(self):
+        """Returns the signature of the text so far, or None if it has too few words."""
+        if self.word_count < SHINGLE_WORDS:
+            return None
+        return self._signature.copy()
+
+
+def minhash(text):
+    """Returns the MinHash signature of text's word 5-shingles, or None if it has too few words."""
+    hasher = MinHasher()
+    hasher.update(text)
+    return hasher.signature()
+
+
+def similarity(signature, other):
+    """Returns the Jaccard similarity estimated from two MinHash signatures."""
+    return float(np.mean(signature == other))
+
+
+def _band_keys(signature):
+    rows = NUM_PERMUTATIONS // BANDS
+    return [
+        (band, int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(),
+                                              digest_size=8).digest(), 'big', signed=True))
+        for band in range(BANDS)
+    ]
+
+
+class FingerprintIndex:
+    def __init__(self, path=DEFAULT_INDEX_PATH, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.duplicates = 0
+        self.originals = 0
+        self._lock = threading.Lock()
+        # Parse workers fingerprint articles from several threads, so the connection is shared behind a lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS articles ("
+                "url TEXT PRIMARY KEY, signature BLOB NOT NULL, original TEXT NOT NULL, "
+                "summary TEXT, model TEXT, last_seen INTEGER NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, bucket INTEGER NOT NULL, url TEXT NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS bands_url ON bands (url)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS articles_last_seen ON articles (last_seen)")
+
+    def _original_of(self, url):
+        row = self._conn.execute("SELECT original FROM articles WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def _best_match(self, url, signature):
+        candidates = set()
+        for band, bucket in _band_keys(signature):
+            rows = self._conn.execute("SELECT url FROM bands WHERE band = ? AND bucket = ?", (band, bucket))
+            candidates.update(candidate for (candidate,) in rows if candidate != url)
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            row = self._conn.execute("SELECT signature FROM articles WHERE url = ?", (candidate,)).fetchone()
+            if row is None:
+                continue
+            score = similarity(signature, np.frombuffer(row[0], dtype=np.uint64))
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def match(self, url, text):
+        """Fingerprints an article and returns (canonical url, canonical url of its original).
+
+        The original is the article itself unless an earlier one had
+        near-identical text. The article is added to the index either way.
+        """
+        return self.match_signature(url, minhash(text))
+
+    def match_signature(self, url, signature):
+        """Like match, for an article already fingerprinted (minhash or MinHasher.signature)."""
+        url = canonical_url(url)
+        if signature is None:
+            return url, url
+        now = time.time_ns()
+        with self._lock, self._conn:
+            match = self._best_match(url, signature)
+            # Duplicates point at the first article of their group, never at another duplicate
+            original = (self._original_of(match) or match) if match else url
+            previous = self._conn.execute("SELECT signature FROM articles WHERE url = ?", (url,)).fetchone()
+            if previous is not None and similarity(signature, np.frombuffer(previous[0], dtype=np.uint64)) >= 1.0:
+                self._conn.execute("UPDATE articles SET original = ?, last_seen = ? WHERE url = ?",
+                                   (original, now, url))
+            else:
+                # New or changed text: a summary recorded for the old text no longer applies
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO articles (url, signature, original, summary, model, last_seen) "
+                    "VALUES (?, ?, ?, NULL, NULL, ?)", (url, signature.tobytes(), original, now))
+                self._conn.execute("DELETE FROM bands WHERE url = ?", (url,))
+                self._conn.executemany("INSERT INTO bands (band, bucket, url) VALUES (?, ?, ?)",
+                                       [(band, bucket, url) for band, bucket in _band_keys(signature)])
+            self._evict()
+            if original == url:
+                self.originals += 1
+            else:
+                self.duplicates += 1
+        return url, original
+
+    def _evict(self):
+        (entries,) = self._conn.execute("SELECT COUNT(*) FROM articles").fetchone()
+        excess = entries - self.max_entries
+        if excess > 0:
+            stale = [url for (url,) in self._conn.execute(
+                "SELECT url FROM articles ORDER BY last_seen LIMIT ?", (excess,))]
+            self._conn.executemany("DELETE FROM articles WHERE url = ?", [(url,) for url in stale])
+            self._conn.executemany("DELETE FROM bands WHERE url = ?", [(url,) for url in stale])
+
+    def record_summary(self, url, summary, model_name):
+        """Stores the summary generated for an article, for its duplicates to reuse."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE articles SET summary = ?, model = ? WHERE url = ?",
+                               (summary, model_name, canonical_url(url)))
+
+    def summary_of(self, url, model_name):
+        """Returns the summary recorded for an article by the given model, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT summary, model FROM articles WHERE url = ?",
+                                     (canonical_url(url),)).fetchone()
+        if row is None or row[1] != model_name:
+            return None
+        return row[0]
+
+    def stats(self):
+        """Returns duplicate/original counters for this process and the current entry count."""
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM articles").fetchone()
+            return {'duplicates': self.duplicates, 'originals': self.originals, 'entries': entries}
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM articles")
+            self._conn.execute("DELETE FROM bands")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_fingerprint_index(path=DEFAULT_INDEX_PATH):
+    """Returns the process-wide fingerprint index, opening it on first use."""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = FingerprintIndex(path)
+        return _default_index
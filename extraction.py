@@ -0,0 +1,329 @@
+"""HTML extraction for search and article pages, with pluggable parser backends.
+
+The scrapers only ever need two things from a page: the ``href`` of every
+``<a>`` on a search page, and the text of every ``<p>`` on an article page.
+Building a full BeautifulSoup tree for that is the slowest possible way to get
+them, so each backend here answers exactly those two questions:
+
+* ``bs4`` - the original full-DOM ``html.parser`` path, kept as the reference;
+* ``strainer`` - the same parser, but a ``SoupStrainer`` means only ``<a href>``
+  or ``<p>`` elements are ever built into a tree;
+* ``lxml`` - libxml2's C parser, walking just the elements of interest;
+* ``stream`` - the standard library's incremental ``HTMLParser`` fed the page
+  in blocks, which hands out each ``<p>`` (or ``<a href>``) as soon as it is
+  closed and keeps only the names of the open elements, so no tree is built
+  at all. (libxml2's HTML push parser holds on to every byte it is fed, so it
+  cannot do this.)
+
+All four return the same links and text on well-formed pages: text inside
+``<script>``/``<style>`` and comments is skipped, and ``strip=True`` matches
+``get_text(strip=True)``. Malformed markup (a ``<p>`` closed by its ``</li>``,
+a ``<div>`` inside a ``<p>``) is repaired differently by each parser, though:
+``stream`` replays the ``bs4`` tree builder's rules and keeps returning the
+same text, while ``strainer`` and ``lxml`` can differ. ``stream`` is therefore
+the default, and its memory stays bounded however large the page is.
+``iter_links`` and ``iter_paragraphs`` also take a page as an iterable of
+blocks (e.g. an open file) and yield its links or paragraphs one at a time.
+"""
+import codecs
+import html
+from collections import Counter
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import HTMLTreeBuilder
+from bs4.dammit import EntitySubstitution
+
+from instrumentation import span
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+
+def _bs4_links(page_content):
+    soup = BeautifulSoup(page_content, 'html.parser')
+    return [link['href'] for link in soup.find_all('a', href=True)]
+
+
+def _bs4_paragraphs(page_content, strip):
+    soup = BeautifulSoup(page_content, 'html.parser')
+    return [para.get_text(strip=strip) for para in soup.find_all('p')]
+
+
+def _strainer_links(page_content):
+    soup = BeautifulSoup(page_content, 'html.parser', parse_only=SoupStrainer('a', href=True))
+    return [link['href'] for link in soup.find_all('a', href=True)]
+
+
+def _strainer_paragraphs(page_content, strip):
+    soup = BeautifulSoup(page_content, 'html.parser', parse_only=SoupStrainer('p'))
+    return [para.get_text(strip=strip) for para in soup.find_all('p')]
+
+
+# Elements whose text BeautifulSoup's get_text leaves out
+_NON_TEXT_TAGS = set(HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS)
+
+
+def _lxml_root(page_content):
+    if not page_content or not page_content.strip():
+        return None
+    # Parsing bytes sidesteps lxml's refusal of str input that carries an encoding declaration
+    parser = lxml.html.HTMLParser(encoding='utf-8')
+    try:
+        return lxml.html.document_fromstring(page_content.encode('utf-8'), parser=parser)
+    except etree.ParserError:
+        return None
+
+
+def _lxml_strings(element):
+    if element.text:
+        yield element.text
+    for child in element:
+        # Comments and processing instructions have a non-string tag; only their tail is text
+        if isinstance(child.tag, str) and child.tag not in _NON_TEXT_TAGS:
+            yield from _lxml_strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def _lxml_links(page_content):
+    root = _lxml_root(page_content)
+    if root is None:
+        return []
+    return [href for href in (link.get('href') for link in root.iter('a')) if href is not None]
+
+
+def _lxml_paragraphs(page_content, strip):
+    root = _lxml_root(page_content)
+    if root is None:
+        return []
+    if strip:
+        return [''.join(text.strip() for text in _lxml_strings(para)) for para in root.iter('p')]
+    return [''.join(_lxml_strings(para)) for para in root.iter('p')]
+
+
+def _blocks(page_content):
+    """Yields a page given as str, bytes (UTF-8) or an iterable of either as str pieces of FEED_BLOCK or less."""
+    if isinstance(page_content, (str, bytes)):
+        page_content = [page_content]
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for part in page_content:
+        for start in range(0, len(part), FEED_BLOCK):
+            block = part[start:start + FEED_BLOCK]
+            # A character split between two byte blocks is completed by the next one
+            yield decoder.decode(block) if isinstance(block, bytes) else block
+    yield decoder.decode(b"", final=True)
+
+
+class _StreamCollector(HTMLParser):
+    """Collects <p> texts or <a href> targets as the standard library's incremental parser reads a page.
+
+    Paragraphs come out as BeautifulSoup's ``html.parser`` tree builder would
+    make them, so malformed markup gives the same text as the ``bs4`` backend:
+    an end tag closes everything opened after the latest open element of its
+    name (and is ignored if there is none), a ``<p>`` inside a ``<p>`` nests,
+    and void elements hold no text. Only the names of the open elements are
+    kept, never a tree, and a paragraph is handed out once it and every
+    paragraph around it are closed.
+    """
+
+    def __init__(self, links, strip):
+        # Character references are resolved below, the way BeautifulSoup resolves them
+        super().__init__(convert_charrefs=False)
+        self.links = links
+        self.strip = strip
+        self.found = []
+        self._open = []  # names of the open elements, outermost first
+        self._paragraphs = []  # (depth, entry) of each open <p>, outermost first
+        self._pending = []  # [parts, closed] entries of the paragraphs not handed out yet, in document order
+        self._node = []  # pieces of the current text node, which the parser may split
+        self._skipping = 0  # open elements whose strings get_text leaves out
+        self._preserving = 0  # open elements that keep whitespace-only strings as they are
+        self._closed_voids = Counter()  # void elements closed at their start tag, whose end tag is then ignored once
+
+    def _end_node(self, cdata=False):
+        if not self._node:
+            return
+        text = ''.join(self._node)
+        self._node = []
+        if self._skipping and not cdata:
+            return
+        if not self._preserving and not text.strip(_ASCII_SPACES):
+            text = '\n' if '\n' in text else ' '
+        if self.strip:
+            text = text.strip()
+        for _, entry in self._paragraphs:
+            entry[0].append(text)
+
+    def _start(self, tag):
+        self._end_node()
+        self._open.append(tag)
+        if tag == 'p':
+            entry = [[], False]
+            self._pending.append(entry)
+            self._paragraphs.append((len(self._open), entry))
+        self._skipping += tag in _NON_TEXT_TAGS
+        self._preserving += tag in _PRESERVE_WHITESPACE_TAGS
+
+    def _end(self, tag):
+        self._end_node()
+        if tag in self._open:
+            self._close_from(len(self._open) - 1 - self._open[::-1].index(tag))
+
+    def _close_from(self, depth):
+        for name in self._open[depth:]:
+            self._skipping -= name in _NON_TEXT_TAGS
+            self._preserving -= name in _PRESERVE_WHITESPACE_TAGS
+        del self._open[depth:]
+        while self._paragraphs and self._paragraphs[-1][0] > depth:
+            self._paragraphs.pop()[1][1] = True
+        self._hand_out()
+
+    def _hand_out(self):
+        closed = 0
+        for parts, done in self._pending:
+            if not done:
+                break
+            self.found.append(''.join(parts))
+            closed += 1
+        del self._pending[:closed]
+
+    def end_document(self):
+        """Closes every element still open, as the end of the page does in a tree."""
+        self._end_node()
+        self._close_from(0)
+
+    def handle_starttag(self, tag, attrs):
+        if self.links:
+            if tag == 'a':
+                href = dict(attrs).get('href')
+                if href is not None:
+                    self.found.append(href)
+            return
+        self._start(tag)
+        if tag in _VOID_TAGS:
+            self._end(tag)
+            self._closed_voids[tag] += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self.links:
+            self.handle_starttag(tag, attrs)
+            return
+        self._start(tag)
+        self._end(tag)
+
+    def handle_endtag(self, tag):
+        if self.links:
+            return
+        if self._closed_voids[tag]:
+            self._closed_voids[tag] -= 1
+        else:
+            self._end(tag)
+
+    def handle_data(self, data):
+        # Only text inside a <p> is kept
+        if self._paragraphs:
+            self._node.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(_ENTITIES.get(name, f"&{name}"))
+
+    def handle_charref(self, name):
+        self.handle_data(html.unescape(f"&#{name};"))
+
+    def handle_comment(self, data):
+        self._end_node()
+
+    handle_decl = handle_pi = handle_comment
+
+    def unknown_decl(self, data):
+        self._end_node()
+        if data.upper().startswith('CDATA[') and self._paragraphs:
+            # get_text keeps CDATA sections, even inside <script> or <template>
+            self._node.append(data[len('CDATA['):])
+            self._end_node(cdata=True)
+
+
+# How BeautifulSoup's html.parser builder treats elements and strings, mirrored by the stream backend
+_VOID_TAGS = HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS
+_PRESERVE_WHITESPACE_TAGS = HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS
+_ASCII_SPACES = BeautifulSoup.ASCII_SPACES
+_ENTITIES = EntitySubstitution.HTML_ENTITY_TO_CHARACTER
+
+
+def _stream(page_content, links, strip=False):
+    collector = _StreamCollector(links, strip)
+    for block in _blocks(page_content):
+        collector.feed(block)
+        yield from collector.found
+        collector.found.clear()
+    collector.close()
+    collector.end_document()
+    yield from collector.found
+
+
+def _stream_links(page_content):
+    return list(_stream(page_content, links=True))
+
+
+def _stream_paragraphs(page_content, strip):
+    return list(_stream(page_content, links=False, strip=strip))
+
+
+# Backend name -> (links function, paragraphs function)
+backends = {
+    'bs4': (_bs4_links, _bs4_paragraphs),
+    'strainer': (_strainer_links, _strainer_paragraphs),
+    'stream': (_stream_links, _stream_paragraphs),
+}
+if lxml is not None:
+    backends['lxml'] = (_lxml_links, _lxml_paragraphs)
+
+DEFAULT_BACKEND = 'stream'
+# Characters fed to the incremental parsers at a time
+FEED_BLOCK = 64 * 1024
+
+
+def _backend(name):
+    name = name or DEFAULT_BACKEND
+    if name not in backends:
+        raise ValueError(f"Unknown extraction backend: {name}. Use one of: {', '.join(backends)}.")
+    return backends[name]
+
+
+def extract_links(page_content, backend=None):
+    """Returns the href of every <a href> on the page, in document order."""
+    with span('parse', kind='links'):
+        return _backend(backend)[0](page_content)
+
+
+def extract_paragraphs(page_content, strip=True, backend=None):
+    """Returns the text of every <p> on the page, in document order."""
+    with span('parse', kind='paragraphs'):
+        return _backend(backend)[1](page_content, strip)
+
+
+def iter_links(page_content):
+    """Yields the href of every <a href> on the page as soon as it is parsed.
+
+    The page is parsed a FEED_BLOCK at a time, so a caller that stops early
+    never parses the rest of it.
+    """
+    return _stream(page_content, links=True)
+
+
+def iter_paragraphs(page_content, strip=True):
+    """Yields the text of every <p> on the page as soon as it is parsed.
+
+    page_content may be a str, bytes (UTF-8) or an iterable of either, such
+    as an open file, so a page never has to be held in memory whole.
+    """
+    return _stream(page_content, links=False, strip=strip)
+
+
+def extract_text(page_content, strip=True, backend=None):
+    """Joins the text of every <p> on the page with single spaces."""
+    return " ".join(extract_paragraphs(page_content, strip, backend))
@@ -0,0 +1,125 @@
+"""Asynchronous page fetching with pooled keep-alive connections.
+
+A ``Fetcher`` owns one aiohttp session for its lifetime, so every request to
+the same host reuses the connections already open to it instead of paying a
+new TCP/TLS handshake. Requests are paced by a ``HostScheduler``, which caps
+concurrency globally and per host, rate-limits every host, slows a host down
+when it answers 429 or 5xx and honors its ``Retry-After``. Every request has a
+timeout, and transient failures (connection errors, timeouts, 429 and 5xx
+responses) are retried a bounded number of times with exponential backoff.
+
+An optional ``HttpCache`` serves fresh responses from disk and turns stale
+ones into conditional GETs, so an unchanged page costs a 304 instead of a
+full download.
+
+Nothing here is specific to the real sites, so the fetcher can be pointed at a
+local HTTP server in place of them.
+"""
+import asyncio
+import logging
+import random
+
+import aiohttp
+
+from instrumentation import count, span
+from scheduling import HostScheduler
+
+user_agents = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
+]
+
+# Status codes worth retrying; anything else that is not 2xx fails immediately
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class Fetcher:
+    def __init__(self, max_connections=20, max_per_host=4, timeout=15, retries=2, backoff=0.5,
+                 user_agents=user_agents, http_cache=None, scheduler=None):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.user_agents = user_agents
+        self.http_cache = http_cache
+        # Pass a shared scheduler to keep host rate limits and backoff across fetchers
+        self.scheduler = scheduler or HostScheduler(max_connections, max_per_host)
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_per_host)
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def _get(self, url):
+        headers = {"User-Agent": random.choice(self.user_agents)}
+        entry = self.http_cache.lookup(url) if self.http_cache is not None else None
+        if entry is not None:
+            if entry['fresh']:
+                self.http_cache.record(url, 'hit', entry['size'])
+                count('http_cache_hits')
+                return entry['body']
+            headers.update(self.http_cache.conditional_headers(entry))
+
+        async with self.scheduler.slot(url):
+            async with self.session.get(url, headers=headers) as response:
+                self.scheduler.report(url, response.status, response.headers.get("Retry-After"))
+                count('http_responses', status=response.status)
+                if response.status == 304 and entry is not None:
+                    self.http_cache.refresh(url, response.headers)
+                    self.http_cache.record(url, 'revalidated', entry['size'])
+                    return entry['body']
+                if response.status in RETRY_STATUSES:
+                    raise _RetryableStatus(response.status)
+                response.raise_for_status()
+                body = await response.read()
+                text = body.decode(response.get_encoding(), errors='replace')
+                if self.http_cache is not None:
+                    self.http_cache.store(url, response.headers, text, len(body))
+                    self.http_cache.record(url, 'miss', len(body))
+                return text
+
+    async def fetch(self, url):
+        """Returns the body of url, or None if it could not be retrieved."""
+        with span('fetch', url=url):
+            for attempt in range(self.retries + 1):
+                try:
+                    return await self._get(url)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError, _RetryableStatus) as e:
+                    if attempt == self.retries:
+                        logging.error(f"Request failed for {url}: {e}")
+                        count('fetch_failures')
+                        return None
+                    count('fetch_retries')
+                    delay = self.backoff * (2 ** attempt)
+                    # Jitter keeps retries against the same host from landing together
+                    await asyncio.sleep(delay + random.uniform(0, delay))
+                except aiohttp.ClientError as e:
+                    logging.error(f"Request failed for {url}: {e}")
+                    count('fetch_failures')
+                    return None
+
+    async def fetch_all(self, urls):
+        """Fetches every url concurrently and returns the bodies in the same order."""
+        return await asyncio.gather(*(self.fetch(url) for url in urls))
+
+
+async def _fetch_pages(urls, fetcher_options):
+    async with Fetcher(**fetcher_options) as fetcher:
+        return await fetcher.fetch_all(urls)
+
+
+def fetch_pages(urls, **fetcher_options):
+    """Synchronous wrapper around Fetcher.fetch_all for callers outside an event loop."""
+    return asyncio.run(_fetch_pages(list(urls), fetcher_options))
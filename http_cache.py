@@ -0,0 +1,206 @@
+"""On-disk HTTP response cache with conditional revalidation.
+
+Responses are stored zlib-compressed in a SQLite file together with their
+validators (``ETag``/``Last-Modified``) and a freshness deadline derived from
+``Cache-Control``/``Expires``. While an entry is fresh it is served without
+touching the network; once stale, the fetcher sends a conditional GET and a
+``304 Not Modified`` reuses the stored body. Hosts that send no caching headers
+at all can be given a fixed TTL through ``ttl_overrides``.
+
+Article text (or paragraphs) extracted from a cached body is stored as well,
+keyed by a digest of the body, so an unchanged page is not parsed again either.
+
+Hit, revalidation and miss counts, together with bytes downloaded and bytes
+saved, are tracked per host for the lifetime of the process.
+"""
+import email.utils
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+DEFAULT_CACHE_PATH = "http_cache.sqlite3"
+
+
+def parse_cache_control(value):
+    """Parses a Cache-Control header into a {directive: value or True} dict."""
+    directives = {}
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, argument = part.partition("=")
+        directives[name.strip().lower()] = argument.strip().strip('"') if argument else True
+    return directives
+
+
+def _http_date(value):
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _new_host_stats():
+    return {'hits': 0, 'revalidated': 0, 'misses': 0, 'bytes_downloaded': 0, 'bytes_saved': 0}
+
+
+class HttpCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_overrides=None, default_ttl=0):
+        self.path = path
+        # Seconds an entry stays fresh for hosts that send no freshness information
+        self.ttl_overrides = ttl_overrides or {}
+        self.default_ttl = default_ttl
+        self._stats = defaultdict(_new_host_stats)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "url TEXT PRIMARY KEY, body BLOB NOT NULL, size INTEGER NOT NULL, digest TEXT NOT NULL, "
+                "etag TEXT, last_modified TEXT, expires_at REAL NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS extracts ("
+                "digest TEXT NOT NULL, extractor TEXT NOT NULL, text BLOB NOT NULL, "
+                "PRIMARY KEY (digest, extractor))")
+
+    def _freshness_deadline(self, url, headers, now):
+        cache_control = parse_cache_control(headers.get("Cache-Control"))
+        if "no-cache" in cache_control:
+            return now
+        if "max-age" in cache_control:
+            try:
+                return now + int(cache_control["max-age"])
+            except ValueError:
+                return now
+        if headers.get("Expires"):
+            return _http_date(headers["Expires"]) or now
+        host = urlsplit(url).netloc
+        return now + self.ttl_overrides.get(host, self.default_ttl)
+
+    def lookup(self, url):
+        """Returns the cached entry for url as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, size, etag, last_modified, expires_at FROM responses WHERE url = ?",
+                (url,)).fetchone()
+        if row is None:
+            return None
+        body, size, etag, last_modified, expires_at = row
+        return {
+            'body': zlib.decompress(body).decode('utf-8'),
+            'size': size,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': expires_at > time.time(),
+        }
+
+    def conditional_headers(self, entry):
+        """Returns the headers that turn a GET for a cached entry into a conditional one."""
+        headers = {}
+        if entry['etag']:
+            headers["If-None-Match"] = entry['etag']
+        if entry['last_modified']:
+            headers["If-Modified-Since"] = entry['last_modified']
+        return headers
+
+    def store(self, url, headers, body, size):
+        """Stores a 200 response unless its Cache-Control forbids it."""
+        if "no-store" in parse_cache_control(headers.get("Cache-Control")):
+            return
+        encoded = body.encode('utf-8')
+        digest = hashlib.sha256(encoded).hexdigest()
+        expires_at = self._freshness_deadline(url, headers, time.time())
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (url, body, size, digest, etag, last_modified, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, zlib.compress(encoded), size, digest, headers.get("ETag"),
+                 headers.get("Last-Modified"), expires_at))
+
+    def refresh(self, url, headers):
+        """Extends the freshness of an entry after a 304, picking up any new validators."""
+        expires_at = self._freshness_deadline(url, headers, time.time())
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE responses SET expires_at = ?, etag = COALESCE(?, etag), "
+                "last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (expires_at, headers.get("ETag"), headers.get("Last-Modified"), url))
+
+    def record(self, url, outcome, size):
+        """Counts a 'hit', 'revalidated' or 'miss' of size bytes against the url's host."""
+        with self._lock:
+            host_stats = self._stats[urlsplit(url).netloc]
+            if outcome == 'miss':
+                host_stats['misses'] += 1
+                host_stats['bytes_downloaded'] += size
+            else:
+                host_stats[outcome if outcome == 'revalidated' else 'hits'] += 1
+                host_stats['bytes_saved'] += size
+
+    def extract(self, page, extract_text):
+        """Returns extract_text(page), reusing the stored result for an identical page."""
+        digest = hashlib.sha256(page.encode('utf-8')).hexdigest()
+        extractor = f"{extract_text.__module__}.{extract_text.__qualname__}"
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM extracts WHERE digest = ? AND extractor = ?", (digest, extractor)).fetchone()
+        if row is not None:
+            return zlib.decompress(row[0]).decode('utf-8')
+        text = extract_text(page)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extracts (digest, extractor, text) VALUES (?, ?, ?)",
+                (digest, extractor, zlib.compress(text.encode('utf-8'))))
+        return text
+
+    def extract_paragraphs(self, page, extract_paragraphs):
+        """Yields extract_paragraphs(page), replaying the stored paragraphs for an identical page."""
+        digest = hashlib.sha256(page.encode('utf-8')).hexdigest()
+        extractor = f"{extract_paragraphs.__module__}.{extract_paragraphs.__qualname__}"
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM extracts WHERE digest = ? AND extractor = ?", (digest, extractor)).fetchone()
+        if row is not None:
+            yield from json.loads(zlib.decompress(row[0]).decode('utf-8'))
+            return
+        paragraphs = []
+        for paragraph in extract_paragraphs(page):
+            paragraphs.append(paragraph)
+            yield paragraph
+        # Only a page parsed to the end is stored
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extracts (digest, extractor, text) VALUES (?, ?, ?)",
+                (digest, extractor, zlib.compress(json.dumps(paragraphs).encode('utf-8'))))
+
+    def stats(self):
+        """Returns a {host: counters} dict for every host fetched through the cache."""
+        with self._lock:
+            return {host: dict(host_stats) for host, host_stats in self._stats.items()}
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM extracts")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_http_cache(path=DEFAULT_CACHE_PATH):
+    """Returns the process-wide HTTP cache, opening it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = HttpCache(path)
+        return _default_cache
@@ -0,0 +1,287 @@
+"""Lightweight spans, counters and histograms for finding where a query spends its time.
+
+Code is instrumented with ``span(name)`` context managers (or the
+``instrumented(name)`` decorator) around fetching, parsing, chunking,
+summarization, model loading and the transcription steps, and with ``count``
+for events such as retries and cache hits. Every finished span is recorded in
+a ``span_seconds`` histogram labelled with its name and, while a
+``query_timing`` block is active, added to that query's timing breakdown.
+Context variables carry the active breakdown into the pipeline's tasks and
+worker threads, so concurrent queries keep separate totals.
+
+Instrumentation is off by default. While it is off, ``span`` returns a shared
+no-op context manager and ``count``/``observe`` return at once, so the
+instrumented code pays one global lookup per call. It is switched on by
+``enable()`` or by these environment variables:
+
+* ``SCRAPER_INSTRUMENT=1`` - collect metrics and per-query breakdowns;
+* ``SCRAPER_METRICS_FILE=path`` - also write Prometheus text format at exit;
+* ``SCRAPER_TRACE_FILE=path`` - also record every span and write a JSON trace
+  (Chrome trace-event format, viewable in Perfetto or chrome://tracing) at exit.
+"""
+import atexit
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# Spans kept for the trace file; later ones are counted as dropped
+MAX_TRACE_EVENTS = 200000
+
+enabled = False
+tracing = False
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_trace_events = []
+_current_query = contextvars.ContextVar('instrumentation_query', default=None)
+_epoch = time.perf_counter()
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+def _labels_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _observe(name, value, labels):
+    key = _labels_key(name, labels)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = _Histogram()
+    histogram.observe(value)
+
+
+class _Span:
+    __slots__ = ('name', 'attributes', 'start')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.perf_counter()
+        duration = end - self.start
+        with _lock:
+            _observe('span_seconds', duration, {'span': self.name})
+            if exc_type is not None:
+                _counters[_labels_key('span_errors', {'span': self.name})] += 1
+            if tracing:
+                if len(_trace_events) < MAX_TRACE_EVENTS:
+                    _trace_events.append({
+                        'name': self.name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                        'ts': (self.start - _epoch) * 1e6, 'dur': duration * 1e6, 'args': self.attributes,
+                    })
+                else:
+                    _counters[_labels_key('trace_events_dropped', {})] += 1
+        timing = _current_query.get()
+        if timing is not None:
+            timing.add(self.name, duration)
+        return False
+
+
+def span(name, **attributes):
+    """Times the enclosed block as a span called name; attributes go to the trace only."""
+    if not enabled:
+        return _NOOP_SPAN
+    return _Span(name, attributes)
+
+
+def instrumented(name):
+    """Decorator that runs every call of the function inside span(name)."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1, **labels):
+    """Adds value to the counter called name with the given labels."""
+    if not enabled:
+        return
+    with _lock:
+        _counters[_labels_key(name, labels)] += value
+
+
+def observe(name, value, **labels):
+    """Records value in the histogram called name with the given labels."""
+    if not enabled:
+        return
+    with _lock:
+        _observe(name, value, labels)
+
+
+class QueryTiming:
+    """Time spent in each kind of span while a query ran.
+
+    Stages overlap in the pipeline, so the per-span totals can add up to more
+    than the query's wall-clock time.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.wall = 0.0
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.totals[name] += seconds
+            self.counts[name] += 1
+
+    def as_dict(self):
+        return {'query': self.query, 'wall_seconds': self.wall,
+                'spans': {name: {'seconds': self.totals[name], 'count': self.counts[name]} for name in self.totals}}
+
+    def report(self):
+        parts = [f"{name} {seconds:.2f}s ({self.counts[name]})"
+                 for name, seconds in sorted(self.totals.items(), key=lambda item: -item[1])]
+        return f"Query {self.query!r} took {self.wall:.2f}s: " + (", ".join(parts) or "no spans recorded")
+
+
+@contextlib.contextmanager
+def query_timing(query, log=True):
+    """Collects the spans finished inside the block into a QueryTiming for query.
+
+    With log set, the breakdown is logged at INFO level when the block ends.
+    """
+    timing = QueryTiming(query)
+    if not enabled:
+        yield timing
+        return
+    token = _current_query.set(timing)
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing.wall = time.perf_counter() - start
+        try:
+            _current_query.reset(token)
+        except ValueError:
+            # An async generator may finish in a different context than it started in
+            _current_query.set(None)
+        if log:
+            logging.info(timing.report())
+
+
+def enable(trace=False):
+    global enabled, tracing
+    enabled = True
+    tracing = trace
+
+
+def disable():
+    global enabled, tracing
+    enabled = False
+    tracing = False
+
+
+def reset():
+    """Clears every counter, histogram and recorded span."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _trace_events.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def prometheus_text():
+    """Returns every counter and histogram in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+        for previous, ((name, labels), value) in zip([None] + counters, counters):
+            if previous is None or previous[0][0] != name:
+                lines.append(f"# TYPE {name}_total counter")
+            lines.append(f"{name}_total{_format_labels(labels)} {value:g}")
+        for previous, ((name, labels), histogram) in zip([None] + histograms, histograms):
+            if previous is None or previous[0][0] != name:
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+
+
+def write_trace(path):
+    """Writes the recorded spans as a Chrome trace-event JSON file."""
+    with _lock:
+        events = list(_trace_events)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def _configure_from_environment():
+    metrics_file = os.environ.get("SCRAPER_METRICS_FILE")
+    trace_file = os.environ.get("SCRAPER_TRACE_FILE")
+    if os.environ.get("SCRAPER_INSTRUMENT", "") not in ("", "0") or metrics_file or trace_file:
+        enable(trace=bool(trace_file))
+    if metrics_file:
+        atexit.register(write_prometheus, metrics_file)
+    if trace_file:
+        atexit.register(write_trace, trace_file)
+
+
+_configure_from_environment()
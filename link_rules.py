@@ -0,0 +1,90 @@
+"""Declarative article-link rules for search pages.
+
+Each site entry may carry a ``links`` dict describing which anchors on its
+search page are articles:
+
+* ``prefixes`` - hrefs starting with any of these are candidates;
+* ``patterns`` - regexes; hrefs matching any of them at the start are candidates;
+* ``base`` - the URL relative hrefs are resolved against;
+* ``exclude`` - regexes searched in the resolved URL's path; a hit drops the link;
+* ``keep_query`` - keep the query string (dropped by default, as it is mostly
+  tracking parameters on these sites).
+
+The prefixes and patterns of a site are compiled into a single regex, and its
+exclusions into another, the first time the rules are used. Links are
+canonicalized (resolved, lower-cased host, no fragment) so that the same
+article linked twice - or once with a tracking query - is counted once, and
+the page stops being parsed (``extraction.iter_links`` reads it a block at
+a time) as soon as ``n`` articles are found.
+"""
+import re
+import threading
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+from extraction import iter_links
+from instrumentation import span
+
+
+class LinkRule:
+    def __init__(self, rules):
+        alternatives = [re.escape(prefix) for prefix in rules.get("prefixes", ())]
+        alternatives += [f"(?:{pattern})" for pattern in rules.get("patterns", ())]
+        if not alternatives:
+            raise ValueError("A link rule needs at least one prefix or pattern.")
+        self.include = re.compile("|".join(alternatives))
+        exclude = rules.get("exclude", ())
+        self.exclude = re.compile("|".join(f"(?:{pattern})" for pattern in exclude)) if exclude else None
+        self.base = rules.get("base", "")
+        self.keep_query = rules.get("keep_query", False)
+
+    def canonicalize(self, href):
+        """Resolves href against the base and returns it in canonical form."""
+        scheme, netloc, path, query, _ = urlsplit(urljoin(self.base, href))
+        return urlunsplit((scheme.lower(), netloc.lower(), path or "/", query if self.keep_query else "", ""))
+
+    def match(self, href):
+        """Returns the canonical article URL for href, or None if it is not an article link."""
+        if not self.include.match(href):
+            return None
+        url = self.canonicalize(href)
+        if self.exclude is not None and self.exclude.search(urlsplit(url).path):
+            return None
+        return url
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def compile_rules(rules):
+    """Returns the compiled LinkRule for a site's links dict, compiling it only once."""
+    key = id(rules)
+    with _compiled_lock:
+        entry = _compiled.get(key)
+        # The dict is kept alongside its rule so that its id cannot be reused while cached
+        if entry is None or entry[0] is not rules:
+            entry = _compiled[key] = (rules, LinkRule(rules))
+        return entry[1]
+
+
+def find_article_links(page_content, rules, n=5):
+    """Returns the first n distinct article links on a search page, or [] if the site has no rules."""
+    if not rules:
+        return []
+    rule = compile_rules(rules)
+    article_links = []
+    seen = set()
+    with span('parse', kind='links'):
+        for href in iter_links(page_content):
+            url = rule.match(href)
+            if url is None:
+                continue
+            # A trailing slash does not make a different article
+            key = url.rstrip("/")
+            if key in seen:
+                continue
+            seen.add(key)
+            article_links.append(url)
+            if len(article_links) >= n:
+                break
+    return article_links
@@ -0,0 +1,223 @@
+"""Process-wide registry for the heavy models used by the scrapers and transcriber.
+
+Each model is loaded once per process, lazily on first use, and then shared by
+every caller. Loading is guarded by a per-model lock so the worker threads in
+``scrape_traversal_sites`` can all ask for the same model at once and still only
+pay for one load. Long-running workers can load models ahead of time with
+``warm_up`` and release them with ``evict``.
+
+On CPU-only nodes the summarization models can run on a lighter inference
+backend, chosen when the summarizer is constructed (or through the
+``SUMMARIZATION_BACKEND`` environment variable):
+
+* ``torch`` - the fp32 PyTorch model, as before;
+* ``int8`` - the same model with its Linear layers dynamically quantized to int8;
+* ``onnx`` - the model exported once to ONNX (kept under ``ONNX_EXPORT_DIR``)
+  and run by ONNX Runtime.
+
+``set_inference_threads`` (or ``INFERENCE_THREADS``) caps the threads used for
+inference by PyTorch and by ONNX Runtime sessions created afterwards.
+"""
+import gc
+import logging
+import os
+import threading
+
+from instrumentation import span
+
+SUMMARIZATION_MODEL = "facebook/bart-large-cnn"
+SUMMARIZATION_BACKEND = os.environ.get("SUMMARIZATION_BACKEND", "torch")
+WHISPER_MODEL = "base"
+ONNX_EXPORT_DIR = "onnx_models"
+BACKENDS = ("torch", "int8", "onnx")
+
+_inference_threads = int(os.environ.get("INFERENCE_THREADS", 0)) or None
+
+
+def set_inference_threads(num_threads):
+    """Caps the threads PyTorch and newly created ONNX Runtime sessions use for inference."""
+    global _inference_threads
+    _inference_threads = num_threads
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+def _quantize_int8(model):
+    import torch
+    # Weights of every Linear layer are stored as int8; activations are quantized on the fly
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _load_onnx_seq2seq(model_name):
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    options = onnxruntime.SessionOptions()
+    if _inference_threads:
+        options.intra_op_num_threads = _inference_threads
+    # Exporting takes minutes, so the graph is exported once and reused by later loads
+    export_path = os.path.join(ONNX_EXPORT_DIR, model_name.replace("/", "--"))
+    if os.path.isdir(export_path):
+        return ORTModelForSeq2SeqLM.from_pretrained(export_path, session_options=options)
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, session_options=options)
+    model.save_pretrained(export_path)
+    return model
+
+
+def _load_summarization_pipeline(model_name):
+    from transformers import pipeline
+    return pipeline("summarization", model=model_name)
+
+
+def _load_summarization_int8(model_name):
+    summarizer = _load_summarization_pipeline(model_name)
+    summarizer.model = _quantize_int8(summarizer.model)
+    summarizer.inference_backend = "int8"
+    return summarizer
+
+
+def _load_summarization_onnx(model_name):
+    from transformers import AutoTokenizer, pipeline
+    summarizer = pipeline("summarization", model=_load_onnx_seq2seq(model_name),
+                          tokenizer=AutoTokenizer.from_pretrained(model_name))
+    summarizer.inference_backend = "onnx"
+    return summarizer
+
+
+def _load_bart(model_name):
+    from transformers import BartForConditionalGeneration, BartTokenizer
+    tokenizer = BartTokenizer.from_pretrained(model_name)
+    model = BartForConditionalGeneration.from_pretrained(model_name)
+    return tokenizer, model
+
+
+def _load_bart_int8(model_name):
+    tokenizer, model = _load_bart(model_name)
+    return tokenizer, _quantize_int8(model)
+
+
+def _load_bart_onnx(model_name):
+    from transformers import BartTokenizer
+    return BartTokenizer.from_pretrained(model_name), _load_onnx_seq2seq(model_name)
+
+
+def _load_whisper(model_name):
+    import whisper
+    return whisper.load_model(model_name)
+
+
+# Model kinds and the functions that load them, keyed by the name passed to get_model
+loaders = {
+    "summarization": _load_summarization_pipeline,
+    "summarization-int8": _load_summarization_int8,
+    "summarization-onnx": _load_summarization_onnx,
+    "bart": _load_bart,
+    "bart-int8": _load_bart_int8,
+    "bart-onnx": _load_bart_onnx,
+    "whisper": _load_whisper,
+}
+
+_models = {}
+# Keys of the models installed with register rather than loaded
+_registered = set()
+_load_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _lock_for(key):
+    with _registry_lock:
+        if key not in _load_locks:
+            _load_locks[key] = threading.Lock()
+        return _load_locks[key]
+
+
+def get_model(kind, model_name):
+    """Returns the shared instance of a model, loading it on first use."""
+    key = (kind, model_name)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    if kind not in loaders:
+        raise ValueError(f"Unknown model kind: {kind}")
+
+    with _lock_for(key):
+        # Another thread may have finished loading while we waited for the lock
+        model = _models.get(key)
+        if model is None:
+            logging.info(f"Loading {kind} model {model_name}")
+            with span('model_load', kind=kind, model=model_name):
+                model = loaders[kind](model_name)
+            _models[key] = model
+    return model
+
+
+def backend_kind(kind, backend):
+    """Returns the registry kind of a model kind run on the given inference backend."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}. Use one of: {', '.join(BACKENDS)}.")
+    return kind if backend == "torch" else f"{kind}-{backend}"
+
+
+def get_summarizer(model_name=SUMMARIZATION_MODEL, backend=None, num_threads=None):
+    """Returns the shared summarization pipeline for the given inference backend."""
+    if num_threads:
+        set_inference_threads(num_threads)
+    return get_model(backend_kind("summarization", backend or SUMMARIZATION_BACKEND), model_name)
+
+
+def get_whisper_model(model_name=WHISPER_MODEL):
+    """Returns the shared Whisper model."""
+    return get_model("whisper", model_name)
+
+
+def register(kind, model_name, model):
+    """Installs an already-built model under (kind, model_name), e.g. a stand-in for benchmarks."""
+    with _registry_lock:
+        _models[(kind, model_name)] = model
+        _registered.add((kind, model_name))
+
+
+def registered_model(kind, model_name):
+    """Returns the model installed under (kind, model_name) with register, or None if it is loaded or absent."""
+    with _registry_lock:
+        return _models.get((kind, model_name)) if (kind, model_name) in _registered else None
+
+
+def warm_up(*keys):
+    """Loads the given (kind, model_name) pairs now instead of on first use."""
+    for kind, model_name in keys:
+        get_model(kind, model_name)
+
+
+def evict(kind=None, model_name=None):
+    """Drops loaded models so their memory can be reclaimed.
+
+    With no arguments every model is evicted; otherwise only those matching
+    the given kind and/or model name.
+    """
+    with _registry_lock:
+        keys = [
+            key for key in _models
+            if (kind is None or key[0] == kind) and (model_name is None or key[1] == model_name)
+        ]
+        for key in keys:
+            del _models[key]
+            _registered.discard(key)
+    if keys:
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+    return keys
+
+
+def loaded_models():
+    """Returns the (kind, model_name) pairs currently resident."""
+    return list(_models)
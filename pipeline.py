@@ -0,0 +1,412 @@
+"""Overlapped fetch -> parse -> summarize pipeline.
+
+Articles flow through three stages connected by bounded queues:
+
+* fetch workers download article pages through a shared ``Fetcher``;
+* parse workers extract, fingerprint and chunk each article in a thread pool,
+  so parsing never blocks the event loop;
+* a single summarizer stage batches chunks from whichever articles have been
+  parsed so far and runs the model in its own thread.
+
+With ``extract_paragraphs``, a parse worker makes a single pass over the page:
+each paragraph is fed to the MinHash fingerprint and to
+``summarization.iter_paragraph_chunks`` as soon as the parser yields it, so
+the article's full text is never joined into one string. Otherwise
+``extract_text`` returns the text whole and it is chunked in one piece.
+
+The network, the parsers and the model therefore work at the same time, and a
+full queue makes the stage in front of it wait, which keeps memory flat no
+matter how many articles a query produces.
+
+With ``target_words`` set, an article whose chunk summaries add up to more
+words is reduced hierarchically (``summarization.reduce_summaries``) on the
+model thread before its record is emitted.
+
+With a ``dedup.FingerprintIndex``, articles are deduplicated on the way:
+a job whose canonical URL was already queued in this run is not fetched
+again, and an article whose text is a near-duplicate of an earlier one reuses
+that article's summary instead of being summarized. Such records carry
+``'duplicate_of'`` (the original's URL), and the original's record lists
+them under ``'alternates'``.
+
+Jobs may carry a ``'query'``, which is copied into their records. With
+``report_failures`` set, a job whose page could not be fetched or held no
+text still produces a record, with ``'summary': None`` and an ``'error'``,
+so callers can tell when every job of a query is accounted for.
+
+``run`` returns every record in job order once the last article is done;
+``stream`` yields each record the moment its article is summarized.
+
+Jobs are dicts with ``'site'`` and ``'url'`` keys; a job may also carry the
+already-downloaded ``'page'``, in which case it skips the fetch stage.
+"""
+import asyncio
+import contextvars
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from dedup import MinHasher, canonical_url
+from instrumentation import count, span
+from summarization import (DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, iter_paragraph_chunks, reduce_summaries,
+                           summarize_chunks, summarizer_name)
+
+_DONE = object()
+
+
+class _Duplicates:
+    """What one run knows about the originals its duplicates are waiting for."""
+
+    def __init__(self):
+        # Canonical URL -> True once queued in this run
+        self.queued = set()
+        # Canonical URLs of the articles this run fingerprinted as originals
+        self.originals = set()
+        # Canonical URL -> the record emitted for it
+        self.records = {}
+        # Canonical URL -> [(position, job)] waiting for its record
+        self.waiting = defaultdict(list)
+        # Canonical URL -> why it produced no summary, for jobs that arrive after it was dropped
+        self.dropped = {}
+
+
+class Pipeline:
+    def __init__(self, fetcher, extract_text, summarizer, fetch_workers=8, parse_workers=2,
+                 queue_size=16, batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                 min_length=10, cache=None, chunker=None, target_words=None, dedup=None, report_failures=False,
+                 extract_paragraphs=None):
+        self.fetcher = fetcher
+        self.extract_text = extract_text
+        # Yields an article's paragraphs; takes precedence over extract_text
+        self.extract_paragraphs = extract_paragraphs
+        self.summarizer = summarizer
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.min_length = min_length
+        self.cache = cache
+        self.chunker = chunker
+        self.target_words = target_words
+        self.dedup = dedup
+        self.report_failures = report_failures
+
+    async def run(self, jobs):
+        """Runs every job through the pipeline and returns the records in job order."""
+        results = []
+
+        async def collect(position, record):
+            results.append((position, record))
+
+        await self._run(jobs, collect)
+        return [record for _, record in sorted(results, key=lambda result: result[0])]
+
+    async def stream(self, jobs):
+        """Yields each record as soon as its article is summarized, in completion order."""
+        records = asyncio.Queue(self.queue_size)
+
+        async def forward(position, record):
+            await records.put(record)
+
+        runner = asyncio.create_task(self._run(jobs, forward))
+        try:
+            while True:
+                getter = asyncio.ensure_future(records.get())
+                await asyncio.wait({getter, runner}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                while not records.empty():
+                    yield records.get_nowait()
+                # Surfaces any exception raised inside the pipeline
+                runner.result()
+                return
+        finally:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+    async def _run(self, jobs, emit):
+        job_queue = asyncio.Queue(self.queue_size)
+        page_queue = asyncio.Queue(self.queue_size)
+        text_queue = asyncio.Queue(self.queue_size)
+
+        duplicates = _Duplicates() if self.dedup is not None else None
+
+        with ThreadPoolExecutor(self.parse_workers) as parse_pool, ThreadPoolExecutor(1) as model_pool:
+            fetchers = [asyncio.create_task(self._fetch_worker(job_queue, page_queue, duplicates, emit))
+                        for _ in range(self.fetch_workers)]
+            parsers = [asyncio.create_task(self._parse_worker(page_queue, text_queue, parse_pool, duplicates, emit))
+                       for _ in range(self.parse_workers)]
+            summarizer = asyncio.create_task(self._summarize_stage(text_queue, model_pool, emit, duplicates))
+            driver = asyncio.create_task(self._drive(jobs, duplicates, emit, (job_queue, fetchers),
+                                                     (page_queue, parsers), (text_queue, [summarizer])))
+            tasks = fetchers + parsers + [summarizer, driver]
+            try:
+                # A failing stage would otherwise leave the others blocked on full queues
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in tasks:
+                    if task.done() and not task.cancelled() and task.exception():
+                        raise task.exception()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _drive(self, jobs, duplicates, emit, *stages):
+        await self._produce(jobs, stages[0][0], duplicates, emit)
+        # Shut the stages down front to back so every queued item is drained
+        for queue, workers in stages:
+            for _ in workers:
+                await queue.put(_DONE)
+            await asyncio.gather(*workers)
+
+    async def _produce(self, jobs, job_queue, duplicates, emit):
+        position = 0
+        if not hasattr(jobs, '__aiter__'):
+            jobs = _aiter(jobs)
+        async for job in jobs:
+            if duplicates is not None:
+                url = canonical_url(job['url'])
+                if url in duplicates.queued:
+                    # The same page reached through another link is neither fetched nor summarized again
+                    await self._attach_duplicate(url, position, job, duplicates, emit)
+                    position += 1
+                    continue
+                duplicates.queued.add(url)
+            await job_queue.put((position, job))
+            position += 1
+
+    async def _fetch_worker(self, job_queue, page_queue, duplicates, emit):
+        while True:
+            item = await job_queue.get()
+            if item is _DONE:
+                return
+            position, job = item
+            page = job.get('page')
+            if page is None:
+                page = await self.fetcher.fetch(job['url'])
+            if page:
+                await page_queue.put((position, job, page))
+            else:
+                await self._drop(position, job, "fetch failed", duplicates, emit)
+
+    async def _parse_worker(self, page_queue, text_queue, parse_pool, duplicates, emit):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await page_queue.get()
+            if item is _DONE:
+                return
+            position, job, page = item
+            # Run in a copy of this context so the query's instrumentation follows the work
+            parsed = await loop.run_in_executor(parse_pool, contextvars.copy_context().run,
+                                                self._parse, page, job['url'])
+            if parsed is None:
+                await self._drop(position, job, "no text", duplicates, emit)
+                continue
+            chunks, url, original = parsed
+            if original is not None and original == url:
+                duplicates.originals.add(url)
+                original = None
+            await text_queue.put((position, job, chunks, original))
+
+    def _parse(self, page, url):
+        """Chunks and fingerprints a page in one pass over its paragraphs.
+
+        Returns (chunks, canonical url, canonical url of its original), the
+        urls None without dedup, or None if the page has no text.
+        """
+        hasher = MinHasher() if self.dedup is not None else None
+        has_text = False
+
+        def paragraphs():
+            nonlocal has_text
+            for paragraph in self._paragraphs(page):
+                has_text = has_text or bool(paragraph.strip())
+                if hasher is not None:
+                    hasher.update(paragraph)
+                yield paragraph
+
+        with span('parse', kind='article'):
+            chunks = list(iter_paragraph_chunks(paragraphs(), self.chunk_size, self.chunker))
+        if not has_text:
+            return None
+        if hasher is None:
+            return chunks, None, None
+        return (chunks,) + self.dedup.match_signature(url, hasher.signature())
+
+    def _paragraphs(self, page):
+        http_cache = getattr(self.fetcher, 'http_cache', None)
+        if self.extract_paragraphs is None:
+            # Pages that came back unchanged reuse the text extracted last time
+            return [http_cache.extract(page, self.extract_text) if http_cache is not None
+                    else self.extract_text(page)]
+        if http_cache is not None:
+            return http_cache.extract_paragraphs(page, self.extract_paragraphs)
+        return self.extract_paragraphs(page)
+
+    async def _summarize_stage(self, text_queue, model_pool, emit, duplicates):
+        loop = asyncio.get_running_loop()
+        pending = []  # (article, chunk index, chunk) waiting for the model
+        done = False
+
+        async def accept(item):
+            nonlocal done
+            if item is _DONE:
+                done = True
+                return
+            position, job, chunks, original = item
+            if original is not None:
+                if original in duplicates.originals or original in duplicates.records:
+                    # The original is summarized in this run; its summary is shared once ready
+                    await self._attach_duplicate(original, position, job, duplicates, emit)
+                    return
+                summary = self.dedup.summary_of(original, self._summary_version())
+                if summary is not None:
+                    count('duplicate_articles')
+                    await self._emit_record(position, job, summary, duplicates, emit, duplicate_of=original)
+                    return
+                # Nothing recorded for the original, so this article is summarized after all
+            article = {'position': position, 'job': job, 'parts': [None] * len(chunks),
+                       'remaining': len(chunks)}
+            if not chunks:
+                await self._emit_article(article, emit, model_pool, duplicates)
+            pending.extend((article, index, chunk) for index, chunk in enumerate(chunks))
+
+        # A worker pool gets a model batch for each of its workers per call
+        call_size = self.batch_size * getattr(self.summarizer, 'workers', 1)
+        while True:
+            if not pending:
+                if done:
+                    return
+                await accept(await text_queue.get())
+            # Top the batch up with whatever is already parsed, but never wait for more
+            while not done and len(pending) < call_size and not text_queue.empty():
+                await accept(text_queue.get_nowait())
+            if not pending:
+                continue
+
+            batch = pending[:call_size]
+            del pending[:call_size]
+            summaries = await loop.run_in_executor(
+                model_pool, contextvars.copy_context().run, summarize_chunks, [chunk for _, _, chunk in batch],
+                self.summarizer, self.min_length, self.batch_size, self.cache)
+            for (article, index, _), summary in zip(batch, summaries):
+                article['parts'][index] = summary
+                article['remaining'] -= 1
+                if article['remaining'] == 0:
+                    await self._emit_article(article, emit, model_pool, duplicates)
+
+    def _summary_version(self):
+        # A summary recorded for duplicates is only reused under the settings that produced it
+        return f"{summarizer_name(self.summarizer)}:{self.min_length}:{self.target_words}"
+
+    def _finish_summary(self, parts, url):
+        summary = " ".join(parts)
+        if self.target_words:
+            (summary,) = reduce_summaries([parts], self.summarizer, self.target_words, self.chunk_size,
+                                          self.min_length, self.batch_size, self.cache)
+        if self.dedup is not None:
+            self.dedup.record_summary(url, summary, self._summary_version())
+        return summary
+
+    async def _emit_article(self, article, emit, model_pool, duplicates):
+        job = article['job']
+        if self.target_words or self.dedup is not None:
+            loop = asyncio.get_running_loop()
+            summary = await loop.run_in_executor(
+                model_pool, contextvars.copy_context().run, self._finish_summary, article['parts'], job['url'])
+        else:
+            summary = " ".join(article['parts'])
+        await self._emit_record(article['position'], job, summary, duplicates, emit)
+
+    @staticmethod
+    def _record(job, summary):
+        record = {'site': job['site'], 'url': job['url'], 'summary': summary}
+        if 'query' in job:
+            record['query'] = job['query']
+        return record
+
+    async def _drop(self, position, job, reason, duplicates, emit):
+        """Reports an article that produced no summary, if asked to, and drops the jobs that were waiting for it."""
+        waiting = []
+        if duplicates is not None:
+            url = canonical_url(job['url'])
+            duplicates.dropped.setdefault(url, reason)
+            waiting = duplicates.waiting.pop(url, [])
+        if self.report_failures:
+            record = self._record(job, None)
+            record['error'] = reason
+            await emit(position, record)
+        for waiting_position, waiting_job in waiting:
+            await self._drop(waiting_position, waiting_job, reason, duplicates, emit)
+
+    async def _emit_record(self, position, job, summary, duplicates, emit, duplicate_of=None):
+        record = self._record(job, summary)
+        if duplicates is None:
+            await emit(position, record)
+            return
+        if duplicate_of is not None:
+            record['duplicate_of'] = duplicate_of
+        else:
+            record['alternates'] = []
+        url = canonical_url(job['url'])
+        duplicates.records[url] = record
+        await emit(position, record)
+        for waiting_position, waiting_job in duplicates.waiting.pop(url, ()):
+            await self._attach_duplicate(url, waiting_position, waiting_job, duplicates, emit)
+
+    async def _attach_duplicate(self, original, position, job, duplicates, emit):
+        record = duplicates.records.get(original)
+        if record is None:
+            if original in duplicates.dropped:
+                # The original already failed, so nothing would ever release this job
+                await self._drop(position, job, duplicates.dropped[original], duplicates, emit)
+                return
+            duplicates.waiting[original].append((position, job))
+            return
+        count('duplicate_articles')
+        # Point at the article that was actually summarized
+        source = record.get('duplicate_of', record['url'])
+        duplicate = self._record(job, record['summary'])
+        if canonical_url(source) != canonical_url(job['url']):
+            target = duplicates.records.get(canonical_url(source), record)
+            if 'alternates' in target:
+                # Records are emitted before all their duplicates are known; run() sees the full list
+                target['alternates'].append(job['url'])
+            duplicate['duplicate_of'] = source
+        url = canonical_url(job['url'])
+        duplicates.records.setdefault(url, duplicate)
+        await emit(position, duplicate)
+        # Jobs for the same page as this duplicate were waiting on it rather than on its original
+        for waiting_position, waiting_job in duplicates.waiting.pop(url, ()):
+            await self._attach_duplicate(url, waiting_position, waiting_job, duplicates, emit)
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+def iterate_sync(records):
+    """Drives an async iterator from synchronous code, one item at a time.
+
+    The pipeline only runs while the caller is waiting for the next item, so a
+    slow consumer simply pauses it instead of letting records pile up.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(records.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        try:
+            loop.run_until_complete(records.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            leftover = asyncio.all_tasks(loop)
+            if leftover:
+                loop.run_until_complete(asyncio.gather(*leftover, return_exceptions=True))
+        finally:
+            loop.close()
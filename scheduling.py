@@ -0,0 +1,255 @@
+"""Per-host request scheduling: rate limits, adaptive backoff and fair queueing.
+
+Every request the ``Fetcher`` sends goes through a ``HostScheduler`` slot:
+
+* each host has a token bucket refilled at its own rate (``host_rates``
+  overrides the default), so a burst of article links cannot hammer one site;
+* a 429 or 5xx response halves that host's rate and a ``Retry-After`` header
+  pauses it for as long as asked; every successful response wins back a tenth
+  of the configured rate, so a host recovers once it stops complaining;
+* a freed connection from the shared budget goes to the waiting host with the
+  fewest requests in flight (round-robin among equals), so a slow host cannot
+  tie up the budget and keep requests to faster hosts waiting behind it.
+
+Host rates and counters live on the scheduler rather than on a session, so a
+scheduler shared between fetchers (see ``get_scheduler``) keeps its budget and
+backoff across queries. It serves one event loop at a time: the asyncio
+primitives are recreated whenever it is used from a new loop.
+"""
+import asyncio
+import email.utils
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+from instrumentation import observe
+
+DEFAULT_RATE = 4.0
+DEFAULT_BURST = 4
+MIN_RATE = 0.1
+# Fraction of a host's configured rate regained after each successful response
+RECOVERY_STEP = 0.1
+# Longest Retry-After pause honored, in seconds
+MAX_RETRY_AFTER = 120
+
+
+def parse_retry_after(value, now=None):
+    """Returns the delay in seconds a Retry-After header asks for, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(0.0, when - (time.time() if now is None else now))
+
+
+def is_throttled(status):
+    return status == 429 or status >= 500
+
+
+class _HostState:
+    def __init__(self, rate, burst):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.loop = None
+        self.lock = None
+        self.slots = None
+        self.queued = 0
+        self.max_queued = 0
+        self.requests = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class _FairSlots:
+    """A counting semaphore that hands a freed slot to the waiting host with the fewest in flight."""
+
+    def __init__(self, size):
+        self.free = size
+        self.active = {}
+        self.waiters = {}
+        self.rotation = deque()
+
+    def _grant(self, host):
+        self.active[host] = self.active.get(host, 0) + 1
+
+    async def acquire(self, host):
+        if self.free > 0 and not self.rotation:
+            self.free -= 1
+            self._grant(host)
+            return
+        future = asyncio.get_running_loop().create_future()
+        queue = self.waiters.setdefault(host, deque())
+        if not queue:
+            self.rotation.append(host)
+        queue.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as the waiter was cancelled; pass it on
+                self.release(host)
+            elif future in queue:
+                queue.remove(future)
+                if not queue:
+                    del self.waiters[host]
+                    self.rotation.remove(host)
+            raise
+
+    def release(self, host):
+        self.active[host] -= 1
+        while self.rotation:
+            # A host slow to answer keeps its slots busy, so it goes after the hosts using fewer
+            chosen = min(self.rotation, key=lambda waiting: self.active.get(waiting, 0))
+            self.rotation.remove(chosen)
+            queue = self.waiters[chosen]
+            future = queue.popleft()
+            if queue:
+                self.rotation.append(chosen)
+            else:
+                del self.waiters[chosen]
+            if not future.done():
+                self._grant(chosen)
+                future.set_result(None)
+                return
+        self.free += 1
+
+
+class HostScheduler:
+    def __init__(self, max_concurrency=20, max_per_host=4, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 host_rates=None, min_rate=MIN_RATE, max_retry_after=MAX_RETRY_AFTER):
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.rate = rate
+        self.burst = burst
+        # Requests per second allowed for specific hosts, e.g. {"stackoverflow.com": 1}
+        self.host_rates = host_rates or {}
+        self.min_rate = min_rate
+        self.max_retry_after = max_retry_after
+        self._hosts = {}
+        self._loop = None
+        self._slots = None
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(self.host_rates.get(host, self.rate), self.burst)
+        return self._hosts[host]
+
+    def _bind(self, state):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = _FairSlots(self.max_concurrency)
+        if state.loop is not loop:
+            state.loop = loop
+            state.lock = asyncio.Lock()
+            state.slots = asyncio.Semaphore(self.max_per_host)
+
+    async def _take_token(self, state):
+        while True:
+            now = time.monotonic()
+            state.refill(now)
+            if now < state.blocked_until:
+                delay = state.blocked_until - now
+            elif state.tokens >= 1:
+                state.tokens -= 1
+                return
+            else:
+                delay = (1 - state.tokens) / state.rate
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self, url):
+        """Waits until a request to url may be sent and holds its connection slot."""
+        host = urlsplit(url).netloc
+        state = self._host(host)
+        self._bind(state)
+        slots = self._slots
+        state.queued += 1
+        state.max_queued = max(state.max_queued, state.queued)
+        start = time.monotonic()
+        try:
+            await state.slots.acquire()
+            try:
+                # The lock keeps a host's requests taking tokens in arrival order
+                async with state.lock:
+                    await self._take_token(state)
+                await slots.acquire(host)
+            except BaseException:
+                state.slots.release()
+                raise
+        finally:
+            state.queued -= 1
+        waited = time.monotonic() - start
+        state.requests += 1
+        state.wait_total += waited
+        state.wait_max = max(state.wait_max, waited)
+        observe('scheduler_wait_seconds', waited, host=host)
+        try:
+            yield
+        finally:
+            slots.release(host)
+            state.slots.release()
+
+    def report(self, url, status, retry_after=None):
+        """Adapts the rate of url's host to the status of a response from it."""
+        host = urlsplit(url).netloc
+        state = self._host(host)
+        now = time.monotonic()
+        state.refill(now)
+        if not is_throttled(status):
+            state.rate = min(state.base_rate, state.rate + state.base_rate * RECOVERY_STEP)
+            return
+        state.throttled += 1
+        state.rate = max(self.min_rate, state.rate / 2)
+        state.tokens = min(state.tokens, 0)
+        delay = parse_retry_after(retry_after)
+        if delay is not None:
+            state.blocked_until = max(state.blocked_until, now + min(delay, self.max_retry_after))
+        logging.info(f"{host} answered {status}; slowing to {state.rate:.2f} requests/s"
+                     + (f" after a {delay:.0f}s pause" if delay is not None else ""))
+
+    def stats(self):
+        """Returns a {host: metrics} dict of rate, queue depth and wait times for every host seen."""
+        return {
+            host: {
+                'rate': state.rate,
+                'queued': state.queued,
+                'max_queued': state.max_queued,
+                'requests': state.requests,
+                'throttled': state.throttled,
+                'wait_total': state.wait_total,
+                'wait_max': state.wait_max,
+                'wait_mean': state.wait_total / state.requests if state.requests else 0.0,
+            }
+            for host, state in self._hosts.items()
+        }
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Returns the process-wide scheduler, so every fetcher shares the same host budgets."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = HostScheduler()
+        return _default_scheduler
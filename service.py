@@ -0,0 +1,397 @@
+"""Long-running summarization service: one warm instance shared by every client.
+
+Each one-shot run of ``app.py`` or of the notebooks pays for loading BART and
+starts with cold connections. The service loads the summarizer once (as a
+``worker_pool`` when ``SUMMARIZER_WORKERS`` is set), keeps one pooled
+``Fetcher`` open, and answers over HTTP on a TCP port or a Unix socket:
+
+* ``GET /resources?query=...&n=5`` - the records of ``app.scrape_resources``;
+* ``POST /summarize`` with ``{"text": ...}`` or ``{"url": ...}`` - one summary
+  of the whole text, reduced hierarchically like the notebooks'
+  ``BartSummarizer`` does;
+* ``GET /health`` - whether the model is loaded, and what is resident;
+* ``GET /queue`` - chunks waiting for and inside the model, requests in flight;
+* ``GET /metrics`` - Prometheus text, when instrumentation is enabled.
+
+Work is shared between concurrent clients at three levels:
+
+* identical queries, URLs and texts in flight are coalesced: later requests
+  wait for the first one's result instead of starting their own;
+* pages are fetched through a ``CoalescingFetcher``, so two queries that reach
+  the same article while it is downloading share one fetch;
+* every request's chunks go through one ``MicroBatcher``, which waits up to
+  ``window`` seconds after the first chunk arrives for chunks from other
+  requests, and runs them as shared model batches. A chunk already waiting or
+  being summarized for another request is not summarized again.
+
+    python service.py [--host 127.0.0.1] [--port 8765 | --unix PATH] [--window 0.01]
+"""
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from aiohttp import web
+
+import instrumentation
+from app import build_fetcher, build_pipeline, discover_articles, extract_article_text
+from dedup import canonical_url
+from fetching import Fetcher
+from instrumentation import count
+from models import SUMMARIZATION_MODEL, loaded_models
+from summarization import (DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, DEFAULT_TARGET_WORDS, _chunk_identity,
+                           run_batches, summarize_long_text, summarizer_name)
+from summary_cache import get_summary_cache
+from worker_pool import get_shared_summarizer
+
+DEFAULT_PORT = 8765
+# Seconds the first chunk of a batch waits for chunks from other requests
+DEFAULT_WINDOW = 0.01
+# Requests summarizing pasted text or single URLs at the same time
+DEFAULT_REQUEST_THREADS = 16
+
+
+class MicroBatcher:
+    """Stands in for a summarizer and merges the chunks of concurrent callers into shared model batches.
+
+    Callers on any thread block in run_batches while a dispatcher thread
+    collects chunks for up to window seconds (or until a full batch per
+    worker is waiting), regroups them by generation length, and runs them on
+    the wrapped summarizer. Identical chunks waiting or running are
+    summarized once.
+    """
+
+    def __init__(self, summarizer, batch_size=DEFAULT_BATCH_SIZE, window=DEFAULT_WINDOW):
+        self.summarizer = summarizer
+        self.batch_size = batch_size
+        self.window = window
+        # Looks like the wrapped summarizer to chunkers, caches and the pipeline
+        self.tokenizer = getattr(summarizer, 'tokenizer', None)
+        self.model = getattr(summarizer, 'model', None)
+        self.workers = getattr(summarizer, 'workers', 1)
+        if hasattr(summarizer, 'inference_backend'):
+            self.inference_backend = summarizer.inference_backend
+        self.batches = 0
+        self.chunks = 0
+        self._waiting = {}  # (chunk identity, max_length, min_length) -> (chunk, future)
+        self._running = {}
+        self._first_arrival = None
+        self._condition = threading.Condition()
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name="micro-batcher", daemon=True)
+        self._dispatcher.start()
+
+    def queue_depth(self):
+        """Returns the number of distinct chunks waiting for the model and inside it."""
+        with self._condition:
+            return {'waiting': len(self._waiting), 'running': len(self._running)}
+
+    def run_batches(self, batches):
+        """Summarizes (chunks, max_length, min_length) batches alongside other callers' chunks."""
+        futures = []
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The micro-batcher is closed.")
+            for chunks, max_length, min_length in batches:
+                batch_futures = []
+                for chunk in chunks:
+                    key = (_chunk_identity(chunk), max_length, min_length)
+                    entry = self._running.get(key) or self._waiting.get(key)
+                    if entry is None:
+                        entry = self._waiting[key] = (chunk, Future())
+                    else:
+                        count('coalesced_chunks')
+                    batch_futures.append(entry[1])
+                futures.append(batch_futures)
+            if self._first_arrival is None and self._waiting:
+                self._first_arrival = time.monotonic()
+            self._condition.notify()
+        return [[future.result() for future in batch_futures] for batch_futures in futures]
+
+    def __call__(self, texts, max_length=130, min_length=30, do_sample=False, batch_size=None):
+        """Summarizes texts like the pipeline does, batched with other callers' chunks."""
+        (summaries,) = self.run_batches([(list(texts), max_length, min_length)])
+        return [{'summary_text': summary} for summary in summaries]
+
+    def _take(self):
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                if self._waiting:
+                    full = len(self._waiting) >= self.batch_size * self.workers
+                    remaining = self._first_arrival + self.window - time.monotonic()
+                    if full or remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                else:
+                    self._condition.wait()
+            taken, self._waiting = self._waiting, {}
+            self._first_arrival = None
+            self._running.update(taken)
+            return taken
+
+    def _dispatch(self):
+        while True:
+            taken = self._take()
+            if taken is None:
+                return
+            groups = defaultdict(list)
+            for key, (chunk, _) in taken.items():
+                # Token ids and strings take different paths through the model, so they never share a batch
+                groups[(key[1], key[2], isinstance(chunk, str))].append(key)
+            batches = []
+            for (max_length, min_length, _), keys in groups.items():
+                keys.sort(key=lambda key: len(taken[key][0]))
+                for start in range(0, len(keys), self.batch_size):
+                    batches.append((keys[start:start + self.batch_size], max_length, min_length))
+            count('micro_batches', len(batches))
+            try:
+                results = run_batches(self.summarizer, [([taken[key][0] for key in keys], max_length, min_length)
+                                                        for keys, max_length, min_length in batches])
+            except Exception as e:
+                logging.error(f"Summarizing {len(taken)} chunks failed: {e}")
+                results, error = None, e
+            with self._condition:
+                for index, (keys, _, _) in enumerate(batches):
+                    for position, key in enumerate(keys):
+                        future = self._running.pop(key)[1]
+                        if results is None:
+                            future.set_exception(error)
+                        else:
+                            future.set_result(results[index][position])
+                self.batches += len(batches)
+                self.chunks += len(taken)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            waiting, self._waiting = self._waiting, {}
+            self._condition.notify_all()
+        for _, future in waiting.values():
+            future.set_exception(RuntimeError("The micro-batcher was closed."))
+        self._dispatcher.join()
+
+
+class Coalescer:
+    """Runs one task per key at a time; callers asking for a key already in flight share its result."""
+
+    def __init__(self):
+        self._tasks = {}
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def run(self, key, start):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(start())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.shared += 1
+            count('coalesced_requests')
+        # A client that disconnects does not cancel the work the others are waiting for
+        return await asyncio.shield(task)
+
+
+class CoalescingFetcher(Fetcher):
+    """A Fetcher whose concurrent requests for the same URL share one download."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_flight = Coalescer()
+
+    async def fetch(self, url):
+        return await self.in_flight.run(url, lambda: super(CoalescingFetcher, self).fetch(url))
+
+
+class SummarizationService:
+    def __init__(self, summarizer, fetcher, batch_size=DEFAULT_BATCH_SIZE, window=DEFAULT_WINDOW, use_cache=True,
+                 request_threads=DEFAULT_REQUEST_THREADS):
+        self.batcher = MicroBatcher(summarizer, batch_size, window)
+        self.fetcher = fetcher
+        self.batch_size = batch_size
+        self.use_cache = use_cache
+        self.cache = get_summary_cache() if use_cache else None
+        self.queries = Coalescer()
+        self.summaries = Coalescer()
+        self.started = time.time()
+        self._request_pool = ThreadPoolExecutor(request_threads, thread_name_prefix="summarize-request")
+
+    async def resources(self, query, n=5):
+        """Returns the records of a query, sharing the run with identical queries in flight."""
+        query = " ".join(query.split())
+
+        async def run():
+            with instrumentation.query_timing(query):
+                pipeline = build_pipeline(self.fetcher, self.batcher, self.batch_size, self.use_cache)
+                return await pipeline.run(discover_articles(self.fetcher, query, n))
+
+        return await self.queries.run((query, n), run)
+
+    async def summarize(self, text, target_words=DEFAULT_TARGET_WORDS):
+        """Summarizes the whole of a text down to about target_words words."""
+        key = ('text', hashlib.sha256(text.encode('utf-8')).hexdigest(), target_words)
+        return await self.summaries.run(key, lambda: self._summarize(text, target_words))
+
+    async def summarize_url(self, url, target_words=DEFAULT_TARGET_WORDS):
+        """Fetches an article and summarizes its text; returns None if it has no text."""
+        async def run():
+            page = await self.fetcher.fetch(url)
+            if not page:
+                return None
+            # Parsing is CPU-bound, so it stays off the event loop like summarization
+            loop = asyncio.get_running_loop()
+            text = await loop.run_in_executor(self._request_pool, contextvars.copy_context().run,
+                                              extract_article_text, page)
+            return await self._summarize(text, target_words) if text else None
+
+        return await self.summaries.run(('url', canonical_url(url), target_words), run)
+
+    async def _summarize(self, text, target_words):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._request_pool, contextvars.copy_context().run, summarize_long_text, text, self.batcher,
+            target_words, DEFAULT_CHUNK_SIZE, 10, self.batch_size, self.cache)
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'summarizer': summarizer_name(self.batcher.summarizer),
+            'workers': self.batcher.workers,
+            'models': [f"{kind}:{name}" for kind, name in loaded_models()],
+            'uptime_s': time.time() - self.started,
+        }
+
+    def queue(self):
+        depth = self.batcher.queue_depth()
+        # Only a CoalescingFetcher tracks the fetches in flight
+        in_flight = getattr(self.fetcher, 'in_flight', None)
+        fetches, shared_fetches = (len(in_flight), in_flight.shared) if in_flight is not None else (0, 0)
+        return {
+            'chunks_waiting': depth['waiting'],
+            'chunks_running': depth['running'],
+            'queries_in_flight': len(self.queries),
+            'summaries_in_flight': len(self.summaries),
+            'fetches_in_flight': fetches,
+            'coalesced': self.queries.shared + self.summaries.shared + shared_fetches,
+            'batches': self.batcher.batches,
+            'mean_batch_chunks': self.batcher.chunks / self.batcher.batches if self.batcher.batches else 0.0,
+        }
+
+    def close(self):
+        self.batcher.close()
+        self._request_pool.shutdown()
+
+
+def _positive_integer(value, name, from_query=False):
+    """Returns value if it is a positive JSON integer (or, from a query string, a string of digits)."""
+    if from_query and isinstance(value, str) and value.isascii() and value.isdigit():
+        value = int(value)
+    # bool is an int subclass, but JSON true is not a count
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise web.HTTPBadRequest(text=f"{name} must be an integer")
+    if value < 1:
+        raise web.HTTPBadRequest(text=f"{name} must be positive")
+    return value
+
+
+async def handle_resources(request):
+    query = request.query.get('query', '').strip()
+    if not query:
+        raise web.HTTPBadRequest(text="Missing query parameter")
+    n = _positive_integer(request.query.get('n', 5), "n", from_query=True)
+    records = await request.app['service'].resources(query, n)
+    return web.json_response({'query': query, 'resources': records})
+
+
+async def handle_summarize(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Expected a JSON body")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Expected a JSON object")
+    service = request.app['service']
+    target_words = _positive_integer(body.get('target_words', DEFAULT_TARGET_WORDS), "target_words")
+    text, url = body.get('text'), body.get('url')
+    if text and isinstance(text, str):
+        summary = await service.summarize(text, target_words)
+    elif url and isinstance(url, str):
+        summary = await service.summarize_url(url, target_words)
+        if summary is None:
+            raise web.HTTPBadGateway(text=f"No article text could be retrieved from {url}")
+    else:
+        raise web.HTTPBadRequest(text="Expected 'text' or 'url' as a string")
+    return web.json_response({'summary': summary})
+
+
+async def handle_health(request):
+    return web.json_response(request.app['service'].health())
+
+
+async def handle_queue(request):
+    return web.json_response(request.app['service'].queue())
+
+
+async def handle_metrics(request):
+    return web.Response(text=instrumentation.prometheus_text(), content_type='text/plain')
+
+
+def create_app(summarizer=None, batch_size=DEFAULT_BATCH_SIZE, window=DEFAULT_WINDOW, use_cache=True, fetcher=None):
+    """Builds the aiohttp application around a loaded summarizer.
+
+    The summarizer is loaded here, before the server starts, so that the first
+    client does not pay for it and a worker pool's processes are already
+    running when the first request arrives.
+    """
+    summarizer = summarizer or get_shared_summarizer(SUMMARIZATION_MODEL)
+    fetcher = fetcher or build_fetcher(use_cache, CoalescingFetcher)
+    application = web.Application()
+
+    async def lifetime(application):
+        async with fetcher:
+            service = application['service'] = SummarizationService(summarizer, fetcher, batch_size, window,
+                                                                    use_cache)
+            try:
+                yield
+            finally:
+                service.close()
+
+    application.cleanup_ctx.append(lifetime)
+    application.router.add_get('/resources', handle_resources)
+    application.router.add_post('/summarize', handle_summarize)
+    application.router.add_get('/health', handle_health)
+    application.router.add_get('/queue', handle_queue)
+    application.router.add_get('/metrics', handle_metrics)
+    return application
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW,
+                        help="seconds a chunk waits for chunks from other requests")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the HTTP, summary and fingerprint caches")
+    args = parser.parse_args(argv)
+
+    application = create_app(batch_size=args.batch_size, window=args.window, use_cache=not args.no_cache)
+    if args.unix:
+        web.run_app(application, path=args.unix)
+    else:
+        web.run_app(application, host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""Batched summarization shared by the scrapers.
+
+Every eligible chunk of every article is collected up front, grouped by the
+generation parameters the per-chunk path would have used, sorted by length so
+that similar-sized chunks share a batch, and run through the pipeline
+``batch_size`` chunks at a time. Summaries are then stitched back together in
+their original chunk order, one record per article.
+
+Chunks come in two forms. Plain strings from the 300-word ``split_text`` path
+go through the pipeline as before. Token ID lists produced by a
+``chunking.TokenChunker`` skip the pipeline's tokenizer and go straight to
+``model.generate``, with their generation lengths derived from token counts.
+``iter_paragraph_chunks`` produces the same chunks from a page streamed
+paragraph by paragraph (``extraction.iter_paragraphs``), one chunk at a time,
+without joining the page's text into one string first.
+
+Texts too long for one model input are summarized hierarchically
+(``summarize_long_text``): the whole text is cut into content-defined chunks,
+the chunks are summarized in batches, and groups of consecutive summaries are
+summarized again, level by level, until the result fits ``target_words``.
+Every level goes through ``summarize_chunks``, so with a cache an edited
+transcript only regenerates the chunks and groups its edit touched.
+"""
+import logging
+from collections import defaultdict
+
+from chunking import content_defined_chunks, content_defined_groups, word_blocks
+from instrumentation import count, span
+
+DEFAULT_CHUNK_SIZE = 300
+DEFAULT_BATCH_SIZE = 8
+MIN_CHUNK_WORDS = 30
+# Combined summaries longer than this many words are summarized again
+DEFAULT_TARGET_WORDS = 300
+MAX_REDUCE_LEVELS = 8
+
+
+def iter_word_chunks(texts, chunk_size):
+    """Yields chunk_size-word chunks of the texts taken as one run of words, e.g. a page's paragraphs.
+
+    Words are read lazily, so only the chunk being filled is held, however long
+    the texts are.
+    """
+    words = []
+    for text in texts:
+        for block in word_blocks(text):
+            for word in block:
+                words.append(word)
+                if len(words) == chunk_size:
+                    yield ' '.join(words)
+                    words = []
+    if words:
+        yield ' '.join(words)
+
+
+def split_text(text, chunk_size):
+    """Splits the text into chunks of specified size."""
+    return iter_word_chunks([text], chunk_size)
+
+
+def chunk_max_length(chunk):
+    """Returns the max_length used when summarizing a single chunk."""
+    return min(130, len(chunk) // 2) if len(chunk) > 30 else 30
+
+
+def token_generation_lengths(n_tokens, min_length):
+    """Returns (max_length, min_length) for a chunk of n_tokens input tokens."""
+    max_length = min(130, max(30, n_tokens // 2))
+    return max_length, min(min_length, max_length - 1)
+
+
+def _eligible(chunks):
+    for chunk in chunks:
+        if len(chunk.split()) < MIN_CHUNK_WORDS:
+            continue
+        yield chunk
+
+
+def eligible_chunks(text, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields the chunks of text that are long enough to be summarized."""
+    return _eligible(split_text(text, chunk_size))
+
+
+def chunk_text(text, chunk_size=DEFAULT_CHUNK_SIZE, chunker=None):
+    """Returns the chunks of text to summarize, as token ID lists when a chunker is given."""
+    with span('chunk'):
+        if chunker is not None:
+            return chunker.chunk(text)
+        return list(eligible_chunks(text, chunk_size))
+
+
+def iter_paragraph_chunks(paragraphs, chunk_size=DEFAULT_CHUNK_SIZE, chunker=None):
+    """Yields the chunks of a text given as paragraphs, without joining them into one string first.
+
+    The chunks are those chunk_text would return for the paragraphs joined
+    with spaces, so a page streamed by extraction.iter_paragraphs is chunked
+    in bounded memory.
+    """
+    if chunker is not None:
+        return chunker.iter_chunks(paragraphs)
+    return _eligible(iter_word_chunks(paragraphs, chunk_size))
+
+
+def _generation_lengths(chunk, min_length):
+    if isinstance(chunk, str):
+        return chunk_max_length(chunk), min_length
+    return token_generation_lengths(len(chunk), min_length)
+
+
+def _chunk_identity(chunk):
+    return chunk if isinstance(chunk, str) else "ids:" + " ".join(map(str, chunk))
+
+
+def _with_special_tokens(tokenizer, ids):
+    if hasattr(tokenizer, 'build_inputs_with_special_tokens'):
+        return tokenizer.build_inputs_with_special_tokens(ids)
+    return [tokenizer.bos_token_id] + ids + [tokenizer.eos_token_id]
+
+
+def generate_from_ids(summarizer, batch, max_length, min_length):
+    """Summarizes pre-tokenized chunks with the pipeline's model, skipping its tokenizer."""
+    import torch
+
+    tokenizer, model = summarizer.tokenizer, summarizer.model
+    inputs = tokenizer.pad(
+        {'input_ids': [_with_special_tokens(tokenizer, ids) for ids in batch]}, return_tensors='pt')
+    inputs = {name: tensor.to(model.device) for name, tensor in inputs.items()}
+    with torch.inference_mode():
+        output_ids = model.generate(**inputs, max_length=max_length, min_length=min_length, do_sample=False)
+    return tokenizer.batch_decode(output_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+
+
+def _run_batch(summarizer, batch, max_length, min_length):
+    count('summarized_chunks', len(batch))
+    with span('generate', batch_size=len(batch), max_length=max_length):
+        if not isinstance(batch[0], str):
+            return generate_from_ids(summarizer, batch, max_length, min_length)
+        results = summarizer(batch, max_length=max_length, min_length=min_length, do_sample=False,
+                             batch_size=len(batch))
+        return [(result[0] if isinstance(result, list) else result)['summary_text'] for result in results]
+
+
+def run_batches(summarizer, batches):
+    """Summarizes (chunks, max_length, min_length) batches and returns their summaries in order.
+
+    A summarizer with its own run_batches (a worker pool) runs them in
+    parallel; otherwise they run one after another in this thread.
+    """
+    run_in_parallel = getattr(summarizer, 'run_batches', None)
+    if run_in_parallel is not None:
+        return run_in_parallel(batches)
+    return [_run_batch(summarizer, batch, max_length, min_length) for batch, max_length, min_length in batches]
+
+
+def summarizer_name(summarizer):
+    """Returns the name of the model behind a summarization pipeline, and its backend if not fp32."""
+    model = getattr(summarizer, 'model', None)
+    # ONNX Runtime models only carry their name in their config
+    name = (getattr(model, 'name_or_path', None) or getattr(summarizer, 'model_name', None)
+            or getattr(getattr(model, 'config', None), 'name_or_path', None) or type(summarizer).__name__)
+    # Quantized and ONNX models summarize slightly differently, so they get their own cache entries
+    backend = getattr(summarizer, 'inference_backend', None)
+    return f"{name}@{backend}" if backend else name
+
+
+def summarize_chunks(chunks, summarizer, min_length=10, batch_size=DEFAULT_BATCH_SIZE, cache=None):
+    """Summarizes chunks in length-sorted batches and returns the summaries in input order.
+
+    Identical chunks are only summarized once, and with a cache only the
+    chunks it has not seen before reach the model.
+    """
+    with span('summarize', chunks=len(chunks)):
+        return _summarize_chunks(chunks, summarizer, min_length, batch_size, cache)
+
+
+def _summarize_chunks(chunks, summarizer, min_length, batch_size, cache):
+    summaries = [None] * len(chunks)
+    # Identical chunks get identical summaries, so each distinct one is generated once
+    first_index = {}
+    for index, chunk in enumerate(chunks):
+        first_index.setdefault(_chunk_identity(chunk), index)
+
+    keys = {}
+    if cache is not None:
+        model_name = summarizer_name(summarizer)
+        keys = {
+            index: cache.make_key(identity, model_name, *_generation_lengths(chunks[index], min_length), False)
+            for identity, index in first_index.items()
+        }
+        cached = cache.get_many(keys.values())
+        for index, key in keys.items():
+            summaries[index] = cached.get(key)
+
+    buckets = defaultdict(list)
+    for index in first_index.values():
+        if summaries[index] is None:
+            buckets[_generation_lengths(chunks[index], min_length)].append(index)
+
+    batches = []
+    for (max_length, chunk_min_length), indices in buckets.items():
+        # Neighbouring chunks in a batch are padded to the longest one, so keep them close in size
+        indices.sort(key=lambda i: len(chunks[i]))
+        for start in range(0, len(indices), batch_size):
+            batches.append((indices[start:start + batch_size], max_length, chunk_min_length))
+
+    generated = []
+    results = run_batches(summarizer, [([chunks[i] for i in batch], max_length, chunk_min_length)
+                                       for batch, max_length, chunk_min_length in batches])
+    for (batch, _, _), batch_summaries in zip(batches, results):
+        for i, summary in zip(batch, batch_summaries):
+            summaries[i] = summary
+            generated.append(i)
+
+    if cache is not None and generated:
+        cache.put_many([(keys[i], summaries[i]) for i in generated])
+
+    for index, chunk in enumerate(chunks):
+        if summaries[index] is None:
+            summaries[index] = summaries[first_index[_chunk_identity(chunk)]]
+    return summaries
+
+
+def _model_inputs(texts, summarizer):
+    """Returns texts as token ID lists when the summarizer has a tokenizer, so they skip re-tokenization."""
+    tokenizer = getattr(summarizer, 'tokenizer', None)
+    if tokenizer is None:
+        return texts
+    limit = tokenizer.model_max_length - tokenizer.num_special_tokens_to_add()
+    return [ids[:limit] for ids in tokenizer(texts, add_special_tokens=False, verbose=False)['input_ids']]
+
+
+def _word_count(parts):
+    return sum(len(part.split()) for part in parts)
+
+
+def reduce_summaries(parts_per_text, summarizer, target_words=DEFAULT_TARGET_WORDS, chunk_size=DEFAULT_CHUNK_SIZE,
+                     min_length=10, batch_size=DEFAULT_BATCH_SIZE, cache=None, max_levels=MAX_REDUCE_LEVELS):
+    """Summarizes groups of consecutive summaries, level by level, until each text's fit target_words.
+
+    parts_per_text holds the chunk summaries of each text in order. Each
+    level summarizes the groups of every text that is still too long in one
+    batched pass. Returns one combined summary per text.
+    """
+    parts_per_text = [list(parts) for parts in parts_per_text]
+    pending = range(len(parts_per_text))
+    for level in range(1, max_levels + 1):
+        pending = [index for index in pending
+                   if len(parts_per_text[index]) > 1 and _word_count(parts_per_text[index]) > target_words]
+        if not pending:
+            break
+        groups = []
+        owners = []
+        for index in pending:
+            for group in content_defined_groups(parts_per_text[index], chunk_size):
+                groups.append(" ".join(group))
+                owners.append(index)
+        with span('reduce', level=level, chunks=len(groups)):
+            summaries = summarize_chunks(_model_inputs(groups, summarizer), summarizer, min_length, batch_size, cache)
+        reduced = defaultdict(list)
+        for owner, summary in zip(owners, summaries):
+            reduced[owner].append(summary)
+        shrinking = []
+        for index in pending:
+            # A level that does not shorten the text would never reach the target
+            if _word_count(reduced[index]) < _word_count(parts_per_text[index]):
+                parts_per_text[index] = reduced[index]
+                shrinking.append(index)
+        pending = shrinking
+    else:
+        pending = [index for index in pending if _word_count(parts_per_text[index]) > target_words]
+        if pending:
+            logging.warning(f"{len(pending)} summaries still exceed {target_words} words after {max_levels} levels")
+    return [" ".join(parts) for parts in parts_per_text]
+
+
+def summarize_long_text(text, summarizer, target_words=DEFAULT_TARGET_WORDS, chunk_size=DEFAULT_CHUNK_SIZE,
+                        min_length=10, batch_size=DEFAULT_BATCH_SIZE, cache=None):
+    """Summarizes all of a text of any length down to about target_words words.
+
+    Unlike a single model call, which truncates its input, every part of the
+    text is summarized; the chunk summaries are then reduced hierarchically.
+    """
+    chunks = content_defined_chunks(text, chunk_size)
+    if not chunks:
+        return ""
+    with span('reduce', level=0, chunks=len(chunks)):
+        summaries = summarize_chunks(_model_inputs(chunks, summarizer), summarizer, min_length, batch_size, cache)
+    return reduce_summaries([summaries], summarizer, target_words, chunk_size, min_length, batch_size, cache)[0]
+
+
+def summarize_articles(articles, summarizer, chunk_size=DEFAULT_CHUNK_SIZE, min_length=10,
+                       batch_size=DEFAULT_BATCH_SIZE, cache=None, chunker=None, target_words=None):
+    """Summarizes a list of {'site', 'url', 'full_text'} articles in one batched pass.
+
+    Returns one {'site', 'url', 'summary'} record per article, in input order.
+    With target_words, an article whose chunk summaries add up to more words
+    is reduced hierarchically instead of returning all of them concatenated.
+    """
+    chunks = []
+    owners = []
+    for index, article in enumerate(articles):
+        for chunk in chunk_text(article['full_text'], chunk_size, chunker):
+            chunks.append(chunk)
+            owners.append(index)
+
+    summaries = summarize_chunks(chunks, summarizer, min_length, batch_size, cache)
+
+    per_article = [[] for _ in articles]
+    for owner, summary in zip(owners, summaries):
+        per_article[owner].append(summary)
+
+    if target_words:
+        combined = reduce_summaries(per_article, summarizer, target_words, chunk_size, min_length, batch_size, cache)
+    else:
+        combined = [" ".join(parts) for parts in per_article]
+    return [
+        {'site': article['site'], 'url': article['url'], 'summary': summary}
+        for article, summary in zip(articles, combined)
+    ]
+
+
+def summarize_text(text, summarizer, chunk_size=DEFAULT_CHUNK_SIZE, min_length=10,
+                   batch_size=DEFAULT_BATCH_SIZE, cache=None, chunker=None):
+    """Summarizes a single text, batching its chunks."""
+    summaries = summarize_chunks(chunk_text(text, chunk_size, chunker), summarizer,
+                                 min_length, batch_size, cache)
+    return " ".join(summaries)
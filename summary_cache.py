@@ -0,0 +1,120 @@
+"""Persistent, content-addressed cache of chunk summaries.
+
+A summary is stored under a hash of the chunk text together with everything
+that influences the generated output: the model name and the
+``max_length``/``min_length``/``do_sample`` arguments. The same chunk from the
+same article therefore costs one model call no matter how many queries
+return it.
+
+The cache lives in a single SQLite file and is bounded to ``max_entries``
+rows; when it grows past that, the least recently used summaries are evicted.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = "summary_cache.sqlite3"
+DEFAULT_MAX_ENTRIES = 100000
+
+
+class SummaryCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # The pipeline summarizes from a worker thread, so the connection is shared behind a lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "key TEXT PRIMARY KEY, summary TEXT NOT NULL, last_used INTEGER NOT NULL)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries (last_used)")
+
+    @staticmethod
+    def make_key(chunk, model_name, max_length, min_length, do_sample=False):
+        """Returns the cache key for a chunk summarized with the given parameters."""
+        digest = hashlib.sha256()
+        digest.update(f"{model_name}\0{max_length}\0{min_length}\0{int(do_sample)}\0".encode('utf-8'))
+        digest.update(chunk.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_many(self, keys):
+        """Returns a {key: summary} dict for the keys that are cached."""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({placeholders})", batch)
+                found.update(rows)
+            if found:
+                now = time.time_ns()
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE summaries SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """Stores (key, summary) pairs, evicting the least recently used entries if over capacity."""
+        now = time.time_ns()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO summaries (key, summary, last_used) VALUES (?, ?, ?)",
+                [(key, summary, now) for key, summary in items])
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM summaries WHERE key IN "
+                    "(SELECT key FROM summaries ORDER BY last_used LIMIT ?)", (excess,))
+                self.evictions += excess
+
+    def put(self, key, summary):
+        self.put_many([(key, summary)])
+
+    def stats(self):
+        """Returns hit/miss/eviction counters for this process and the current entry count."""
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': entries,
+            }
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM summaries")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_summary_cache(path=DEFAULT_CACHE_PATH):
+    """Returns the process-wide summary cache, opening it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SummaryCache(path)
+        return _default_cache
@@ -1,12 +1,22 @@
+import asyncio
+from contextlib import aclosing
 import logging
-import requests
-from bs4 import BeautifulSoup
-from transformers import pipeline
-from concurrent.futures import ThreadPoolExecutor
 import random
-
-# Configure logging
-logging.basicConfig(filename='error_log.txt', level=logging.ERROR, 
+import instrumentation
+from app import build_fetcher, build_pipeline
+from extraction import extract_text, iter_paragraphs
+from fetching import fetch_pages
+from http_cache import get_http_cache
+from link_rules import find_article_links
+from models import SUMMARIZATION_MODEL
+from pipeline import iterate_sync
+from scheduling import get_scheduler
+from summarization import DEFAULT_BATCH_SIZE, summarize_text
+from worker_pool import get_shared_summarizer
+from writers import write_resources
+
+# Configure logging; progress messages and per-query timings are kept while instrumenting
+logging.basicConfig(filename='error_log.txt', level=logging.INFO if instrumentation.enabled else logging.ERROR, 
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
 # Lists of sites based on scraping method
@@ -28,15 +38,29 @@ traversal_sites = {
     #},
     "GeeksforGeeks": {
         "url": "https://www.geeksforgeeks.org/search/?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://www.geeksforgeeks.org",
+            "prefixes": ["/articles/", "/geeks/"],
+        },
     },
     "Tutorialspoint": {
         "url": "https://www.tutorialspoint.com/search/index.htm?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://www.tutorialspoint.com",
+            "prefixes": ["/tutorials/", "https://www.tutorialspoint.com/"],
+            "exclude": [r"^/$", r"^/index\.htm$", r"^/(about|search)(/|$)"],
+        },
     },
     "Stack Overflow": {
         "url": "https://stackoverflow.com/search?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://stackoverflow.com",
+            # Only numbered questions; /questions/tagged/... and /questions/ask are listings and forms
+            "patterns": [r"(https://stackoverflow\.com)?/questions/\d+"],
+        },
     },
 }
 
@@ -48,122 +72,79 @@ def get_random_user_agent():
     return random.choice(user_agents)
 
 def fetch_url(url):
-    headers = {"User-Agent": get_random_user_agent()}
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.text
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request failed for {url}: {e}")
-        return None
+    return fetch_pages([url], user_agents=user_agents, http_cache=get_http_cache(),
+                       scheduler=get_scheduler())[0]
 
 def extract_full_text(page_content):
     """Extracts full text from the page content."""
-    soup = BeautifulSoup(page_content, 'html.parser')
-    paragraphs = soup.find_all('p')
-    return ' '.join([para.get_text() for para in paragraphs])
-
-def split_text(text, chunk_size):
-    """Splits text into chunks of specified size."""
-    words = text.split()
-    for i in range(0, len(words), chunk_size):
-        yield ' '.join(words[i:i + chunk_size])
-
-def summarize_text(text, summarizer, chunk_size=300):
-    summaries = []
-    for chunk in split_text(text, chunk_size):
-        if len(chunk.split()) < 30:
-            continue
-        max_length = min(130, len(chunk) // 2) if len(chunk) > 30 else 30
-        chunk_summary = summarizer(chunk, max_length=max_length, min_length=10, do_sample=False)
-        summaries.append(chunk_summary[0]['summary_text'])
-    return " ".join(summaries)
+    return extract_text(page_content, strip=False)
 
-def process_traversal_site(site, info, query, summarizer, n=5):
-    search_url = f"{info['url']}{info['query_format'](query)}"
-    logging.info(f"Searching Traversal URL: {search_url}")
-
-    page_content = fetch_url(search_url)
-    if not page_content:
-        return []
-
-    soup = BeautifulSoup(page_content, 'html.parser')
-    article_links = []
-
-    for link in soup.find_all('a', href=True):
-        href = link['href']
-        if site == "Medium" and href.startswith('https://medium.com/'):
-            article_links.append(href)
-        elif site == "Dev.to" and href.startswith('https://dev.to/'):
-            article_links.append(href)
-        elif site == "GeeksforGeeks" and (href.startswith('/articles/') or href.startswith('/geeks/')):
-            article_links.append(f"https://www.geeksforgeeks.org{href}")
-        elif site == "Tutorialspoint" and (href.startswith('/tutorials/') or href.startswith('https://www.tutorialspoint.com/')):
-            article_links.append(f"https://www.tutorialspoint.com{href}")
-        elif site == "Stack Overflow" and (href.startswith('/questions/') or href.startswith('https://stackoverflow.com/questions/')):
-            article_links.append(f"https://stackoverflow.com{href}")
-
-    article_links = article_links[:n]
-    output = []
-
-    for article_url in article_links:
-        page_content = fetch_url(article_url)
-        if page_content:
-            full_text = extract_full_text(page_content)
-            if full_text:
-                final_summary = summarize_text(full_text, summarizer)
-                output.append({'site': site, 'url': article_url, 'summary': final_summary})
-
-    return output
+def iter_full_paragraphs(page_content):
+    """Yields the unstripped text of every paragraph as soon as it is parsed."""
+    return iter_paragraphs(page_content, strip=False)
 
-def scrape_direct_access_sites(query, summarizer):
-    output = []
-    for site, info in direct_access_sites.items():
-        search_url = f"{info['url']}{info['query_format'](query)}"
-        logging.info(f"Searching Direct Access URL: {search_url}")
+def extract_article_links(site, page_content, n=5):
+    """Returns the first n article links found on a traversal site's search page."""
+    return find_article_links(page_content, traversal_sites[site].get("links"), n)
+
+async def discover_articles(fetcher, query, direct, traversal, n=5):
+    """Yields an article job for every page the query should summarize.
 
-        page_content = fetch_url(search_url)
+    All search pages are fetched at once. Direct access sites are summarized
+    from the search page itself; traversal sites contribute their top n links.
+    """
+    search_urls = [(site, f"{info['url']}{info['query_format'](query)}") for site, info in direct.items()]
+    search_urls += [(site, f"{info['url']}{info['query_format'](query)}") for site, info in traversal.items()]
+    for site, search_url in search_urls:
+        logging.info(f"Searching {site} URL: {search_url}")
+
+    search_pages = await fetcher.fetch_all([url for _, url in search_urls])
+    for (site, search_url), page_content in zip(search_urls, search_pages):
         if not page_content:
             continue
+        if site in direct:
+            yield {'site': site, 'url': search_url, 'page': page_content}
+        else:
+            for article_url in find_article_links(page_content, traversal[site].get("links"), n):
+                yield {'site': site, 'url': article_url}
+
+async def summarize_sites(query, summarizer, direct, traversal, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=False):
+    """Runs the given sites through the overlapped fetch -> parse -> summarize pipeline app.py builds."""
+    with instrumentation.query_timing(query):
+        async with build_fetcher(use_cache, user_agents=user_agents) as fetcher:
+            pipeline = build_pipeline(fetcher, summarizer, batch_size, use_cache, extract_paragraphs=iter_full_paragraphs)
+            return await pipeline.run(discover_articles(fetcher, query, direct, traversal, n))
+
+async def stream_sites(query, summarizer, direct, traversal, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=False):
+    """Yields each record as soon as its article is summarized."""
+    with instrumentation.query_timing(query):
+        async with build_fetcher(use_cache, user_agents=user_agents) as fetcher:
+            pipeline = build_pipeline(fetcher, summarizer, batch_size, use_cache, extract_paragraphs=iter_full_paragraphs)
+            async with aclosing(pipeline.stream(discover_articles(fetcher, query, direct, traversal, n))) as resources:
+                async for resource in resources:
+                    yield resource
 
-        full_text = extract_full_text(page_content)
-        if full_text:
-            final_summary = summarize_text(full_text, summarizer)
-            output.append({'site': site, 'url': search_url, 'summary': final_summary})
+def process_traversal_site(site, info, query, summarizer, n=5):
+    return asyncio.run(summarize_sites(query, summarizer, {}, {site: info}, n))
 
-    return output
+def scrape_direct_access_sites(query, summarizer):
+    return asyncio.run(summarize_sites(query, summarizer, direct_access_sites, {}))
 
 def scrape_traversal_sites(query, summarizer, n=5):
-    output = []
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(process_traversal_site, site, info, query, summarizer, n)
-            for site, info in traversal_sites.items()
-        ]
-        for future in futures:
-            result = future.result()
-            if result:
-                output.extend(result)
-    return output
-
-def scrape_resources(query, n=5):
-    model_name = "facebook/bart-large-cnn"
-    summarizer = pipeline("summarization", model=model_name)
-    output = []
-
-    output.extend(scrape_direct_access_sites(query, summarizer))
-    output.extend(scrape_traversal_sites(query, summarizer, n))
-
-    return output
+    return asyncio.run(summarize_sites(query, summarizer, {}, traversal_sites, n))
+
+def scrape_resources(query, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=True):
+    # The summarizer is loaded once per process and reused across queries; with
+    # SUMMARIZER_WORKERS > 1 it is a pool of worker processes sharing its weights
+    summarizer = get_shared_summarizer(SUMMARIZATION_MODEL)
+    return asyncio.run(summarize_sites(query, summarizer, direct_access_sites, traversal_sites, n, batch_size, use_cache))
+
+def iter_resources(query, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=True):
+    """Synchronous generator over the records of a query, in completion order."""
+    summarizer = get_shared_summarizer(SUMMARIZATION_MODEL)
+    return iterate_sync(stream_sites(query, summarizer, direct_access_sites, traversal_sites, n, batch_size, use_cache))
 
 # Example usage
 if __name__ == "__main__":
     query = "Dynamic programming"
-    resources = scrape_resources(query)
-
-    with open('summarized_resources.txt', 'w', encoding='utf-8') as f:
-        for resource in resources:
-            f.write(f"Site: {resource['site']}\n")
-            f.write(f"URL: {resource['url']}\n")
-            f.write(f"Summary: {resource['summary']}\n")
-            f.write("\n")
\ No newline at end of file
+    write_resources(iter_resources(query), 'summarized_resources.txt')
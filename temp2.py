@@ -1,19 +1,36 @@
+import asyncio
+from contextlib import aclosing
 import logging
-import requests
-from bs4 import BeautifulSoup
-from transformers import pipeline
-from concurrent.futures import ThreadPoolExecutor
 import random
-
-# Configure logging
-logging.basicConfig(filename='error_log.txt', level=logging.ERROR,
+import instrumentation
+from app import build_fetcher, build_pipeline
+from extraction import extract_text
+from fetching import fetch_pages
+from http_cache import get_http_cache
+from link_rules import find_article_links
+from models import SUMMARIZATION_MODEL
+from pipeline import iterate_sync
+from scheduling import get_scheduler
+from summarization import DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE
+from summarization import summarize_text as summarize_text_batched
+from worker_pool import get_shared_summarizer
+from writers import write_resources
+
+# Configure logging; progress messages and per-query timings are kept while instrumenting
+logging.basicConfig(filename='error_log.txt', level=logging.INFO if instrumentation.enabled else logging.ERROR,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
 # Lists of sites based on scraping method
 direct_access_sites = {
     "Wikipedia": {
         "url": "https://en.wikipedia.org/w/index.php?search=",
-        "query_format": lambda query: query.replace(" ", "+")
+        "query_format": lambda query: query.replace(" ", "+"),
+        "links": {
+            "base": "https://en.wikipedia.org",
+            "prefixes": ["/wiki/"],
+            # Namespaced pages (Special:, Help:, Category:, ...) are not articles
+            "exclude": [r":"],
+        },
     },
 }
 
@@ -21,23 +38,48 @@ direct_access_sites = {
 traversal_sites = {
     "Medium": {
         "url": "https://medium.com/search?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://medium.com",
+            "prefixes": ["https://medium.com/"],
+            "exclude": [r"^/$", r"^/(tag|tags|topic|search|m|membership|plans)(/|$)"],
+        },
     },
     "Dev.to": {
         "url": "https://dev.to/search?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://dev.to",
+            # Articles live at /<author>/<slug>
+            "patterns": [r"https://dev\.to/[^/?#]+/[^/?#]+"],
+            "exclude": [r"^/(t|search|enter|settings|tags|about)(/|$)"],
+        },
     },
     "GeeksforGeeks": {
         "url": "https://www.geeksforgeeks.org/search/?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://www.geeksforgeeks.org",
+            "prefixes": ["/articles/", "/geeks/"],
+        },
     },
     "Tutorialspoint": {
         "url": "https://www.tutorialspoint.com/search/index.htm?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://www.tutorialspoint.com",
+            "prefixes": ["/tutorials/", "https://www.tutorialspoint.com/"],
+            "exclude": [r"^/$", r"^/index\.htm$", r"^/(about|search)(/|$)"],
+        },
     },
     "Stack Overflow": {
         "url": "https://stackoverflow.com/search?q=",
-        "query_format": lambda query: query
+        "query_format": lambda query: query,
+        "links": {
+            "base": "https://stackoverflow.com",
+            # Only numbered questions; /questions/tagged/... and /questions/ask are listings and forms
+            "patterns": [r"(https://stackoverflow\.com)?/questions/\d+"],
+        },
     },
     "W3Schools": {
         "url": "https://www.w3schools.com/#gsc.tab=0&gsc.q=",
@@ -54,130 +96,85 @@ user_agents = [
 def get_random_user_agent():
     return random.choice(user_agents)
 
-def split_text(text, chunk_size):
-    """Splits the text into chunks of specified size."""
-    words = text.split()
-    for i in range(0, len(words), chunk_size):
-        yield ' '.join(words[i:i + chunk_size])
-
 def fetch_url(url):
-    headers = {"User-Agent": get_random_user_agent()}
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.text
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request failed for {url}: {e}")
-        return None
-
-def summarize_text(text, summarizer, chunk_size=300):
-    summaries = []
-    for chunk in split_text(text, chunk_size):
-        if len(chunk.split()) < 30:
+    return fetch_pages([url], user_agents=user_agents, http_cache=get_http_cache(),
+                       scheduler=get_scheduler())[0]
+
+# Minimum summary length passed to the summarizer for every chunk
+min_summary_length = 30
+
+def summarize_text(text, summarizer, chunk_size=DEFAULT_CHUNK_SIZE):
+    return summarize_text_batched(text, summarizer, chunk_size, min_length=min_summary_length)
+
+def extract_article_text(page_content):
+    """Joins the text of every paragraph on an article page."""
+    return extract_text(page_content, strip=True)
+
+def extract_wikipedia_links(page_content, n=5):
+    """Returns the first n article links on a Wikipedia search page."""
+    return find_article_links(page_content, direct_access_sites["Wikipedia"]["links"], n)
+
+def extract_article_links(site, page_content, n=5):
+    """Returns the first n article links found on a traversal site's search page."""
+    return find_article_links(page_content, traversal_sites[site].get("links"), n)
+
+async def discover_articles(fetcher, query, include_wikipedia, traversal, n=5):
+    """Fetches every search page at once and yields a job for each of the top n links per site."""
+    search_urls = []
+    if include_wikipedia:
+        wiki_info = direct_access_sites["Wikipedia"]
+        search_urls.append(("Wikipedia", f"{wiki_info['url']}{wiki_info['query_format'](query)}"))
+    search_urls += [(site, f"{info['url']}{info['query_format'](query)}") for site, info in traversal.items()]
+    for site, search_url in search_urls:
+        logging.info(f"Searching {site} URL: {search_url}")
+
+    search_pages = await fetcher.fetch_all([url for _, url in search_urls])
+    for (site, _), page_content in zip(search_urls, search_pages):
+        if not page_content:
             continue
-        max_length = min(130, len(chunk) // 2) if len(chunk) > 30 else 30
-        chunk_summary = summarizer(chunk, max_length=max_length, min_length=30, do_sample=False)
-        summaries.append(chunk_summary[0]['summary_text'])
-    return " ".join(summaries)
+        if site == "Wikipedia":
+            article_links = extract_wikipedia_links(page_content, n)
+        else:
+            article_links = extract_article_links(site, page_content, n)
+        for article_url in article_links:
+            yield {'site': site, 'url': article_url}
+
+async def summarize_sites(query, summarizer, include_wikipedia, traversal, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=False):
+    """Runs the given sites through the overlapped fetch -> parse -> summarize pipeline app.py builds."""
+    with instrumentation.query_timing(query):
+        async with build_fetcher(use_cache, user_agents=user_agents) as fetcher:
+            pipeline = build_pipeline(fetcher, summarizer, batch_size, use_cache,
+                                      min_length=min_summary_length)
+            return await pipeline.run(discover_articles(fetcher, query, include_wikipedia, traversal, n))
+
+async def stream_sites(query, summarizer, include_wikipedia, traversal, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=False):
+    """Yields each record as soon as its article is summarized."""
+    with instrumentation.query_timing(query):
+        async with build_fetcher(use_cache, user_agents=user_agents) as fetcher:
+            pipeline = build_pipeline(fetcher, summarizer, batch_size, use_cache,
+                                      min_length=min_summary_length)
+            async with aclosing(pipeline.stream(discover_articles(fetcher, query, include_wikipedia, traversal, n))) as resources:
+                async for resource in resources:
+                    yield resource
 
 def process_wikipedia(query, summarizer, n=5):
-    wiki_info = direct_access_sites["Wikipedia"]
-    search_url = f"{wiki_info['url']}{wiki_info['query_format'](query)}"
-    logging.info(f"Searching Wikipedia URL: {search_url}")
-
-    page_content = fetch_url(search_url)
-    if not page_content:
-        return []
-
-    soup = BeautifulSoup(page_content, 'html.parser')
-    article_links = [f"https://en.wikipedia.org{link['href']}" for link in soup.find_all('a', href=True) if link['href'].startswith('/wiki/') and ':' not in link['href']]
-    article_links = article_links[:n]
-
-    output = []
-    for article_url in article_links:
-        article_content = fetch_url(article_url)
-        if not article_content:
-            continue
-
-        article_soup = BeautifulSoup(article_content, 'html.parser')
-        paragraphs = article_soup.find_all('p')
-        full_text = " ".join([para.get_text(strip=True) for para in paragraphs])
-
-        if full_text:
-            final_summary = summarize_text(full_text, summarizer)
-            output.append({'site': "Wikipedia", 'url': article_url, 'summary': final_summary})
-
-    return output
+    return asyncio.run(summarize_sites(query, summarizer, True, {}, n))
 
 def process_traversal_site(site, info, query, summarizer, n=5):
-    search_url = f"{info['url']}{info['query_format'](query)}"
-    logging.info(f"Searching URL: {search_url}")
-
-    page_content = fetch_url(search_url)
-    if not page_content:
-        return []
-
-    soup = BeautifulSoup(page_content, 'html.parser')
-    article_links = []
-
-    for link in soup.find_all('a', href=True):
-        href = link['href']
-        if site == "Medium" and href.startswith('https://medium.com/'):
-            article_links.append(href)
-        elif site == "Dev.to" and href.startswith('https://dev.to/'):
-            article_links.append(href)
-        elif site == "GeeksforGeeks" and (href.startswith('/articles/') or href.startswith('/geeks/')):
-            article_links.append(f"https://www.geeksforgeeks.org{href}")
-        elif site == "Tutorialspoint" and (href.startswith('/tutorials/') or href.startswith('https://www.tutorialspoint.com/')):
-            article_links.append(f"https://www.tutorialspoint.com{href}")
-        elif site == "Stack Overflow" and (href.startswith('/questions/') or href.startswith('https://stackoverflow.com/questions/')):
-            article_links.append(f"https://stackoverflow.com{href}")
-
-    article_links = article_links[:n]
-
-    output = []
-    for article_url in article_links:
-        article_content = fetch_url(article_url)
-        if not article_content:
-            continue
-
-        article_soup = BeautifulSoup(article_content, 'html.parser')
-        paragraphs = article_soup.find_all('p')
-        full_text = " ".join([para.get_text(strip=True) for para in paragraphs])
-
-        if full_text:
-            final_summary = summarize_text(full_text, summarizer)
-            output.append({'site': site, 'url': article_url, 'summary': final_summary})
-
-    return output
-
-def scrape_resources(query, n=5):
-    model_name = "facebook/bart-large-cnn"
-    summarizer = pipeline("summarization", model=model_name)
-    output = []
-
-    output.extend(process_wikipedia(query, summarizer, n))
+    return asyncio.run(summarize_sites(query, summarizer, False, {site: info}, n))
 
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(process_traversal_site, site, info, query, summarizer, n)
-            for site, info in traversal_sites.items()
-        ]
-        for future in futures:
-            result = future.result()
-            if result:
-                output.extend(result)
+def scrape_resources(query, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=True):
+    # The summarizer is loaded once per process and reused across queries; with
+    # SUMMARIZER_WORKERS > 1 it is a pool of worker processes sharing its weights
+    summarizer = get_shared_summarizer(SUMMARIZATION_MODEL)
+    return asyncio.run(summarize_sites(query, summarizer, True, traversal_sites, n, batch_size, use_cache))
 
-    return output
+def iter_resources(query, n=5, batch_size=DEFAULT_BATCH_SIZE, use_cache=True):
+    """Synchronous generator over the records of a query, in completion order."""
+    summarizer = get_shared_summarizer(SUMMARIZATION_MODEL)
+    return iterate_sync(stream_sites(query, summarizer, True, traversal_sites, n, batch_size, use_cache))
 
 # Example usage
 if __name__ == "__main__":
     query = "Dynamic programming"
-    resources = scrape_resources(query)
-
-    with open('summarized_resources.txt', 'w', encoding='utf-8') as f:
-        for resource in resources:
-            f.write(f"Site: {resource['site']}\n")
-            f.write(f"URL: {resource['url']}\n")
-            f.write(f"Summary: {resource['summary']}\n")
-            f.write("\n")
+    write_resources(iter_resources(query), 'summarized_resources.txt')
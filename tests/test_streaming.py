@@ -0,0 +1,77 @@
+"""Streaming extraction and chunking against their whole-document counterparts."""
+import tracemalloc
+
+import pytest
+
+from benchmarks import fixtures
+from extraction import extract_paragraphs, extract_text, iter_paragraphs
+from summarization import iter_paragraph_chunks
+
+LARGE_PAGE = 4 * 1024 * 1024
+# Largest rise in Python allocations accepted while LARGE_PAGE is streamed: half the page,
+# so holding the page, its text or its token IDs whole fails
+PEAK_LIMIT = LARGE_PAGE // 2
+
+PAGES = fixtures.generate(seed=1, articles=10, malformed=5)
+ARTICLES = sorted(name for name in PAGES if name.startswith("article_"))
+
+
+@pytest.fixture(scope="module")
+def token_chunker():
+    pytest.importorskip("tokenizers")
+    pytest.importorskip("transformers")
+    from benchmarks.stubs import stub_tokenizer
+    from chunking import TokenChunker
+    return TokenChunker(stub_tokenizer())
+
+
+@pytest.mark.parametrize("strip", [True, False])
+@pytest.mark.parametrize("name", ARTICLES)
+def test_iter_paragraphs_matches_bs4(name, strip):
+    page = PAGES[name]
+    assert list(iter_paragraphs(page, strip)) == extract_paragraphs(page, strip, backend='bs4')
+
+
+def test_iter_paragraphs_accepts_blocks():
+    page = PAGES[ARTICLES[0]]
+    blocks = [page[i:i + 100] for i in range(0, len(page), 100)]
+    assert list(iter_paragraphs(blocks)) == extract_paragraphs(page, backend='bs4')
+
+
+@pytest.mark.parametrize("name", ARTICLES)
+def test_token_iter_chunks_matches_chunk(token_chunker, name):
+    paragraphs = extract_paragraphs(PAGES[name], backend='bs4')
+    assert list(token_chunker.iter_chunks(paragraphs)) == token_chunker.chunk(" ".join(paragraphs))
+
+
+def test_token_iter_chunks_across_blocks(token_chunker, monkeypatch):
+    import chunking
+    # Unpunctuated paragraphs and odd whitespace force cuts in the middle of sentences
+    paragraphs = [extract_text(PAGES[name]) for name in ARTICLES]
+    paragraphs += [" ".join(fixtures.WORDS) * 3, "a  b\tc\n d.  E", "", "x! \n Y"]
+    expected = token_chunker.chunk(" ".join(paragraphs))
+    monkeypatch.setattr(chunking, 'TOKENIZE_CHARS', 97)
+    assert list(token_chunker.iter_chunks(paragraphs)) == expected
+
+
+def _streamed_peak(chunker):
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        chunks = sum(1 for _ in iter_paragraph_chunks(iter_paragraphs(fixtures.huge_article_blocks(LARGE_PAGE)),
+                                                      chunker=chunker))
+        return chunks, tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def test_streaming_memory_is_bounded():
+    chunks, peak = _streamed_peak(None)
+    assert chunks > 0
+    assert peak < PEAK_LIMIT
+
+
+def test_token_streaming_memory_is_bounded(token_chunker):
+    chunks, peak = _streamed_peak(token_chunker)
+    assert chunks > 0
+    assert peak < PEAK_LIMIT
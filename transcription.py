@@ -0,0 +1,535 @@
+"""Video transcription with Whisper.
+
+The audio stream of the video is decoded once, straight to 16 kHz mono
+float32 samples in memory (``load_audio``), and the array is transcribed by
+the shared Whisper model; the transcript is wrapped into lines of at most 80
+characters. Nothing is written to disk, so several videos can be transcribed
+at once from the same directory. Wrapping is linear in the transcript's
+length, and ``write_transcript`` wraps a stream of segments straight to a
+file without holding the whole text.
+
+Long recordings can be transcribed in segments (``segmented=True``):
+``speech_segments`` finds the spans that contain speech with an energy-based
+voice activity detector, cutting at silences and never letting a span exceed
+Whisper's 30-second window by much; non-speech is never sent to the model.
+The spans are transcribed in parallel by a pool of worker processes, each with
+its own Whisper model and a share of the CPU threads, and the timestamped
+results are stitched back together in order (``transcribe_segments``). The
+workers are spawned, not forked, so they never inherit a parent whose torch
+threads are already running, and as each holds a copy of the model there are
+at most ``MAX_SEGMENT_WORKERS`` of them unless more are asked for.
+
+``stream_transcript`` is the streaming variant: audio is decoded
+incrementally and transcribed in overlapping windows, and timestamped
+segments are yielded as soon as each window is done, with the text repeated
+in the overlap removed. Given a checkpoint file it records every finished
+window, so a run that fails late in a long recording resumes from the last
+completed offset instead of starting over.
+
+The older file-based steps (``extract_audio`` to MP3, ``convert_audio`` to a
+16 kHz WAV) remain for ``generate_transcript(..., in_memory=False)``, which
+keeps its intermediate files in a private temporary directory. moviepy and
+pydub are only imported by the steps that need them, so the rest of the
+module (and the benchmarks) work without them installed.
+"""
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import instrumentation
+from chunking import word_blocks
+from instrumentation import instrumented, query_timing, span
+from models import get_whisper_model, register, registered_model, set_inference_threads
+
+# Whisper expects 16 kHz mono audio
+SAMPLE_RATE = 16000
+# Voice activity detection works on frames of this many seconds
+VAD_FRAME_SECONDS = 0.03
+# Frames this many dB above the recording's noise floor count as speech
+VAD_MARGIN_DB = 12.0
+# Frames quieter than this are silence whatever the noise floor
+VAD_FLOOR_DB = -60.0
+# Whisper decodes 30-second windows; longer speech spans are cut at their quietest frame
+MAX_SEGMENT_SECONDS = 30.0
+# Seconds of audio decoded per read while streaming
+STREAM_BLOCK_SECONDS = 5.0
+# Every segment worker loads its own Whisper model, so the default pool stops at this many
+MAX_SEGMENT_WORKERS = 4
+
+
+def _ffmpeg_executable():
+    """Returns the ffmpeg on PATH, or the one bundled with moviepy's imageio-ffmpeg, or None."""
+    executable = shutil.which("ffmpeg")
+    if executable:
+        return executable
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return None
+
+
+def _pcm_to_float(frames, channels, rate, sample_rate):
+    samples = np.frombuffer(frames, dtype='<i2')
+    audio = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32) / 32768.0
+    if rate != sample_rate:
+        # Linear interpolation; only used when ffmpeg is unavailable
+        positions = np.arange(int(len(audio) * sample_rate / rate)) * (rate / sample_rate)
+        audio = np.interp(positions, np.arange(len(audio)), audio)
+    return audio.astype(np.float32)
+
+
+def _wav_blocks(audio_file, sample_rate, start=0.0, block_seconds=None):
+    with wave.open(audio_file, 'rb') as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"Only 16-bit WAV can be read without ffmpeg: {audio_file}")
+        channels, rate = f.getnchannels(), f.getframerate()
+        f.setpos(min(f.getnframes(), int(start * rate)))
+        block = int(block_seconds * rate) if block_seconds else f.getnframes()
+        while True:
+            frames = f.readframes(block)
+            if not frames:
+                return
+            yield _pcm_to_float(frames, channels, rate, sample_rate)
+
+
+def _read_wav(audio_file, sample_rate):
+    return np.concatenate(list(_wav_blocks(audio_file, sample_rate)) or [np.zeros(0, np.float32)])
+
+
+# Function to decode the audio of a video or audio file into memory
+@instrumented('load_audio')
+def load_audio(media_file, sample_rate=SAMPLE_RATE):
+    """Decodes media_file's audio stream once, to mono float32 samples in [-1, 1] at sample_rate.
+
+    ffmpeg decodes, downmixes and resamples in a single pass and pipes raw
+    samples back, so no intermediate file is written. Without ffmpeg only
+    16-bit WAV files can be read.
+    """
+    executable = _ffmpeg_executable()
+    if executable is None:
+        if media_file.lower().endswith(".wav"):
+            return _read_wav(media_file, sample_rate)
+        raise RuntimeError("ffmpeg is required to decode audio from " + media_file)
+    command = [executable, "-nostdin", "-threads", "0", "-i", media_file, "-vn",
+               "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {media_file}: {result.stderr.decode(errors='replace')[-500:]}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+# Function to extract audio from video
+@instrumented('extract_audio')
+def extract_audio(video_file, output_audio_file):
+    from moviepy.editor import VideoFileClip
+
+    print("Extracting audio from video...")
+    video = VideoFileClip(video_file)
+    audio = video.audio
+    audio.write_audiofile(output_audio_file)
+    print(f"Audio extracted to {output_audio_file}")
+
+
+# Function to convert audio to WAV format mono PCM with 16kHz sample rate
+@instrumented('convert_audio')
+def convert_audio(input_audio_file, output_audio_file):
+    from pydub import AudioSegment
+
+    print("Converting audio to WAV format mono PCM with 16kHz sample rate...")
+    audio = AudioSegment.from_file(input_audio_file)
+    audio = audio.set_channels(1)  # Convert to mono
+    audio = audio.set_frame_rate(16000)  # Set sample rate to 16kHz
+    audio.export(output_audio_file, format="wav")
+    print(f"Audio converted to {output_audio_file}")
+
+
+# Function to transcribe audio using Whisper
+@instrumented('transcribe')
+def transcribe_audio_whisper(audio, model_name="base"):
+    """Transcribes an audio file, or an array of 16 kHz mono float32 samples from load_audio."""
+    # Whisper is loaded once per process by the shared registry and reused across calls
+    model = get_whisper_model(model_name)
+    result = model.transcribe(audio)
+    return result['text']
+
+
+def _frame_energy_db(audio, frame):
+    count = len(audio) // frame
+    frames = audio[:count * frame].reshape(count, frame).astype(np.float64)
+    return 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+
+def _split_long(start, end, energy, max_frames):
+    """Cuts the frame span [start, end) at its quietest frames until no piece is longer than max_frames."""
+    pieces = []
+    while end - start > max_frames:
+        # Look for the cut in the second half of the window, so pieces do not get too short
+        window = energy[start + max_frames // 2:start + max_frames]
+        cut = start + max_frames // 2 + int(np.argmin(window))
+        pieces.append((start, cut))
+        start = cut
+    pieces.append((start, end))
+    return pieces
+
+
+def speech_segments(audio, sample_rate=SAMPLE_RATE, min_silence=0.5, min_speech=0.25, padding=0.2,
+                    max_segment=MAX_SEGMENT_SECONDS):
+    """Returns (start, end) sample offsets of the spans of audio that contain speech.
+
+    A frame is speech when its energy is VAD_MARGIN_DB above the noise floor
+    (the 10th percentile of frame energies). Speech separated by less than
+    min_silence seconds is kept together, spans shorter than min_speech
+    seconds are dropped as clicks, and every span is padded by padding
+    seconds on both sides so word onsets are not clipped.
+    """
+    frame = int(VAD_FRAME_SECONDS * sample_rate)
+    energy = _frame_energy_db(audio, frame)
+    if not len(energy):
+        return []
+    noise_floor = np.percentile(energy, 10)
+    # In a recording with no pauses the floor is speech itself; stay well below the loudest frames then
+    threshold = max(VAD_FLOOR_DB, min(noise_floor + VAD_MARGIN_DB, energy.max() - 2 * VAD_MARGIN_DB))
+    voiced = np.flatnonzero(energy > threshold)
+    if not len(voiced):
+        return []
+    # Runs of voiced frames, merged across gaps shorter than min_silence
+    gaps = np.flatnonzero(np.diff(voiced) > max(1, int(min_silence / VAD_FRAME_SECONDS)))
+    starts = np.concatenate(([voiced[0]], voiced[gaps + 1]))
+    ends = np.concatenate((voiced[gaps], [voiced[-1]])) + 1
+    pad = int(padding / VAD_FRAME_SECONDS)
+    max_frames = int(max_segment / VAD_FRAME_SECONDS)
+    segments = []
+    for start, end in zip(starts, ends):
+        if end - start < min_speech / VAD_FRAME_SECONDS:
+            continue
+        start, end = max(0, start - pad), min(len(energy), end + pad)
+        if segments and start <= segments[-1][1]:
+            # Padding made this span touch the previous one
+            start = segments.pop()[0]
+        segments.append((start, end))
+    return [(int(start) * frame, min(len(audio), int(end) * frame))
+            for span in segments for start, end in _split_long(*span, energy, max_frames)]
+
+
+def _available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _init_worker(model_name, threads, stand_in):
+    set_inference_threads(threads)
+    # A spawned worker starts with an empty registry, so stand-ins are installed again
+    if stand_in is not None:
+        register("whisper", model_name, stand_in)
+    get_whisper_model(model_name)
+
+
+def _transcribe_segment(samples, model_name, options):
+    result = get_whisper_model(model_name).transcribe(samples, **options)
+    return result['text'], [(piece['start'], piece['end'], piece['text']) for piece in result.get('segments', ())]
+
+
+@instrumented('transcribe')
+def transcribe_segments(audio, model_name="base", workers=None, **options):
+    """Transcribes the speech in audio span by span, in parallel, and returns timestamped segments.
+
+    Returns a list of {'start', 'end', 'text'} dicts (times in seconds from
+    the start of audio) in recording order. With workers=1 the spans are
+    transcribed in this process; otherwise a pool of that many spawned
+    processes (default: one per CPU, at most MAX_SEGMENT_WORKERS) each load
+    the model once and split the CPU threads.
+    Extra options (e.g. language='en', which also skips per-span language
+    detection) are passed to Whisper's transcribe.
+    """
+    spans = speech_segments(audio)
+    if not spans:
+        return []
+    cpus = _available_cpus()
+    workers = min(workers or min(cpus, MAX_SEGMENT_WORKERS), len(spans))
+    pieces = [audio[start:end] for start, end in spans]
+    if workers == 1:
+        results = [_transcribe_segment(piece, model_name, options) for piece in pieces]
+    else:
+        threads = max(1, cpus // workers)
+        initargs = (model_name, threads, registered_model("whisper", model_name))
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=initargs) as pool:
+            results = list(pool.map(_transcribe_segment, pieces, [model_name] * len(pieces),
+                                    [options] * len(pieces)))
+    segments = []
+    for (start, end), (text, timed) in zip(spans, results):
+        offset = start / SAMPLE_RATE
+        if not timed:
+            timed = [(0.0, (end - start) / SAMPLE_RATE, text)]
+        segments.extend({'start': offset + piece_start, 'end': offset + piece_end, 'text': piece_text.strip()}
+                        for piece_start, piece_end, piece_text in timed if piece_text.strip())
+    return segments
+
+
+def segments_text(segments):
+    """Joins transcript segments into plain text, as format_transcript expects."""
+    return " ".join(segment['text'] for segment in segments)
+
+
+def _decode_blocks(media_file, start, sample_rate):
+    """Yields float32 blocks of media_file's audio from start seconds on, as ffmpeg decodes them."""
+    executable = _ffmpeg_executable()
+    if executable is None:
+        if media_file.lower().endswith(".wav"):
+            yield from _wav_blocks(media_file, sample_rate, start, STREAM_BLOCK_SECONDS)
+            return
+        raise RuntimeError("ffmpeg is required to decode audio from " + media_file)
+    command = [executable, "-nostdin", "-ss", str(start), "-i", media_file, "-vn",
+               "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            data = process.stdout.read(int(STREAM_BLOCK_SECONDS * sample_rate) * 4)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+
+
+def audio_windows(media_file, window=30.0, overlap=5.0, start=0.0, sample_rate=SAMPLE_RATE):
+    """Yields (offset seconds, samples, last) for windows of media_file's audio, decoded as needed.
+
+    Each window is window seconds long and starts overlap seconds before the
+    previous one ended; last is True for the window that reaches the end.
+    """
+    size = int(window * sample_rate)
+    hop = size - int(overlap * sample_rate)
+    if hop <= 0:
+        raise ValueError("The overlap must be shorter than the window.")
+    blocks = _decode_blocks(media_file, start, sample_rate)
+    buffer = np.zeros(0, np.float32)
+    offset = start
+    exhausted = False
+    while True:
+        # One sample more than a window tells whether another window follows
+        while len(buffer) <= size and not exhausted:
+            block = next(blocks, None)
+            if block is None:
+                exhausted = True
+            else:
+                buffer = np.concatenate((buffer, block))
+        if not len(buffer):
+            return
+        last = len(buffer) <= size
+        yield offset, buffer[:size], last
+        if last:
+            return
+        buffer = buffer[hop:]
+        offset += hop / sample_rate
+
+
+def _timed_pieces(result, duration):
+    pieces = [(piece['start'], piece['end'], piece['text'],
+               [(word['start'], word['end'], word['word']) for word in piece.get('words') or ()])
+              for piece in result.get('segments', ())]
+    # Without timestamps the text is taken to cover the whole window
+    return pieces or [(0.0, duration, result['text'], [])]
+
+
+def _text_after(start, end, text, words, committed):
+    """Returns the part of a segment's text spoken after committed seconds."""
+    if words:
+        return "".join(word for word_start, word_end, word in words if (word_start + word_end) / 2 >= committed)
+    # Without word timestamps, assume the words are spread evenly over the segment
+    split = text.split()
+    keep = round(len(split) * (end - committed) / (end - start))
+    return " ".join(split[len(split) - keep:]) if keep else ""
+
+
+def _normalized(word):
+    return word.strip(".,;:!?\"'").lower()
+
+
+def _drop_repeated_words(previous, text, longest=12):
+    """Drops the leading words of text that repeat the last words of the previous segment."""
+    words = text.split()
+    tail = [_normalized(word) for word in previous[-longest:]]
+    head = [_normalized(word) for word in words[:longest]]
+    # A single repeated word is as likely to be spoken twice as to be a duplicate
+    for size in range(min(len(tail), len(head)), 1, -1):
+        if tail[-size:] == head[:size]:
+            return " ".join(words[size:])
+    return text
+
+
+def _load_checkpoint(checkpoint, media_file):
+    """Returns (resume offset, committed time, finished, segments) recorded in a checkpoint file."""
+    if not os.path.exists(checkpoint):
+        return 0.0, 0.0, False, []
+    offset, committed, finished = 0.0, 0.0, False
+    segments, pending = [], []
+    with open(checkpoint, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The process died while writing this line
+                break
+            if 'media' in record and record['media'] != media_file:
+                raise ValueError(f"{checkpoint} is the checkpoint of {record['media']}, not {media_file}")
+            if 'segment' in record:
+                pending.append(record['segment'])
+            elif 'offset' in record:
+                # Segments only count once the window that produced them is complete
+                segments += pending
+                pending = []
+                offset, committed, finished = record['offset'], record['committed'], record['finished']
+    return offset, committed, finished, segments
+
+
+def stream_transcript(media_file, model_name="base", window=30.0, overlap=5.0, checkpoint=None, **options):
+    """Yields {'start', 'end', 'text'} transcript segments of media_file while it is being transcribed.
+
+    The audio is transcribed in windows of window seconds overlapping by
+    overlap seconds. A segment that starts in a window's overlap is left to
+    the next window, which sees it whole, and a segment already covered by
+    the previous window is skipped, as are words repeating the end of the
+    previous segment. Word timestamps are requested from Whisper so that a
+    segment straddling the overlap can be cut between words.
+
+    With a checkpoint path, every finished window and its segments are
+    appended to that file; a later call with the same file first yields the
+    recorded segments and then carries on from where it stopped.
+    Extra options are passed to Whisper's transcribe.
+    """
+    start, committed, finished, done = 0.0, 0.0, False, []
+    if checkpoint:
+        start, committed, finished, done = _load_checkpoint(checkpoint, media_file)
+    yield from done
+    if finished:
+        return
+    options.setdefault('word_timestamps', True)
+    model = get_whisper_model(model_name)
+    log = open(checkpoint, 'a', encoding='utf-8') if checkpoint else None
+    try:
+        if log and not done and not start:
+            log.write(json.dumps({'media': media_file}) + "\n")
+        previous = done[-1]['text'].split() if done else []
+        for offset, samples, last in audio_windows(media_file, window, overlap, start):
+            duration = len(samples) / SAMPLE_RATE
+            with span('transcribe', offset=offset):
+                result = model.transcribe(samples, **options)
+            boundary = math.inf if last else offset + window - overlap
+            segments = []
+            for piece_start, piece_end, text, words in _timed_pieces(result, duration):
+                piece_start, piece_end = offset + piece_start, offset + piece_end
+                words = [(offset + word_start, offset + word_end, word) for word_start, word_end, word in words]
+                if piece_start >= boundary:
+                    break
+                if piece_end <= committed:
+                    continue
+                if piece_start < committed:
+                    # The previous window already emitted the beginning of this segment
+                    text = _text_after(piece_start, piece_end, text, words, committed)
+                    piece_start = committed
+                text = _drop_repeated_words(previous, text.strip())
+                if not text:
+                    continue
+                segments.append({'start': piece_start, 'end': piece_end, 'text': text})
+                committed = max(committed, piece_end)
+                previous = text.split()
+            if log:
+                for segment in segments:
+                    log.write(json.dumps({'segment': segment}) + "\n")
+                log.write(json.dumps({'offset': offset + window - overlap, 'committed': committed,
+                                      'finished': last}) + "\n")
+                log.flush()
+            yield from segments
+    finally:
+        if log:
+            log.close()
+
+
+def iter_transcript_lines(transcript, max_length=80):
+    """Yields the lines of a transcript wrapped at max_length characters.
+
+    transcript is the text, or an iterable of texts such as the segments of
+    stream_transcript; words are read lazily and only the current line is held.
+    """
+    if isinstance(transcript, str):
+        transcript = [transcript]
+    current_line = ""
+    for text in transcript:
+        for words in word_blocks(text):
+            for word in words:
+                if len(current_line) + len(word) + 1 > max_length:
+                    yield current_line
+                    current_line = word
+                elif current_line:
+                    current_line += " " + word
+                else:
+                    current_line = word
+    if current_line:
+        yield current_line
+
+
+# Function to add line breaks to transcript
+@instrumented('format_transcript')
+def format_transcript(transcript, max_length=80):
+    # The lines are joined once at the end; growing one string line by line is quadratic on long transcripts
+    return "\n".join(iter_transcript_lines(transcript, max_length))
+
+
+def write_transcript(transcript, path, max_length=80):
+    """Writes a transcript (text or iterable of texts) to path wrapped into lines, as it is produced."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for index, line in enumerate(iter_transcript_lines(transcript, max_length)):
+            f.write(("\n" if index else "") + line)
+
+
+def _transcribe_via_files(video_file, model_name):
+    # Each call gets its own directory, so concurrent jobs never share intermediate files
+    with tempfile.TemporaryDirectory(prefix="transcript_") as directory:
+        temp_audio_file = os.path.join(directory, "temp_audio.mp3")
+        final_audio_file = os.path.join(directory, "final_audio.wav")
+        # Extract audio from video
+        extract_audio(video_file, temp_audio_file)
+        # Convert audio to WAV format mono PCM with 16kHz sample rate
+        convert_audio(temp_audio_file, final_audio_file)
+        print("Transcribing audio file...")
+        return transcribe_audio_whisper(final_audio_file, model_name)
+
+
+# Main function to generate transcript
+def generate_transcript(video_file, model_name="base", in_memory=True, segmented=False, workers=None):
+    with query_timing(video_file, log=False) as timing:
+        if segmented:
+            # Only the speech is transcribed, a span per worker process at a time
+            print("Decoding audio from video...")
+            audio = load_audio(video_file)
+            print("Transcribing speech segments...")
+            transcript = segments_text(transcribe_segments(audio, model_name, workers))
+        elif in_memory:
+            # Decode the audio track once and hand the samples to Whisper directly
+            print("Decoding audio from video...")
+            audio = load_audio(video_file)
+            print("Transcribing audio...")
+            transcript = transcribe_audio_whisper(audio, model_name)
+        else:
+            transcript = _transcribe_via_files(video_file, model_name)
+
+        # Format transcript with line breaks
+        formatted_transcript = format_transcript(transcript)
+
+    if instrumentation.enabled:
+        print(timing.report())
+    return formatted_transcript
@@ -0,0 +1,210 @@
+"""Multi-process summarization: N spawned workers sharing one copy of the weights.
+
+One process runs one ``generate`` at a time, and splitting a node's cores
+between threads of the same process stops helping long before 32 cores. A
+``SummarizerPool`` starts ``workers`` processes from a parent that has already
+loaded the summarizer. The model's parameters are moved to shared memory
+first (``share_memory``), and torch pickles shared tensors as handles to
+those pages, so every worker reads the same weights and the pool costs one
+copy, not N. Each worker is pinned to its own slice of the CPUs with a
+matching torch thread count.
+
+The pool stands in for the summarizer it wraps: pass it anywhere a
+summarization pipeline goes (``summarize_text``, ``summarize_articles``,
+``Pipeline``). ``summarization.run_batches`` hands it all the batches of a
+call at once, and it spreads them over the workers through a request queue,
+collecting the summaries from a response queue.
+
+Workers are spawned rather than forked: a child forked after torch or the
+tokenizers have started their thread pools can hang, as the segment workers
+of ``transcription`` do. An ONNX Runtime session cannot be pickled, so with
+the ``onnx`` backend each worker loads its own copy of the model by name.
+
+The ``SUMMARIZER_WORKERS`` environment variable sets the number of workers
+``get_shared_summarizer`` starts; with 0 or 1 it returns the plain summarizer.
+"""
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from models import SUMMARIZATION_MODEL, get_summarizer, set_inference_threads
+from summarization import _run_batch
+
+DEFAULT_WORKERS = int(os.environ.get("SUMMARIZER_WORKERS", 0))
+# Seconds between checks that the workers are still alive while waiting for results
+HEALTH_CHECK_INTERVAL = 1.0
+
+
+def _available_cpus():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def _share_weights(summarizer):
+    model = getattr(summarizer, 'model', None)
+    if hasattr(model, 'share_memory'):
+        try:
+            model.share_memory()
+        except RuntimeError as e:
+            # Some quantized modules cannot move their packed weights; each worker then gets its own copy
+            logging.warning(f"Model weights stay private to the parent process: {e}")
+
+
+def _worker_main(summarizer, model, threads, cpus, requests, responses):
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    set_inference_threads(threads)
+    if summarizer is None:
+        summarizer = get_summarizer(*model)
+    while True:
+        item = requests.get()
+        if item is None:
+            return
+        request_id, batch, max_length, min_length = item
+        try:
+            responses.put((request_id, _run_batch(summarizer, batch, max_length, min_length), None))
+        except Exception as e:
+            # The exception may not survive pickling, so its description is sent instead
+            responses.put((request_id, None, f"{type(e).__name__}: {e}"))
+
+
+class SummarizerPool:
+    def __init__(self, summarizer, workers=None, threads_per_worker=None, model_name=None):
+        cpus = _available_cpus()
+        self.summarizer = summarizer
+        self.workers = workers or len(cpus)
+        self.threads_per_worker = threads_per_worker or max(1, len(cpus) // self.workers)
+        # Looks like the wrapped pipeline to chunkers, caches and summarizer_name
+        self.tokenizer = getattr(summarizer, 'tokenizer', None)
+        self.model = getattr(summarizer, 'model', None)
+        if hasattr(summarizer, 'inference_backend'):
+            self.inference_backend = summarizer.inference_backend
+        self._ids = itertools.count()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        model = None
+        if getattr(summarizer, 'inference_backend', None) == "onnx":
+            if model_name is None:
+                raise ValueError("A pool of ONNX summarizers needs the model_name each worker loads.")
+            model, summarizer_arg = (model_name, "onnx"), None
+        else:
+            _share_weights(summarizer)
+            summarizer_arg = summarizer
+        context = multiprocessing.get_context("spawn")
+        self._requests = context.Queue()
+        self._responses = context.Queue()
+        self._processes = []
+        for index in range(self.workers):
+            start = index * self.threads_per_worker
+            # Workers get disjoint CPU sets while there are enough CPUs, and share them after that
+            worker_cpus = cpus[start:start + self.threads_per_worker] if start < len(cpus) else None
+            process = context.Process(
+                target=_worker_main, name=f"summarizer-{index}", daemon=True,
+                args=(summarizer_arg, model, self.threads_per_worker, worker_cpus, self._requests,
+                      self._responses))
+            process.start()
+            self._processes.append(process)
+        self._collector = threading.Thread(target=self._collect, name="summarizer-pool-results", daemon=True)
+        self._collector.start()
+
+    def _collect(self):
+        while True:
+            try:
+                item = self._responses.get(timeout=HEALTH_CHECK_INTERVAL)
+            except queue.Empty:
+                if self._closed:
+                    return
+                dead = [process.name for process in self._processes if not process.is_alive()]
+                if dead:
+                    self._fail_pending(RuntimeError(f"Summarizer worker(s) {', '.join(dead)} died"))
+                continue
+            if item is None:
+                return
+            request_id, summaries, error = item
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(summaries)
+            else:
+                future.set_exception(RuntimeError(error))
+
+    def _fail_pending(self, error):
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.set_exception(error)
+
+    def submit(self, batch, max_length, min_length):
+        """Queues one batch for the workers and returns a Future of its summaries."""
+        if self._closed:
+            raise RuntimeError("The summarizer pool is closed.")
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            self._futures[request_id] = future
+        self._requests.put((request_id, batch, max_length, min_length))
+        return future
+
+    def run_batches(self, batches):
+        """Runs (chunks, max_length, min_length) batches across the workers and returns the summaries in order."""
+        futures = [self.submit(batch, max_length, min_length) for batch, max_length, min_length in batches]
+        return [future.result() for future in futures]
+
+    def __call__(self, texts, max_length=130, min_length=30, do_sample=False, batch_size=None):
+        """Summarizes texts like the pipeline does, spreading batches of batch_size over the workers."""
+        batch_size = batch_size or len(texts) or 1
+        batches = [(texts[i:i + batch_size], max_length, min_length) for i in range(0, len(texts), batch_size)]
+        return [{'summary_text': summary} for summaries in self.run_batches(batches) for summary in summaries]
+
+    def close(self):
+        """Stops the workers once they have finished the batches already queued."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._processes:
+            self._requests.put(None)
+        for process in self._processes:
+            process.join()
+        self._responses.put(None)
+        self._collector.join()
+        self._fail_pending(RuntimeError("The summarizer pool was closed."))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_summarizer_pool(model_name=SUMMARIZATION_MODEL, workers=None, backend=None):
+    """Returns the process-wide worker pool for a summarization model, starting it on first use."""
+    key = (model_name, workers, backend)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SummarizerPool(get_summarizer(model_name, backend=backend), workers,
+                                                model_name=model_name)
+            atexit.register(pool.close)
+        return pool
+
+
+def get_shared_summarizer(model_name=SUMMARIZATION_MODEL, workers=DEFAULT_WORKERS):
+    """Returns a worker pool when more than one worker is configured, else the in-process summarizer."""
+    if workers and workers > 1:
+        return get_summarizer_pool(model_name, workers)
+    return get_summarizer(model_name)
@@ -0,0 +1,45 @@
+"""Incremental writers for summarized resources.
+
+Each record is written and flushed as soon as it arrives, so the output file
+grows while a query is still running instead of appearing all at once.
+"""
+import json
+
+
+def write_text_record(f, resource):
+    f.write(f"Site: {resource['site']}\n")
+    f.write(f"URL: {resource['url']}\n")
+    f.write(f"Summary: {resource['summary']}\n")
+    if resource.get('duplicate_of'):
+        f.write(f"Duplicate of: {resource['duplicate_of']}\n")
+    if resource.get('alternates'):
+        f.write(f"Also at: {', '.join(resource['alternates'])}\n")
+    f.write("\n")  # Add a newline for better readability
+
+
+def write_jsonl_record(f, resource):
+    f.write(json.dumps(resource, ensure_ascii=False) + "\n")
+
+
+record_writers = {
+    "text": write_text_record,
+    "jsonl": write_jsonl_record,
+}
+
+
+def write_resources(resources, file_path, output_format="text"):
+    """Writes records from any iterable to file_path, flushing after each one.
+
+    Returns the number of records written.
+    """
+    if output_format not in record_writers:
+        raise ValueError(f"Invalid output_format. Use one of: {', '.join(record_writers)}.")
+    write_record = record_writers[output_format]
+
+    count = 0
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for resource in resources:
+            write_record(f, resource)
+            f.flush()
+            count += 1
+    return count